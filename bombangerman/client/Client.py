@@ -1,8 +1,7 @@
-import json
+import select
 import socket
 import argparse
 import time
-import zlib
 
 from Player import Player
 from enum import Enum
@@ -10,7 +9,11 @@ import pygame
 import re
 import yaml
 
+from Prediction import MovementPredictor, passable_map, player_speed
 from View import View
+from utils import FrameCompressor, FrameReader
+
+PACKET_SIZE = 4096
 
 class Mode(Enum):
     MENU = 0
@@ -20,6 +23,8 @@ class Mode(Enum):
 class Client:
     def __init__(self, port=5555, anger_button=True):
         self.client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.frames = FrameReader()
+        self.compressor = FrameCompressor()
         self.mode = Mode.MENU
         self.port = port
         self.id = None
@@ -34,6 +39,7 @@ class Client:
         self.crushing_boxes = dict()
         self.power_ups = dict()
         self.active_taunts = dict()
+        self.predictor = MovementPredictor()  # moves this client's player before the server confirms it
         self.anger_button = anger_button # activate a button that is saved in file
         if self.anger_button:
             self.timeout = 0
@@ -51,6 +57,7 @@ class Client:
         playing = False
 
         menu = True
+        status = ""  # msg of the last server message
         ip_str = ""
         with open("config.yaml", 'r') as stream:
             try:
@@ -105,100 +112,117 @@ class Client:
             run = self.handle_pygame_events()
 
             # Communicate with Server to determine course of action
-            # The server will send a msg string classifying the package
-            resp = zlib.decompress(self.client.recv(4096)).decode()
-            resp = json.loads(resp)
-            msg = resp.get("msg", None)
+            # The server will send a msg string classifying each message.
+            # In-game, the server pushes the events of every server tick: handle all that arrived since the last frame.
+            # Otherwise, wait for the next message of the handshake.
+            for resp in self.receive_messages(block=not playing):
+                msg = resp.get("msg", None)
+                status = msg
+
+                if msg == None or msg == "CLOSE":
+                    self.mode = Mode.MENU
+                    run = False
+                    break
+
+                elif msg == "STARTUP":
+                    self.mode = Mode.MENU
+                    self.send_idle_msg()
+
+                elif msg == "WAITING":
+                    self.send_idle_msg()
+
+                elif msg == "GAME_OVER":
+                    winner_id = resp["id"]  # None if the match ended without a winner
+                    if winner_id is not None:
+                        self.players[not winner_id].immortal = True
+                        self.players[winner_id].immortal = False
+                        self.players[winner_id].facing = 0
+                    for i in range(2):
+                        self.players[i].inverted_keyboard = False
+                        self.players[i].autowalk = False
+                        self.players[i].slimey = False
+                    self.mode = Mode.GAME_OVER
+                    self.explosions = set()
+                    self.boxes = set()
+                    self.bombs = dict()
+                    self.inactive_traps = dict()
+                    self.active_traps = set()
+                    self.falling_boxes = dict()
+                    self.crushing_boxes = dict()
+                    self.active_taunts = dict()
+                    self.power_ups = dict()
+                    playing = False
+                    waiting_screen = True
+                    while waiting_screen:
+                        clock.tick(30)
+                        if winner_id is None:
+                            color = (255,255,255)
+                            s = "the match ended without a winner \n \n press 'R' to play again"
+                        else:
+                            winner_color = "blue" if winner_id == 0 else "red"
+                            color = (0,0,255) if winner_id == 0 else (255,0,0)
+                            s = "the " + winner_color + " player won! \n \n press 'R' to play again"
+                        self.view.draw_game_over_screen(self.players, self.id, s, color)
+                        _ = pygame.event.get()
+                        keys = pygame.key.get_pressed()
+                        if keys[pygame.K_r]:
+                            self.mode = Mode.MENU
+                            waiting_screen = False
+                        #self.view.draw_players(resp["you"], resp["other"], self.id)
+                        self.view.update()
+                    self.send_message({"msg": "again"})
+
+                elif msg == "GAME_START":
+                    if self.field == None or self.players == None:
+                        raise ValueError("Server sent",msg,"when Client has not Map or Player data.")
+                    if not playing:
+                        playing = True
+                        self.mode = Mode.GAME
+                        self.predictor.reset(self.players[self.id])
+                    else:
+                        raise ValueError("Server sent",msg,"when Client is already in-game.")
+                    self.send_idle_msg() # From now on, one action is sent per client tick
+
+                elif msg == "GAME_RUNNING":
+                    if not playing:
+                        raise ValueError("Server sent",msg,"when Client is not in-game.")
+                    self.handle_server_events(resp)
+                    self.predictor.reconcile(self.players[self.id], *self.passable_map())
+
+                elif msg == "MAP_DATA":
+                    self.id = resp.get("id", self.id)  # map updates during the game carry no ID
+                    self.field = resp["f"]
+                    for x,y,ticks in resp["t"]:
+                        self.inactive_traps[(x,y)] = [ticks,ticks]
+                    if not playing:
+                        self.send_idle_msg()
+
+                elif msg == "PLAYER_DATA":
+                    player_data = resp["p"]
+                    self.update_player_data(player_data)
+                    self.send_idle_msg()
+
+                elif msg == "EXIT":
+                    run = False
+                    break
+                else:
+                    raise NotImplementedError("Server msg",msg,"handling is not implemented in the .run() method of the Client")
 
-            if msg == None or msg == "CLOSE":
-                self.mode = Mode.MENU
-                run = False
+            if not run:
                 continue
 
-            elif msg == "STARTUP":
-                self.mode = Mode.MENU
-                self.send_idle_msg()
-
-            elif msg == "WAITING":
-                self.send_idle_msg()
-
-            elif msg == "GAME_OVER":
-                winner_id = resp["id"]
-                self.players[not winner_id].immortal = True
-                self.players[winner_id].immortal = False
-                self.players[winner_id].facing = 0
-                for i in range(2):
-                    self.players[i].inverted_keyboard = False
-                    self.players[i].autowalk = False
-                    self.players[i].slimey = False
-                self.mode = Mode.GAME_OVER
-                self.explosions = set()
-                self.boxes = set()
-                self.bombs = dict()
-                self.inactive_traps = dict()
-                self.active_traps = set()
-                self.falling_boxes = dict()
-                self.crushing_boxes = dict()
-                self.active_taunts = dict()
-                self.power_ups = dict()
-                playing = False
-                waiting_screen = True
-                while waiting_screen:
-                    clock.tick(30)
-                    winner_color = "blue" if resp["id"] == 0 else "red"
-                    color = (0,0,255) if resp["id"] == 0 else (255,0,0)
-                    s = "the " + winner_color + " player won! \n \n press 'R' to play again"
-                    self.view.draw_game_over_screen(self.players, self.id, s, color)
-                    _ = pygame.event.get()
-                    keys = pygame.key.get_pressed()
-                    if keys[pygame.K_r]:
-                        self.mode = Mode.MENU
-                        waiting_screen = False
-                    #self.view.draw_players(resp["you"], resp["other"], self.id)
-                    self.view.update()
-                self.client.send(str.encode(json.dumps({"msg": "again"})))
-
-            elif msg == "GAME_START":
-                if self.field == None or self.players == None:
-                    raise ValueError("Server sent",msg,"when Client has not Map or Player data.")
-                if not playing:
-                    playing = True
-                    self.mode = Mode.GAME
-                else:
-                    raise ValueError("Server sent",msg,"when Client is already in-game.")
-                self.send_idle_msg() # Sends 2x to switch roles of initiative with the server
-                self.send_action("wait")
-
-            elif msg == "GAME_RUNNING":
-                if not playing:
-                    raise ValueError("Server sent",msg,"when Client is not in-game.")
+            if playing:
                 action = self.handle_user_input()
-                self.handle_server_events(resp)
-                self.send_action(action)
-
-            elif msg == "MAP_DATA":
-                self.id = resp["id"]
-                self.field = resp["f"]
-                for x,y,ticks in resp["t"]:
-                    self.inactive_traps[(x,y)] = [ticks,ticks]
-                self.send_idle_msg()
-
-            elif msg == "PLAYER_DATA":
-                player_data = resp["p"]
-                self.update_player_data(player_data)
-                self.send_idle_msg()
-
-            elif msg == "EXIT":
-                run = False
-                continue
-            else:
-                raise NotImplementedError("Server msg",msg,"handling is not implemented in the .run() method of the Client")
+                opponent_anger = self.players[not self.id].anger
+                seq = self.predictor.predict(self.players[self.id], action, player_speed(opponent_anger),
+                                             *self.passable_map())
+                self.send_action(action, seq)
 
             ### DRAW PYGAME SCREEN ###
 
             if self.mode == Mode.MENU:
                 #self.view.draw_menu() # TODO
-                self.view.draw_init_screen(resp["msg"], (255,255,255))
+                self.view.draw_init_screen(status, (255,255,255))
             elif self.mode == Mode.GAME:
                 self.update_counters()
                 self.view.draw_game(self.field, self.boxes, self.inactive_traps, self.active_traps, self.power_ups, self.bombs, self.explosions, self.falling_boxes, self.crushing_boxes, self.players, self.active_taunts, self.id, clock)
@@ -207,6 +231,50 @@ class Client:
 
         pygame.quit()
 
+    def spectate(self, address: str, match_id=None):
+        """ Watches matches on the server's spectator port instead of playing.
+            :param match_id: ID of the match to watch first. Defaults to the longest running match
+        """
+        clock = pygame.time.Clock()
+        self.client.connect((address, self.port))
+        self.send_message({"msg": "SPECTATE", "match": match_id})
+        status = "WAITING"
+        run = True
+        while run:
+            clock.tick(60)
+            run = self.handle_pygame_events()
+            for resp in self.receive_messages(block=False):
+                msg = resp.get("msg", None)
+                if msg == "CLOSE":
+                    run = False
+                    break
+                elif msg == "WAITING":
+                    status = "waiting for a match"
+                elif msg == "PLAYER_DATA":
+                    self.players = []
+                    self.update_player_data(resp["p"])
+                elif msg == "MAP_DATA":
+                    self.field = resp["f"]
+                    for x,y,ticks in resp["t"]:
+                        self.inactive_traps[(x,y)] = [ticks,ticks]
+                    self.mode = Mode.GAME
+                elif msg == "GAME_RUNNING":
+                    self.handle_server_events(resp)
+                elif msg == "GAME_OVER":
+                    if resp["id"] is None:
+                        status = "the match ended without a winner"
+                    else:
+                        status = "the " + ("blue" if resp["id"] == 0 else "red") + " player won!"
+                    self.mode = Mode.MENU
+
+            if self.mode == Mode.GAME:
+                self.update_counters()
+                self.view.draw_game(self.field, self.boxes, self.inactive_traps, self.active_traps, self.power_ups, self.bombs, self.explosions, self.falling_boxes, self.crushing_boxes, self.players, self.active_taunts, 0, clock)
+            else:
+                self.view.draw_init_screen(status, (255,255,255))
+
+        pygame.quit()
+
     def update_counters(self):
         """ Updates all tick counters for the client
         """
@@ -233,12 +301,36 @@ class Client:
             del self.active_taunts[id]
 
 
+    def receive_messages(self, block: bool) -> list:
+        """ Reads everything the server sent so far and returns the complete messages.
+            :param block: wait until at least one message has arrived
+        """
+        while True:
+            readable, _, _ = select.select([self.client], [], [], 0)
+            if not readable and (self.frames.has_message() or not block):
+                break
+            data = self.client.recv(PACKET_SIZE)
+            if not data:
+                self.frames.messages.append({"msg": "CLOSE"})
+                break
+            self.frames.feed(data)
+        messages = list(self.frames.messages)
+        self.frames.messages.clear()
+        return messages
+
+    def send_message(self, data: dict):
+        self.client.sendall(self.compressor.encode(data))
+
     def send_idle_msg(self):
-        self.client.send(str.encode(json.dumps({"msg": "ok"})))
+        self.send_message({"msg": "ok"})
+
+    def send_action(self, action:str, seq:int=None):
+        """ :param seq: sequence number of the action, acknowledged by the server with INPUT_ACK """
+        self.send_message({"id": self.id, "action": action, "seq": seq})
 
-    def send_action(self, action:str):
-        data = {"id": self.id, "action": action}
-        self.client.send(str.encode(json.dumps(data)))
+    def passable_map(self):
+        """ :returns: the passability bitmap of the field and the field's height, for the MovementPredictor """
+        return passable_map(self.field, list(self.boxes) + list(self.bombs) + list(self.crushing_boxes))
 
     def handle_server_events(self, resp:dict):
         for type, data in resp.get("e",[]):
@@ -259,10 +351,13 @@ class Client:
                 self.players[data["id"]].bloody = 32
             elif type == 4:
                 # PLAYER_MOVED
-                p = self.players[data["id"]]
-                p.x = data["x"]
-                p.y = data["y"]
-                p.facing = data["f"]
+                if data["id"] == self.id and self.mode == Mode.GAME:
+                    self.predictor.set_server_state(data["x"], data["y"], data["f"])
+                else:
+                    p = self.players[data["id"]]
+                    p.x = data["x"]
+                    p.y = data["y"]
+                    p.facing = data["f"]
             elif type == 12:
                 # PLAYER_NOT_SLIMEY
                 self.players[data["id"]].slimey = False
@@ -344,6 +439,28 @@ class Client:
                 # PLAYER_AUTOWALK_OFF
                 self.players[data["id"]].autowalk = False
 
+            elif type == 31:
+                # FIELD_CHANGED
+                self.field[data["x"]][data["y"]] = [data["t"], data["s"]]
+            elif type == 32:
+                # RESYNC, followed by events that rebuild the game state
+                for entities in (self.boxes, self.bombs, self.explosions, self.inactive_traps, self.active_traps,
+                                 self.falling_boxes, self.crushing_boxes, self.power_ups, self.active_taunts):
+                    entities.clear()
+            elif type == 33:
+                # PLAYER_STATE
+                p = self.players[data["id"]]
+                p.x, p.y, p.facing = data["x"], data["y"], data["f"]
+                p.lifes, p.bombs, p.power = data["l"], data["b"], data["p"]
+                p.immortal, p.slimey = data["i"], data["s"]
+                p.inverted_keyboard, p.autowalk = data["k"], data["a"]
+                if data["id"] == self.id and self.mode == Mode.GAME:
+                    self.predictor.set_server_state(p.x, p.y, p.facing)
+            elif type == 34:
+                # INPUT_ACK
+                if data["id"] == self.id:
+                    self.predictor.acknowledge(data["s"])
+
     def handle_user_input(self):
         # get pressed key
         keys = pygame.key.get_pressed()
@@ -411,10 +528,18 @@ if __name__ == '__main__':
     # Parsing the command
     pygame.init()
     parser = argparse.ArgumentParser()
-    parser.add_argument("-p", "--port", help="Port of the game server to connect to. Defaults to 5555.", default=5555,
-                        type=int)
-    args = vars(parser.parse_args())
-
-    # Game Client
-    client = Client(**args)
-    client.run()
+    parser.add_argument("-p", "--port", help="Port of the game server to connect to. Defaults to 5555, "
+                                             "or 5557 when spectating.", default=None, type=int)
+    parser.add_argument("-s", "--spectate", help="Watch matches at this server address instead of playing.",
+                        default=None)
+    parser.add_argument("-m", "--match", help="ID of the match to watch. Defaults to the longest running match.",
+                        default=None, type=int)
+    args = parser.parse_args()
+
+    if args.spectate:
+        client = Client(port=args.port or 5557, anger_button=False)
+        client.spectate(args.spectate, args.match)
+    else:
+        # Game Client
+        client = Client(port=args.port or 5555)
+        client.run()
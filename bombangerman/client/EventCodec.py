@@ -0,0 +1,114 @@
+import struct
+from typing import List, Tuple
+
+# Binary layout of GameEvent streams, shared by server, client and GameReplay.
+# Each event type has one fixed struct layout. Runs of consecutive events of the same type
+# are packed into one array: [type:uint8][count:uint8][count * event struct].
+# Runs are self-delimiting, so payloads of several ticks can simply be concatenated.
+
+RUN_HEADER = struct.Struct("!BB")
+MAX_RUN_LENGTH = 255
+
+TILE = [("x", "b", 1), ("y", "b", 1)]
+PLAYER = [("id", "B", 1)]
+
+# event type value -> [(data key, struct format, scale)]. Scaled values are sent as integers.
+EVENT_SCHEMA = {
+    0: [],  # GENERIC
+    1: [],  # PLAYER_INIT
+    2: PLAYER,  # PLAYER_MORTAL
+    3: PLAYER + [("dmg", "B", 1)],  # PLAYER_DAMAGED
+    4: PLAYER + [("x", "H", 100), ("y", "H", 100), ("f", "B", 1)],  # PLAYER_MOVED
+    5: TILE,  # SPAWN_BOX
+    6: TILE + [("t", "H", 1)],  # SPAWN_BOMB
+    7: TILE,  # SPAWN_EXPLOSION
+    8: TILE,  # UPDATE_TRAP
+    9: TILE,  # REMOVE_BOX
+    10: TILE,  # REMOVE_BOMB
+    11: TILE,  # REMOVE_EXPLOSION
+    12: PLAYER,  # PLAYER_NOT_SLIMEY
+    13: PLAYER,  # PLAYER_SLIMED
+    14: PLAYER,  # WINNER
+    15: TILE + [("t", "H", 1)],  # SPAWN_FALLING_BOX
+    16: TILE,  # REMOVE_FALLING_BOX
+    17: TILE + [("t", "H", 1)],  # SPAWN_CRUSHING_BOX
+    18: TILE,  # REMOVE_CRUSHING_BOX
+    19: PLAYER + [("t", "H", 1)],  # PLAYER_TAUNT
+    20: TILE + [("t", "B", 1)],  # SPAWN_POWER_UP
+    21: TILE,  # REMOVE_POWER_UP
+    22: [("0", "f", None), ("1", "f", None)],  # ANGER_INFO
+    23: TILE,  # ACTIVATE_TRAP
+    24: TILE + [("t", "H", 1)],  # RESET_TRAP
+    25: PLAYER,  # PLAYER_INVERT_KEYBOARD_ON
+    26: PLAYER,  # PLAYER_INVERT_KEYBOARD_OFF
+    27: PLAYER + [("b", "B", 1)],  # PLAYER_CHANGE_BOMBS_COUNT
+    28: PLAYER + [("p", "B", 1)],  # PLAYER_CHANGE_POWER_AMOUNT
+    29: PLAYER,  # PLAYER_AUTOWALK_ON
+    30: PLAYER,  # PLAYER_AUTOWALK_OFF
+    31: TILE + [("t", "B", 1), ("s", "B", 1)],  # FIELD_CHANGED
+    32: [],  # RESYNC
+    33: PLAYER + [("x", "H", 100), ("y", "H", 100), ("f", "B", 1), ("l", "b", 1), ("b", "B", 1), ("p", "B", 1),
+                  ("i", "?", 1), ("s", "?", 1), ("k", "?", 1), ("a", "?", 1)],  # PLAYER_STATE
+    34: PLAYER + [("s", "I", 1)],  # INPUT_ACK
+}
+
+
+class EventLayout:
+    """ The compiled struct layout of one event type """
+    def __init__(self, type: int, fields: list):
+        self.type = type
+        self.keys = tuple(key for key, _, _ in fields)
+        self.scales = tuple(scale for _, _, scale in fields)
+        self.struct = struct.Struct("!" + "".join(fmt for _, fmt, _ in fields))
+        self.scaled = any(scale not in (None, 1) for scale in self.scales)
+
+    def pack_values(self, data: dict) -> tuple:
+        if not self.scaled:
+            return tuple(data[key] for key in self.keys)
+        return tuple(data[key] if scale in (None, 1) else int(round(data[key] * scale))
+                     for key, scale in zip(self.keys, self.scales))
+
+    def to_dict(self, values: tuple) -> dict:
+        if not self.scaled:
+            return dict(zip(self.keys, values))
+        return {key: value if scale in (None, 1) else value / scale
+                for key, value, scale in zip(self.keys, values, self.scales)}
+
+
+LAYOUTS = {type: EventLayout(type, fields) for type, fields in EVENT_SCHEMA.items()}
+
+
+def encode_events(events: List[Tuple[int, dict]]) -> bytes:
+    """ :param events: (type, data_dict) tuples as returned by GameEvent.encode()
+        :returns: the packed events. Order is preserved.
+    """
+    chunks = []
+    i = 0
+    while i < len(events):
+        type = events[i][0]
+        layout = LAYOUTS[type]
+        end = i + 1
+        while end < len(events) and events[end][0] == type and end - i < MAX_RUN_LENGTH:
+            end += 1
+        chunks.append(RUN_HEADER.pack(type, end - i))
+        pack = layout.struct.pack
+        chunks.extend(pack(*layout.pack_values(data)) for _, data in events[i:end])
+        i = end
+    return b"".join(chunks)
+
+
+def decode_events(payload: bytes) -> List[Tuple[int, dict]]:
+    """ :returns: (type, data_dict) tuples, equal to what GameEvent.encode() returned on the server """
+    events = []
+    offset = 0
+    while offset < len(payload):
+        type, count = RUN_HEADER.unpack_from(payload, offset)
+        offset += RUN_HEADER.size
+        layout = LAYOUTS[type]
+        end = offset + count * layout.struct.size
+        if layout.struct.size == 0:
+            events.extend((type, {}) for _ in range(count))
+        else:
+            events.extend((type, layout.to_dict(values)) for values in layout.struct.iter_unpack(payload[offset:end]))
+        offset = end
+    return events
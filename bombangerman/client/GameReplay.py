@@ -1,4 +1,5 @@
 import argparse
+import base64
 from math import sqrt, floor, ceil
 from os import listdir
 import io
@@ -7,6 +8,7 @@ from Player import Player
 import pygame
 import time
 from View import View
+from EventCodec import decode_events
 import matplotlib.pyplot as plt
 import pandas as pd
 import numpy as np
@@ -68,7 +70,9 @@ class GameReplay:
                 self.last_timestamp = float(lines[-1].split(";")[0])
 
         # plot data files
-        data_files = [f for f in replay_files if f not in [GAME_CSV, BUTTONPRESS_CSV] + FACE_FILES]
+        # game_<match>.csv files hold later matches of the same server run
+        data_files = [f for f in replay_files if f not in [GAME_CSV, BUTTONPRESS_CSV] + FACE_FILES
+                      and not f.startswith("game_")]
         self.nr_plots = len(data_files)
         for file in data_files:
             print("FILENAME:", file)
@@ -173,7 +177,11 @@ class GameReplay:
                             continue
                         timestamp = eval(line.split(";")[0])
 
-                        events = eval(line.split(";")[1])
+                        events = line.split(";")[1].strip()
+                        if events.startswith("["):  # recorded before events were packed by EventCodec
+                            events = eval(events)
+                        else:
+                            events = decode_events(base64.b64decode(events))
                         self.handle_events(events)
                     elif i < frame:
                         continue
@@ -358,6 +366,22 @@ class GameReplay:
                 # PLAYER_AUTOWALK_OFF
                 self.players[data["id"]].autowalk = False
 
+            elif type == 31:
+                # FIELD_CHANGED
+                self.field[data["x"]][data["y"]] = [data["t"], data["s"]]
+            elif type == 32:
+                # RESYNC, followed by events that rebuild the game state
+                for entities in (self.boxes, self.bombs, self.explosions, self.inactive_traps, self.active_traps,
+                                 self.falling_boxes, self.crushing_boxes, self.power_ups, self.active_taunts):
+                    entities.clear()
+            elif type == 33:
+                # PLAYER_STATE
+                p = self.players[data["id"]]
+                p.x, p.y, p.facing = data["x"], data["y"], data["f"]
+                p.lifes, p.bombs, p.power = data["l"], data["b"], data["p"]
+                p.immortal, p.slimey = data["i"], data["s"]
+                p.inverted_keyboard, p.autowalk = data["k"], data["a"]
+
     def load_next_image_and_timestamp(self, player_id, opened_handle):
         f = opened_handle
         timestamp = f.readline()
@@ -0,0 +1,176 @@
+from math import ceil, floor
+from typing import Tuple
+
+# Player movement and collision, shared by the server's Game and the client's movement prediction.
+# Both sides must step players the same way, so keep the copies in server/ and client/ identical.
+
+PLAYER_RADIUS = 0.3  # Collision radius, must be 0 < x < 0.5!
+BASE_SPEED = 0.05  # tiles per tick
+MAX_BONUS_SPEED = 0.1  # added at full anger of the opponent
+
+# fraction. 0.0 -> never slide, 1.0 always slide.
+# FRONTAL_SLIDE_THRESHOLD only handles slide when the frontal tile is solid
+# Slides upon entering open frontal tiles along corners of diagonally adjacent walls
+# are not handled by this threshold but instead always happen on collision with the corner.
+FRONTAL_SLIDE_THRESHOLD_FACTOR = 0.1
+
+# used in sliding detection for FRONTAL_SLIDE_THRESHOLD
+# minimum sideways player distance from tile center
+MIN_PLAYER_SIDE_OFFSET = (0.5 - PLAYER_RADIUS) ** 2
+# maximum sideways player distance from tile center
+MAX_PLAYER_SIDE_OFFSET = (0.5 ** 2) + ((0.5 - PLAYER_RADIUS) ** 2)
+# If the player is further away from the tile center than this, sliding will happen upon frontal collision
+FRONTAL_SLIDE_THRESHOLD = ((
+                                   MAX_PLAYER_SIDE_OFFSET - MIN_PLAYER_SIDE_OFFSET) * FRONTAL_SLIDE_THRESHOLD_FACTOR) + MIN_PLAYER_SIDE_OFFSET
+
+DIR = {"right": (1, 0),
+       "left": (-1, 0),
+       "up": (0, -1),
+       "down": (0, 1)}
+
+# facing of a player after moving in each direction, as sent in PLAYER_MOVED
+DOWN = 0
+RIGHT = 1
+UP = 2
+LEFT = 3
+FACINGS = {"down": DOWN, "right": RIGHT, "up": UP, "left": LEFT}
+INVERTED_ACTIONS = {"left": "right", "right": "left", "up": "down", "down": "up"}
+
+# diag_left, diag_right, left, right
+TILE_OFFSETS = {
+    (1, 0): ((1, -1), (1, 1), (0, -1), (0, 1)),
+    (0, 1): ((1, 1), (-1, 1), (1, 0), (-1, 0)),
+    (-1, 0): ((-1, 1), (-1, -1), (0, 1), (0, -1)),
+    (0, -1): ((-1, -1), (1, -1), (-1, 0), (1, 0)),
+}
+
+RIGHT_CORNER_OFFSETS = {
+    (1, 0): (0, 0),
+    (0, 1): (+1, 0),
+    (-1, 0): (+1, +1),
+    (0, -1): (0, +1),
+}
+
+LEFT_CORNER_OFFSETS = {
+    (1, 0): (0, +1),
+    (0, 1): (0, 0),
+    (-1, 0): (+1, 0),
+    (0, -1): (+1, +1),
+}
+
+SLIDE_FACTORS = {
+    (1, 0): {"left": (0, -1), "right": (0, +1)},
+    (0, 1): {"left": (1, 0), "right": (-1, 0)},
+    (-1, 0): {"left": (0, +1), "right": (0, -1)},
+    (0, -1): {"left": (-1, 0), "right": (+1, 0)}
+}
+
+
+# Per direction of DIR, every offset one step of collide() needs, in the order it unpacks them:
+# the direction, the diagonal left and right neighbours of the tile in front, the left and right neighbours
+# of the player's tile, the corners of the diagonal right and left neighbours and the slide left and right
+COLLISION_TABLES = {dir: (*dir, *TILE_OFFSETS[dir][0], *TILE_OFFSETS[dir][1], *TILE_OFFSETS[dir][2],
+                          *TILE_OFFSETS[dir][3], *RIGHT_CORNER_OFFSETS[dir], *LEFT_CORNER_OFFSETS[dir],
+                          *SLIDE_FACTORS[dir]["left"], *SLIDE_FACTORS[dir]["right"])
+                    for dir in TILE_OFFSETS}
+
+# Longest step checked for collisions at once: the gap between a centered player and the edges of its tile.
+# Faster players move in several steps, so no step can pass a tile boundary and the wall behind it at once.
+MAX_STEP = 0.5 - PLAYER_RADIUS
+PLAYER_RADIUS_SQUARED = PLAYER_RADIUS ** 2
+
+
+def distance_squared(p1, p2):
+    return (p1[0] - p2[0]) ** 2 + (p1[1] - p2[1]) ** 2
+
+
+def move_step(x: float, y: float, speed: float, dir: Tuple[int, int], passable, height: int) -> Tuple[float, float]:
+    """ One tick of movement of a player at (x, y) in direction dir, one of the values of DIR.
+        Speeds above MAX_STEP are split into equal steps of at most MAX_STEP, each checked for collisions.
+        :param passable: the passability bitmap of the field, indexed tile x * height + tile y, see TileGrid
+        :param height: the height of the field in tiles
+        :returns: (dx, dy) to move the player by. (0, 0) if a wall blocks it, half a step sideways if it slides
+    """
+    table = COLLISION_TABLES[dir]
+    if speed <= MAX_STEP:
+        return collide(x, y, speed, table, passable, height)
+    steps = ceil(speed / MAX_STEP)
+    step_speed = speed / steps
+    nx, ny = x, y
+    for _ in range(steps):
+        dx, dy = collide(nx, ny, step_speed, table, passable, height)
+        nx += dx
+        ny += dy
+    return nx - x, ny - y
+
+
+def collide(x: float, y: float, speed: float, table: tuple, passable, height: int) -> Tuple[float, float]:
+    """ One step of move_step(), with the COLLISION_TABLES entry of the direction
+        :returns: (dx, dy) to move the player by
+    """
+    (x_dir, y_dir, diag_left_x, diag_left_y, diag_right_x, diag_right_y, side_left_x, side_left_y, side_right_x,
+     side_right_y, right_corner_x, right_corner_y, left_corner_x, left_corner_y, slide_left_x, slide_left_y,
+     slide_right_x, slide_right_y) = table
+    player_tile_x, player_tile_y = (floor(x), floor(y))
+    nx, ny = x + (speed * x_dir), y + (speed * y_dir)
+
+    # 3 Tiles to check: Tile in direction, and left and right of that (viewed in direction of movement)
+    #       □  upper
+    # --> o □  front
+    #       □  lower
+
+    front_x, front_y = player_tile_x + x_dir, player_tile_y + y_dir
+    left_x, left_y = player_tile_x + diag_left_x, player_tile_y + diag_left_y
+    right_x, right_y = player_tile_x + diag_right_x, player_tile_y + diag_right_y
+
+    if not passable[front_x * height + front_y]:
+        if floor(nx + PLAYER_RADIUS * x_dir) != front_x or floor(ny + PLAYER_RADIUS * y_dir) != front_y:
+            return speed * x_dir, speed * y_dir
+        # Collision with frontal wall OR slide along it depending on position.
+        # Compare distance of the player to the center of the tile he is standing on
+        # by getting the vector of the tile center to the player position.
+        # the vector then denotes the slide direction too.
+        #           v-- player pos
+        #    ┌───────┐
+        #    │      T│ <- slide left
+        #    │      F│ <- no slide
+        #    │   x  F│ <- no slide
+        #    │      F│ <- no slide
+        #    │      T│ <- slide right
+        #    └───────┘
+        tile_center_x, tile_center_y = player_tile_x + 0.5, player_tile_y + 0.5
+        player_vector_x, player_vector_y = x - tile_center_x, y - tile_center_y
+        if player_vector_x * player_vector_x + player_vector_y * player_vector_y <= FRONTAL_SLIDE_THRESHOLD:
+            return 0, 0  # Turns the player only
+        # slide, player is at edge. First, get the direction to slide to:
+        forward_vector_x = front_x + 0.5 - tile_center_x
+        forward_vector_y = front_y + 0.5 - tile_center_y
+        if -player_vector_x * forward_vector_y + player_vector_y * forward_vector_x < 0:
+            if passable[(player_tile_x + side_left_x) * height + player_tile_y + side_left_y] \
+                    and passable[left_x * height + left_y]:
+                return speed * 0.5 * slide_left_x, speed * 0.5 * slide_left_y
+        elif passable[(player_tile_x + side_right_x) * height + player_tile_y + side_right_y] \
+                and passable[right_x * height + right_y]:
+            return speed * 0.5 * slide_right_x, speed * 0.5 * slide_right_y
+        return 0, 0
+
+    # Get nearer neighboring tile (left or right neighbour)
+    right_dx, right_dy = nx - (right_x + 0.5), ny - (right_y + 0.5)
+    left_dx, left_dy = nx - (left_x + 0.5), ny - (left_y + 0.5)
+    if right_dx * right_dx + right_dy * right_dy < left_dx * left_dx + left_dy * left_dy:
+        # closer to the right neighboring tile. compare to that.
+        if not passable[right_x * height + right_y]:
+            # If corner would be inside player collision radius: Collision.
+            # player distance to that point < player radius ?
+            corner_dx, corner_dy = right_x + right_corner_x - nx, right_y + right_corner_y - ny
+            if corner_dx * corner_dx + corner_dy * corner_dy < PLAYER_RADIUS_SQUARED:
+                return speed * 0.5 * slide_left_x, speed * 0.5 * slide_left_y
+    elif not passable[left_x * height + left_y]:
+        # player in left half of the tile, check against left neighboring tile's closest corner
+        # If corner would be inside player collision circle: Collision.
+        corner_dx, corner_dy = left_x + left_corner_x - nx, left_y + left_corner_y - ny
+        if corner_dx * corner_dx + corner_dy * corner_dy < PLAYER_RADIUS_SQUARED:
+            return speed * 0.5 * slide_right_x, speed * 0.5 * slide_right_y
+
+    ### ELSE: we move.
+    return speed * x_dir, speed * y_dir
@@ -0,0 +1,98 @@
+from collections import deque
+from typing import Optional, Tuple
+
+from Movement import DIR, FACINGS, INVERTED_ACTIONS, BASE_SPEED, MAX_BONUS_SPEED, move_step
+
+MAX_PREDICTED_INPUTS = 120  # actions kept until the server acknowledges them, about 2 seconds
+WALL = 1  # tile type value of walls in MAP_DATA
+FACING_ACTIONS = {facing: action for action, facing in FACINGS.items()}
+
+
+def passable_map(field: list, blocking_tiles) -> Tuple[bytearray, int]:
+    """ :param field: [x][y] -> [tile type, sprite id], as sent in MAP_DATA
+        :param blocking_tiles: (x, y) of the tiles whose content blocks players: boxes, bombs and crushing boxes
+        :returns: the passability bitmap of the field as the server's TileGrid keeps it, and the field's height
+    """
+    height = len(field[0])
+    passable = bytearray(tile[0] != WALL for column in field for tile in column)
+    for x, y in blocking_tiles:
+        passable[x * height + y] = 0
+    return passable, height
+
+
+def player_speed(opponent_anger: float) -> float:
+    """ :returns: the distance a player moves per tick, see Game.update() """
+    return BASE_SPEED + opponent_anger * MAX_BONUS_SPEED
+
+
+def predict_step(player, x: float, y: float, facing: int, action: str, speed: float, passable,
+                 height: int) -> Tuple[float, float, int]:
+    """ The movement part of the server's Game.player_action()
+        :param player: the local Player, for its inverted keyboard and autowalk effects
+        :returns: the player's x, y and facing after the action
+    """
+    if player.inverted_keyboard and action in INVERTED_ACTIONS:
+        action = INVERTED_ACTIONS[action]
+    if action not in DIR:
+        if not player.autowalk:
+            return x, y, facing
+        action = FACING_ACTIONS[facing]  # the server's last_action is the direction the player faces
+    dx, dy = move_step(x, y, speed, DIR[action], passable, height)
+    return x + dx, y + dy, FACINGS[action]
+
+
+class MovementPredictor:
+    """ Moves the local player as soon as an action is sent instead of after the server's PLAYER_MOVED.
+        Every action is tagged with a sequence number and kept until the server acknowledges it with INPUT_ACK.
+        On each acknowledgement the player is reset to the server's authoritative position, and the actions the
+        server has not applied yet are replayed on top of it. Mispredictions, e.g. against a bomb the client did
+        not know about yet, are corrected this way without taking back the player's later input.
+    """
+    def __init__(self):
+        self.next_seq = 0
+        self.pending = deque(maxlen=MAX_PREDICTED_INPUTS)  # (sequence number, action, speed)
+        self.acked_seq = -1
+        self.server_state: Optional[Tuple[float, float, int]] = None  # x, y, facing as of the acknowledged action
+        self.server_updated = False
+
+    def reset(self, player) -> None:
+        """ Starts predicting from the player's current state, e.g. at the start of a game """
+        self.pending.clear()
+        self.acked_seq = self.next_seq - 1
+        self.server_state = player.x, player.y, player.facing
+        self.server_updated = False
+
+    def predict(self, player, action: str, speed: float, passable, height: int) -> int:
+        """ Applies the action to the local player right away
+            :returns: the action's sequence number, to send along with the action
+        """
+        seq = self.next_seq
+        self.next_seq += 1
+        self.pending.append((seq, action, speed))
+        player.x, player.y, player.facing = predict_step(player, player.x, player.y, player.facing, action, speed,
+                                                         passable, height)
+        return seq
+
+    def set_server_state(self, x: float, y: float, facing: int) -> None:
+        """ The local player's authoritative position, from PLAYER_MOVED or PLAYER_STATE """
+        self.server_state = x, y, facing
+        self.server_updated = True
+
+    def acknowledge(self, seq: int) -> None:
+        """ The server applied all actions up to sequence number seq, from INPUT_ACK """
+        self.acked_seq = seq
+        self.server_updated = True
+
+    def reconcile(self, player, passable, height: int) -> None:
+        """ Moves the player to the server's position plus the actions the server has not applied yet.
+            Call after handling the server's events, before predicting the next action.
+        """
+        if not self.server_updated or self.server_state is None:
+            return
+        self.server_updated = False
+        while self.pending and self.pending[0][0] <= self.acked_seq:
+            self.pending.popleft()
+        x, y, facing = self.server_state
+        for _, action, speed in self.pending:
+            x, y, facing = predict_step(player, x, y, facing, action, speed, passable, height)
+        player.x, player.y, player.facing = x, y, facing
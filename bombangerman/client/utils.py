@@ -1,6 +1,178 @@
 import json
+import struct
+import time
 import zlib
+from collections import deque
+from typing import Optional
+
+from EventCodec import decode_events
+
+# Every message on a player connection is one frame: a header with the payload length
+# and the payload type, followed by the payload itself.
+FRAME_HEADER = struct.Struct("!IB")  # payload length, frame type
+FRAME_JSON = 0  # uncompressed JSON
+FRAME_ZLIB_JSON = 1  # zlib compressed JSON
+FRAME_EVENTS = 2  # the GameEvents of one or more ticks, packed by EventCodec
+FRAME_DEFLATE = 3  # [frame type:uint8][payload] compressed on the connection's zlib stream
+FRAME_ZLIB_EVENTS = 4  # zlib compressed FRAME_EVENTS payload that does not depend on earlier frames
+CLIENT_FRAME_TYPES = (FRAME_JSON, FRAME_ZLIB_JSON, FRAME_DEFLATE)  # the frame types players and spectators send
+MAX_FRAME_SIZE = 16 * 1024 * 1024
+COMPRESSION_THRESHOLD = 96  # payloads in bytes below this are sent uncompressed
 
 
 def compress(data):
     return zlib.compress(str.encode(json.dumps(data)))
+
+
+def encode_frame(data, compressed=True) -> bytes:
+    """ :returns: the frame holding the JSON serialisation of data, zlib compressed or not """
+    if compressed:
+        return frame(FRAME_ZLIB_JSON, compress(data))
+    return frame(FRAME_JSON, str.encode(json.dumps(data)))
+
+
+def frame(frame_type: int, payload: bytes) -> bytes:
+    return FRAME_HEADER.pack(len(payload), frame_type) + payload
+
+
+def event_frame(packed_events: bytes) -> bytes:
+    """ :returns: a frame of packed events that decodes on its own, compressed if it is large enough.
+                  Unlike FrameCompressor frames, the same bytes can be written to any number of connections.
+    """
+    if len(packed_events) < COMPRESSION_THRESHOLD:
+        return frame(FRAME_EVENTS, packed_events)
+    return frame(FRAME_ZLIB_EVENTS, zlib.compress(packed_events))
+
+
+class FrameError(ValueError):
+    """ A frame that can not be read: oversized, of a type the reader does not accept, or with a corrupt payload """
+
+
+def inflate(payload: bytes) -> bytes:
+    """ :returns: the zlib compressed payload. Raises FrameError if it inflates beyond MAX_FRAME_SIZE """
+    decompressor = zlib.decompressobj()
+    data = decompressor.decompress(payload, MAX_FRAME_SIZE)
+    if decompressor.unconsumed_tail:
+        raise FrameError("Frame inflates beyond the maximum frame size")
+    if not decompressor.eof:
+        raise FrameError("Truncated zlib stream")
+    return data
+
+
+def decode_payload(frame_type: int, payload: bytes):
+    if frame_type == FRAME_EVENTS:
+        return {"msg": "GAME_RUNNING", "e": decode_events(payload)}
+    if frame_type == FRAME_ZLIB_EVENTS:
+        return {"msg": "GAME_RUNNING", "e": decode_events(inflate(payload))}
+    if frame_type == FRAME_ZLIB_JSON:
+        payload = inflate(payload)
+    elif frame_type != FRAME_JSON:
+        raise ValueError("Unknown frame type", frame_type)
+    return json.loads(payload.decode())
+
+
+class FrameCompressor:
+    """ Compresses the frames sent on one connection with a single zlib stream.
+        Each frame is flushed with Z_SYNC_FLUSH, so the receiver can decode it right away while
+        later frames still profit from the keys and values seen in earlier ones.
+        Frames with payloads below the threshold are sent as they are, since compressing
+        them costs more CPU time than the few bytes it saves.
+    """
+    def __init__(self, threshold: int = COMPRESSION_THRESHOLD, level: int = zlib.Z_DEFAULT_COMPRESSION):
+        self.threshold = threshold
+        self.compressor = zlib.compressobj(level)
+        self.frames = 0
+        self.compressed_frames = 0
+        self.raw_bytes = 0  # payload bytes before compression
+        self.sent_bytes = 0  # frame bytes after compression, with headers
+        self.cpu_ns = 0  # CPU time spent compressing
+
+    def frame(self, frame_type: int, payload: bytes) -> bytes:
+        """ :returns: the frame to send for the payload, compressed if it is large enough """
+        self.frames += 1
+        self.raw_bytes += len(payload)
+        if len(payload) < self.threshold:
+            data = frame(frame_type, payload)
+        else:
+            start = time.thread_time_ns()
+            compressed = self.compressor.compress(bytes((frame_type,))) + self.compressor.compress(payload) \
+                + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+            self.cpu_ns += time.thread_time_ns() - start
+            self.compressed_frames += 1
+            data = frame(FRAME_DEFLATE, compressed)
+        self.sent_bytes += len(data)
+        return data
+
+    def encode(self, data) -> bytes:
+        """ :returns: the frame holding the JSON serialisation of data """
+        return self.frame(FRAME_JSON, str.encode(json.dumps(data)))
+
+    def ratio(self) -> float:
+        """ :returns: raw payload bytes per sent byte. Above 1 means compression pays off """
+        return self.raw_bytes / self.sent_bytes if self.sent_bytes else 1.0
+
+    def stats(self) -> dict:
+        return {"frames": self.frames, "compressed_frames": self.compressed_frames, "raw_bytes": self.raw_bytes,
+                "sent_bytes": self.sent_bytes, "ratio": round(self.ratio(), 3), "cpu_ms": self.cpu_ns / 1e6}
+
+
+class FrameReader:
+    """ Reassembles frames from a byte stream. TCP may split a frame across reads or
+        deliver several frames in one read, so feed it whatever recv returned
+        and pop the complete messages.
+    """
+    def __init__(self, frame_types: Optional[tuple] = None):
+        """ :param frame_types: the frame types to accept, e.g. CLIENT_FRAME_TYPES. None accepts all of them """
+        self.frame_types = frame_types
+        self.buffer = bytearray()
+        self.messages = deque()
+        self.decompressor = zlib.decompressobj()  # the sender's FrameCompressor stream
+        self.cpu_ns = 0  # CPU time spent decompressing
+
+    def feed(self, data: bytes) -> None:
+        """ Raises FrameError for a frame that can not be read. The stream can not be read any further after it """
+        self.buffer += data
+        offset = 0
+        while len(self.buffer) - offset >= FRAME_HEADER.size:
+            length, frame_type = FRAME_HEADER.unpack_from(self.buffer, offset)
+            if length > MAX_FRAME_SIZE:
+                raise FrameError("Frame of", length, "bytes exceeds the maximum frame size")
+            end = offset + FRAME_HEADER.size + length
+            if len(self.buffer) < end:
+                break
+            payload = bytes(self.buffer[offset + FRAME_HEADER.size:end])
+            try:
+                message = self.decode(frame_type, payload)
+            except FrameError:
+                raise
+            except (KeyError, IndexError, struct.error, zlib.error, ValueError) as e:
+                raise FrameError("Malformed frame of type", frame_type, e) from e
+            if not isinstance(message, dict):
+                raise FrameError("Frame of type", frame_type, "holds no message")
+            self.messages.append(message)
+            offset = end
+        del self.buffer[:offset]
+
+    def decode(self, frame_type: int, payload: bytes):
+        self.check_type(frame_type)
+        if frame_type == FRAME_DEFLATE:
+            start = time.thread_time_ns()
+            payload = self.decompressor.decompress(payload, MAX_FRAME_SIZE)
+            self.cpu_ns += time.thread_time_ns() - start
+            if self.decompressor.unconsumed_tail:  # a small frame must not inflate without bound
+                raise FrameError("Deflate frame inflates beyond the maximum frame size")
+            frame_type, payload = payload[0], payload[1:]
+            if frame_type == FRAME_DEFLATE:
+                raise FrameError("Deflate frame inside a deflate frame")
+            self.check_type(frame_type)
+        return decode_payload(frame_type, payload)
+
+    def check_type(self, frame_type: int) -> None:
+        if self.frame_types is not None and frame_type not in self.frame_types:
+            raise FrameError("Frame type", frame_type, "is not accepted")
+
+    def has_message(self) -> bool:
+        return len(self.messages) > 0
+
+    def pop_message(self):
+        return self.messages.popleft()
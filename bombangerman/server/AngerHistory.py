@@ -0,0 +1,59 @@
+import struct
+from array import array
+
+ANGER_HISTORY_LEN = 400  # ticks of anger values a player's aggregated anger is made of
+ANGER_HISTORY_DECAY_FACTOR = 1 / ANGER_HISTORY_LEN  # fraction every value loses per tick
+HISTORY_STATE = struct.Struct("<iid")  # oldest, ticks_to_resum, total. Packed in front of the values
+
+
+class AngerHistory:
+    """ Aggregated anger of a player: the sum of its last `length` anger values, each decayed
+        by `decay` per tick since it was added, normalised by the sum of a history full of 1.0.
+        The sum is kept running, so adding a value costs the same for any length: every tick the sum
+        decays, gains the new value and loses the value that just left the history.
+        It is summed up from scratch every `length` ticks, so rounding errors can not build up.
+    """
+    def __init__(self, length: int = ANGER_HISTORY_LEN, decay: float = ANGER_HISTORY_DECAY_FACTOR):
+        self.retain = 1 - decay
+        self.values = array("d", [0.]) * length  # ring buffer, the oldest value at index self.oldest
+        self.oldest = 0
+        self.leaving_weight = self.retain ** length  # the weight of a value when it leaves the history
+        self.total = 0.
+        # closed form of the geometric series sum(retain ** i for i in range(length))
+        self.max_total = (1 - self.leaving_weight) / decay if decay else float(length)
+        self.ticks_to_resum = length
+        self.state_size = HISTORY_STATE.size + self.values.itemsize * length
+
+    def add(self, anger: float) -> float:
+        """ :param anger: the player's anger this tick
+            :returns: the aggregated anger, 0.0 to 1.0 for anger values from 0.0 to 1.0
+        """
+        values = self.values
+        oldest = self.oldest
+        self.total = anger + self.retain * self.total - self.leaving_weight * values[oldest]
+        values[oldest] = anger
+        self.oldest = oldest + 1 if oldest + 1 < len(values) else 0
+        self.ticks_to_resum -= 1
+        if self.ticks_to_resum == 0:
+            self.ticks_to_resum = len(values)
+            self.total = 0.
+            for value in values[self.oldest:] + values[:self.oldest]:
+                self.total = self.total * self.retain + value
+        return max(self.total, 0.) / self.max_total  # rounding can leave a tiny negative sum of zeros
+
+    def pack_into(self, buffer: bytearray, offset: int) -> int:
+        """ Packs the state of the history into the buffer, see Game.snapshot()
+            :returns: the offset after the state
+        """
+        HISTORY_STATE.pack_into(buffer, offset, self.oldest, self.ticks_to_resum, self.total)
+        buffer[offset + HISTORY_STATE.size:offset + self.state_size] = self.values
+        return offset + self.state_size
+
+    def unpack_from(self, buffer, offset: int) -> int:
+        """ Restores a state packed by a history of the same length
+            :returns: the offset after the state
+        """
+        self.oldest, self.ticks_to_resum, self.total = HISTORY_STATE.unpack_from(buffer, offset)
+        with memoryview(buffer) as view, memoryview(self.values) as values:
+            values.cast("B")[:] = view[offset + HISTORY_STATE.size:offset + self.state_size]
+        return offset + self.state_size
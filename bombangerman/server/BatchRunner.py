@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+""" Plays scripted matches without any clients, display or pygame, across a pool of processes.
+    For balance sweeps and regression runs on headless machines.
+    Run from this directory: python BatchRunner.py [-n MATCHES] [-w WORKERS] [-o RESULTS.json]
+"""
+import argparse
+import json
+import multiprocessing
+import random
+import time
+from typing import List
+
+from Game import Game
+from Match import NUM_PLAYERS
+
+ACTIONS = ["up", "up", "down", "down", "left", "left", "right", "right", "bomb", "wait", "slime", "taunt"]
+MAX_TICKS = 60 * 60 * 5  # a match still running after 5 minutes of game time is a draw
+
+
+def play_match(seed: int, max_ticks: int = MAX_TICKS) -> dict:
+    """ Plays one match of random players with random anger values. The same seed plays the same match
+        :returns: the match result. "w" is the winner's player ID or None for a draw
+    """
+    game = Game(seed=seed)
+    for _ in range(NUM_PLAYERS):
+        game.create_player()
+    rng = random.Random(seed)
+    start = time.perf_counter()
+    while game.winner is None and game.ticks < max_ticks:
+        for id in range(NUM_PLAYERS):
+            game.player_action(id, rng.choice(ACTIONS))
+        game.raw_angers = [rng.random() for _ in range(NUM_PLAYERS)]
+        game.update()
+    return {"seed": seed, "w": game.winner, "ticks": game.ticks, "seconds": time.perf_counter() - start,
+            "lifes": [player.lifes for player in game.players]}
+
+
+def run_batch(seeds: List[int], workers: int = None, max_ticks: int = MAX_TICKS) -> List[dict]:
+    """ Plays one match per seed, spread over a pool of worker processes (one per core by default)
+        :returns: the match results, in the order of the seeds
+    """
+    with multiprocessing.Pool(workers) as pool:
+        return pool.starmap(play_match, [(seed, max_ticks) for seed in seeds], chunksize=max(1, len(seeds) // 64))
+
+
+def summarize(results: List[dict], seconds: float) -> dict:
+    """ :param seconds: wall clock time of the whole batch """
+    ticks = sum(result["ticks"] for result in results)
+    return {"matches": len(results), "ticks": ticks, "seconds": seconds, "ticks_per_second": ticks / seconds,
+            "ticks_per_second_per_process": ticks / sum(result["seconds"] for result in results),
+            "wins": [sum(result["w"] == id for result in results) for id in range(NUM_PLAYERS)],
+            "draws": sum(result["w"] is None for result in results)}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--matches", help="Number of matches to play. Defaults to 1000.", default=1000, type=int)
+    parser.add_argument("-s", "--seed", help="Seed of the first match. Defaults to 0.", default=0, type=int)
+    parser.add_argument("-w", "--workers", help="Number of worker processes. Defaults to the number of cores.",
+                        default=None, type=int)
+    parser.add_argument("-t", "--max_ticks", help="Ticks after which a match is a draw. Defaults to 5 minutes.",
+                        default=MAX_TICKS, type=int)
+    parser.add_argument("-o", "--output", help="JSON file to write the summary and every match result to.",
+                        default=None)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    results = run_batch(list(range(args.seed, args.seed + args.matches)), args.workers, args.max_ticks)
+    summary = summarize(results, time.perf_counter() - start)
+    print("[BATCH] {matches} matches, {ticks} ticks in {seconds:.1f} s".format(**summary))
+    print("[BATCH] {ticks_per_second:.0f} ticks/s, {ticks_per_second_per_process:.0f} ticks/s per process".format(**summary))
+    print("[BATCH] wins", summary["wins"], "draws", summary["draws"])
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump({"summary": summary, "matches": results}, f)
@@ -0,0 +1,871 @@
+#!/usr/bin/env python3
+""" Benchmarks for the server hot paths.
+    Run from this directory: python Benchmarks.py [benchmark names]. Runs all benchmarks without names.
+    --save writes the results to a JSON baseline, --compare runs the benchmarks of a baseline again
+    and flags the times and sizes that grew by more than --threshold, or by more than their baseline runs spread
+    apart. Runs that now spread further apart than that are reported as noisy.
+    Benchmarks that also time machine_us() are compared relative to it.
+"""
+import argparse
+import copy
+from functools import partial
+import json
+import pickle
+from math import floor
+import random
+import sys
+import time
+import tracemalloc
+import zlib
+
+from Entities import BOX_KIND, BOMB_KIND, EXPLOSION_KIND, FALLING_BOX_KIND, NO_ENTITY
+from EventCodec import encode_events, decode_events
+from Events import EventType, GameEvent
+from Game import Game, DIR, EXPLOSION_DURATION, TIME_TILL_EXPLOSION
+from Movement import (BASE_SPEED, MAX_BONUS_SPEED, MAX_STEP, PLAYER_RADIUS, FRONTAL_SLIDE_THRESHOLD, TILE_OFFSETS,
+                      RIGHT_CORNER_OFFSETS, LEFT_CORNER_OFFSETS, SLIDE_FACTORS, distance_squared, move_step)
+from Tiles import EMPTY_TILE
+from utils import FrameCompressor, FrameReader, compress, frame, FRAME_EVENTS
+
+MOVEMENT_CASES = ("open", "wall", "slide", "corner")
+MACHINE_KEY = "machine_us"
+
+BENCHMARKS = {}
+ACTIONS = ["up", "up", "down", "down", "left", "left", "right", "right", "bomb", "wait", "slime", "taunt"]
+
+
+def benchmark(name):
+    """ Registers a benchmark function. It returns a dict of result name -> value """
+    def register(function):
+        BENCHMARKS[name] = function
+        return function
+    return register
+
+
+def mean_us(function, items) -> float:
+    """ :returns: the mean time of function(item) over all items in microseconds """
+    start = time.perf_counter_ns()
+    for item in items:
+        function(item)
+    return (time.perf_counter_ns() - start) / len(items) / 1000
+
+
+def machine_us() -> float:
+    """ :returns: the mean time of a fixed pure Python workload in microseconds. This machine runs slower by tens of
+                  percent for seconds at a time, so compare() measures the times of benchmarks that also return
+                  this one, as MACHINE_KEY, relative to it
+    """
+    return mean_us(lambda i: sorted(str(i * j) for j in range(50)), range(200))
+
+
+def scripted_game(seed: int = 0) -> Game:
+    game = Game(seed=seed)
+    game.create_player()
+    game.create_player()
+    return game
+
+
+def play_random_ticks(game: Game, ticks: int, seed: int = 0) -> list:
+    """ Plays random actions and anger values.
+        :returns: the encoded events of every tick
+    """
+    rng = random.Random(seed)
+    events = game.events.subscribe(0)
+    recorded = []
+    for _ in range(ticks):
+        for id in range(len(game.players)):
+            game.player_action(id, rng.choice(ACTIONS))
+        game.raw_angers = [rng.random(), rng.random()]
+        game.update()
+        recorded.append([event.encode() for event in events.read()])
+        if game.winner is not None:
+            break
+    return recorded
+
+
+@benchmark("event_codec")
+def bench_event_codec(ticks: int = 3000) -> dict:
+    """ JSON+zlib event messages against the binary EventCodec, per tick and for 10 ticks sent at once """
+    per_tick = play_random_ticks(scripted_game(), ticks)
+    batched = [sum(per_tick[i:i + 10], []) for i in range(0, len(per_tick), 10)]
+    results = {}
+    for label, batches in (("tick", per_tick), ("10_ticks", batched)):
+        json_payloads = [compress({"msg": "GAME_RUNNING", "e": events}) for events in batches]
+        binary_payloads = [encode_events(events) for events in batches]
+        results.update({
+            "json_bytes_per_" + label: sum(map(len, json_payloads)) / len(batches),
+            "json_encode_us_per_" + label: mean_us(lambda events: compress({"msg": "GAME_RUNNING", "e": events}),
+                                                   batches),
+            "json_decode_us_per_" + label: mean_us(lambda payload: json.loads(zlib.decompress(payload).decode()),
+                                                   json_payloads),
+            "binary_bytes_per_" + label: sum(map(len, binary_payloads)) / len(batches),
+            "binary_encode_us_per_" + label: mean_us(encode_events, batches),
+            "binary_decode_us_per_" + label: mean_us(decode_events, binary_payloads),
+        })
+    return results
+
+
+@benchmark("tiles")
+def bench_tiles(ticks: int = 3000, rounds: int = 20) -> dict:
+    """ player_action and explode, the main users of the tile grid """
+    game = scripted_game()
+    rng = random.Random(0)
+    action_ns = 0
+    actions = 0
+    for _ in range(ticks):
+        for id in range(len(game.players)):
+            action = rng.choice(ACTIONS)
+            start = time.perf_counter_ns()
+            game.player_action(id, action)
+            action_ns += time.perf_counter_ns() - start
+            actions += 1
+        game.update()
+        if game.winner is not None:
+            game = scripted_game(actions)
+    explode_ns = 0
+    explosions = 0
+    for seed in range(rounds):
+        game = scripted_game(seed)
+        bombs = [game.entities.spawn(BOMB_KIND, x, y, owner=0, power=3)
+                 for x in range(1, game.width - 1) for y in range(2, game.height - 1)
+                 if game.tiles[x, y].type.value == 0 and not game.tiles[x, y].has_content()]
+        start = time.perf_counter_ns()
+        for bomb in bombs:
+            game.explode(bomb)
+        explode_ns += time.perf_counter_ns() - start
+        explosions += len(bombs)
+    return {"player_action_us": action_ns / actions / 1000, "explode_us": explode_ns / explosions / 1000}
+
+
+@benchmark("timers")
+def bench_timers(ticks: int = 600) -> dict:
+    """ Game.update with and without a falling box on every free tile, none of which lands during the run """
+    results = {}
+    for fill in (False, True):
+        game = scripted_game()
+        game.falling_box_scheduler.spawn_rate = 0
+        if fill:
+            for x in range(game.width):
+                for y in range(game.height):
+                    if game.tiles.is_passable(x, y) and not game.tiles.has_content(x, y):
+                        box = game.entities.spawn(FALLING_BOX_KIND, x, y, 2 * ticks)
+                        game.tiles.set_content(x, y, box)
+                        game.add_falling_box(box)
+        start = time.perf_counter_ns()
+        for _ in range(ticks):
+            game.update()
+        results["update_us_%d_timers" % game.entities.count(FALLING_BOX_KIND)] = \
+            (time.perf_counter_ns() - start) / ticks / 1000
+    return results
+
+
+@benchmark("explosions")
+def bench_explosions(ticks: int = 600) -> dict:
+    """ Game.update with and without an explosion on every free tile, next to a bomb that can not go off """
+    results = {}
+    for fill in (False, True):
+        game = scripted_game()
+        game.falling_box_scheduler.spawn_rate = 0
+        game.place_box(7, 1)
+        game.entities.spawn(BOMB_KIND, 7, 1, owner=0, power=1)  # never due, and no explosion reaches a box
+        if fill:
+            for x in range(game.width):
+                for y in range(game.height):
+                    if game.tiles.is_passable(x, y):
+                        game.add_explosion(x, y, 2 * ticks)
+        start = time.perf_counter_ns()
+        for _ in range(ticks):
+            game.update()
+        results["update_us_%d_explosions" % game.entities.count(EXPLOSION_KIND)] = \
+            (time.perf_counter_ns() - start) / ticks / 1000
+    return results
+
+
+def place_chain(game: Game, power: int) -> int:
+    """ Places a bomb of the given power on every free tile, all going off in the next tick
+        :returns: the number of bombs
+    """
+    entities = game.entities
+    bombs = 0
+    for x in range(game.width):
+        for y in range(game.height):
+            if game.tiles.is_passable(x, y) and not game.tiles.has_content(x, y):
+                bomb = entities.spawn(BOMB_KIND, x, y, owner=bombs % 2, power=power)
+                game.tiles.set_content(x, y, bomb)
+                game.bomb_timers.schedule(bomb, game.ticks + 1)
+                bombs += 1
+    return bombs
+
+
+@benchmark("entities")
+def bench_entities(rounds: int = 10, ticks: int = 1200, layers: int = 32, power: int = 8) -> dict:
+    """ The EntityStore on a late-game board packed with explosions: memory per explosion, Game.update with the
+        board packed, and the ticks a chain reaction of a bomb on every free tile goes off and burns out at.
+        Raises AssertionError if the board does not end up as before the chains, or freed rows are not reused.
+    """
+    results = {"bytes_per_explosion": 0., "update_us_packed": 0., "chain_tick_us": 0., "expire_tick_us": 0.,
+               "explosions_per_chain": 0., "rows": 0.}
+    for seed in range(rounds):
+        game = scripted_game(seed)
+        play_random_ticks(game, ticks, seed)
+        game.falling_box_scheduler.spawn_rate = 0
+        for player in game.players:
+            player.set_immortal_time(10 * EXPLOSION_DURATION)
+        entities = game.entities
+        free_tiles = [(x, y) for x in range(game.width) for y in range(game.height) if game.tiles.is_passable(x, y)]
+
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        for _ in range(layers):
+            for x, y in free_tiles:
+                game.add_explosion(x, y, 2 * EXPLOSION_DURATION)
+        results["bytes_per_explosion"] += ((tracemalloc.get_traced_memory()[0] - before)
+                                           / (layers * len(free_tiles)) / rounds)
+        tracemalloc.stop()
+        results["update_us_packed"] += mean_us(lambda _: game.update(), range(EXPLOSION_DURATION)) / rounds
+        for _ in range(EXPLOSION_DURATION):
+            game.update()
+        assert entities.count(EXPLOSION_KIND) == 0, "packed explosions did not expire, seed %d" % seed
+
+        rows = len(entities.kinds)
+        for _ in range(2):
+            place_chain(game, power)
+            start = time.perf_counter_ns()
+            game.update()
+            results["chain_tick_us"] += (time.perf_counter_ns() - start) / 1000 / rounds / 2
+            results["explosions_per_chain"] += entities.count(EXPLOSION_KIND) / rounds / 2
+            for _ in range(EXPLOSION_DURATION - 2):
+                game.update()
+            start = time.perf_counter_ns()
+            game.update()
+            results["expire_tick_us"] += (time.perf_counter_ns() - start) / 1000 / rounds / 2
+            assert entities.count(EXPLOSION_KIND) + entities.count(BOMB_KIND) == 0, \
+                "chain did not burn out, seed %d" % seed
+        game.tiles.check_passable()
+        # the packed board needed more rows than the chains, which only reuse them
+        assert len(entities.kinds) == rows, "freed rows are not reused, seed %d" % seed
+        results["rows"] += len(entities.kinds) / rounds
+    return results
+
+
+def walk_blast(game: Game, bomb: int) -> None:
+    """ Game.explode before the blast rays were cached: walks each direction tile by tile.
+        The reference bench_blast checks the cached rays against.
+    """
+    power = game.entities.powers[bomb]
+    origin_x, origin_y = game.entities.position(bomb)
+    game.add_explosion(origin_x, origin_y, EXPLOSION_DURATION)
+    tiles = game.tiles
+    for dir in DIR.values():
+        for i in range(power):
+            current_x = int(origin_x + dir[0] * i)
+            current_y = int(origin_y + dir[1] * i)
+            is_box = tiles.content_is(current_x, current_y, BOX_KIND)
+            if tiles.type_is(current_x, current_y, EMPTY_TILE) or is_box:
+                game.add_explosion(current_x, current_y, EXPLOSION_DURATION)
+                game.register_event(GameEvent(EventType.SPAWN_EXPLOSION, {"x": current_x, "y": current_y}))
+                if is_box:
+                    game.entities.remove(tiles.get_content(current_x, current_y))
+                    tiles.set_content(current_x, current_y, NO_ENTITY)
+                    game.register_event(GameEvent(EventType.REMOVE_BOX, {"x": current_x, "y": current_y}))
+                    if tiles.type_is(current_x, current_y, EMPTY_TILE):
+                        power_up = game.power_up_scheduler.tick(current_x, current_y, game)
+                        if power_up is not None:
+                            game.register_event(GameEvent(EventType.SPAWN_POWER_UP, {"x": current_x, "y": current_y,
+                                                                                     "t": game.entities.powers[power_up]}))
+                    break
+            else:
+                break
+
+
+@benchmark("blast")
+def bench_blast(rounds: int = 10, ticks: int = 600) -> dict:
+    """ Game.explode with cached blast rays against walk_blast, on the same played games.
+        Raises AssertionError if they spawn different events or leave different tiles behind.
+    """
+    results = {"walk_us": 0., "rays_us": 0.}
+    for seed in range(rounds):
+        game = scripted_game(seed)
+        play_random_ticks(game, ticks, seed)
+        rng = random.Random(seed)
+        bombs = [(x, y, rng.randint(1, 8)) for x in range(game.width) for y in range(game.height)
+                 if game.tiles.is_passable(x, y)]
+        rng.shuffle(bombs)
+        games = {}
+        for name, explode in (("walk_us", walk_blast), ("rays_us", Game.explode)):
+            played = games[name] = copy.deepcopy(game)
+            events = played.events.subscribe()
+            start = time.perf_counter_ns()
+            for x, y, power in bombs:
+                explode(played, played.entities.spawn(BOMB_KIND, x, y, owner=0, power=power))
+            results[name] += (time.perf_counter_ns() - start) / len(bombs) / 1000 / rounds
+            games[name] = played, [event.encode() for event in events.read()]
+        (walked, walk_events), (rayed, ray_events) = games["walk_us"], games["rays_us"]
+        assert walk_events == ray_events, "blast rays spawn different events than walking the blast, seed %d" % seed
+        assert (walked.tiles.content_kinds == rayed.tiles.content_kinds).all(), "different tiles, seed %d" % seed
+        assert walked.tiles.explosion_counts == rayed.tiles.explosion_counts, "different explosions, seed %d" % seed
+    return results
+
+
+class SweepBombsGame(Game):
+    """ Game with the bomb phase before chain reactions were resolved breadth first: one sweep over all bombs
+        in the order they were placed, setting off the bombs that are due or stand on a burning tile.
+        A bomb caught by the blast of a bomb placed after it was already swept, so it went off one tick later.
+        Here the sweep is repeated until no bomb goes off, which is what Game.explode_due_bombs must match.
+        The reference bench_chains checks Game.explode_due_bombs against.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.late_chain_ticks = 0  # ticks in which the single sweep before breadth first left caught bombs behind
+    def place_bomb(self, id: int):
+        """ Always scheduled TIME_TILL_EXPLOSION ahead. A bomb placed on a burning tile goes off in the sweep """
+        player = self.players[id]
+        x, y = (floor(p) for p in player.get_pos())
+        if self.tiles.has_content(x, y) or player.bombs <= 0:
+            return
+        player.bombs -= 1
+        self.register_event(GameEvent(EventType.PLAYER_CHANGE_BOMBS_COUNT, {"id": id, "b": player.bombs}))
+        bomb = self.entities.spawn(BOMB_KIND, x, y, TIME_TILL_EXPLOSION, owner=id, power=player.power)
+        self.bomb_timers.schedule(bomb, self.ticks + TIME_TILL_EXPLOSION)
+        self.tiles.set_content(x, y, bomb)
+        self.register_event(GameEvent(EventType.SPAWN_BOMB, {"x": x, "y": y, "t": TIME_TILL_EXPLOSION}))
+
+    def explode_due_bombs(self, now: int) -> None:
+        due = set(self.bomb_timers.pop_due(now))
+        if self.sweep_bombs(due) and self.sweep_bombs(due):
+            self.late_chain_ticks += 1
+            while self.sweep_bombs(due):
+                pass
+
+    def sweep_bombs(self, due: set) -> bool:
+        """ :param due: IDs of the bombs that are due this tick
+            :returns: True if a bomb went off
+        """
+        entities = self.entities
+        went_off = False
+        for bomb in entities.ids_of(BOMB_KIND):
+            if entities.kinds[bomb] != BOMB_KIND:  # went off in this sweep, its row was reused by an explosion
+                continue
+            x, y = entities.position(bomb)
+            if bomb not in due:
+                if not self.tiles.has_explosion(x, y):
+                    continue
+                self.bomb_timers.cancel(bomb)
+            owner = entities.owners[bomb]
+            player = self.players[owner]
+            player.bombs += 1
+            self.register_event(GameEvent(EventType.PLAYER_CHANGE_BOMBS_COUNT, {"id": owner, "b": player.bombs}))
+            self.explode(bomb)
+            self.tiles.set_content(x, y, NO_ENTITY)
+            entities.remove(bomb)
+            self.register_event(GameEvent(EventType.REMOVE_BOMB, {"x": x, "y": y}))
+            went_off = True
+        return went_off
+
+
+@benchmark("chains")
+def bench_chains(rounds: int = 10, ticks: int = 1200, area: int = 5) -> dict:
+    """ Game.update with breadth-first chain reactions against SweepBombsGame, on scripted games. Both players
+        keep placing bombs of random power and age on an area x area square, so blasts overlap and catch other
+        bombs, and now and then place a bomb on a burning tile. "late_chain_ticks" counts the ticks in which
+        the bomb phase before breadth first would have set off part of a chain one tick later.
+        The field has no boxes: a box stops the first blast that reaches it, so which blast of a chain reaction
+        ends at a box depends on the order the bombs go off in, which breadth first changes.
+        Raises AssertionError if the games spawn other events in a tick, in any order.
+    """
+    results = {"chain_ticks": 0, "late_chain_ticks": 0, "burning_placements": 0, "update_us": 0.,
+               "sweep_update_us": 0.}
+    for seed in range(rounds):
+        games = Game(seed=seed), SweepBombsGame(seed=seed)
+        cursors = []
+        for game in games:
+            for _ in range(2):
+                game.create_player()
+            for player in game.players:
+                player.bombs = ticks
+            game.falling_box_scheduler.spawn_rate = 0
+            for box in game.entities.ids_of(BOX_KIND):
+                game.tiles.set_content(*game.entities.position(box), NO_ENTITY)
+                game.entities.remove(box)
+            cursors.append(game.events.subscribe())
+        rng = random.Random(seed)
+        game = games[0]
+        x0, y0 = rng.randrange(1, game.width - area), rng.randrange(1, game.height - area)
+        square = [(x, y) for x in range(x0, x0 + area) for y in range(y0, y0 + area) if game.tiles.is_passable(x, y)]
+        for tick in range(ticks):
+            burning = [(x, y) for x, y in square if game.tiles.has_explosion(x, y) and not game.tiles.has_content(x, y)]
+            placements = []
+            for id in range(2):
+                if burning and rng.random() < 0.2:
+                    placements.append((id, rng.choice(burning), rng.randint(1, 4)))
+                    results["burning_placements"] += 1
+                elif rng.random() < 0.1:
+                    placements.append((id, rng.choice(square), rng.randint(1, 4)))
+            for game, cursor, timing in zip(games, cursors, ("update_us", "sweep_update_us")):
+                for id, (x, y), power in placements:
+                    player = game.players[id]
+                    player.x, player.y, player.power = x + 0.5, y + 0.5, power
+                    game.player_action(id, "bomb")
+                start = time.perf_counter_ns()
+                game.update()
+                results[timing] += (time.perf_counter_ns() - start) / ticks / 1000 / rounds
+            events, sweep_events = ([event.encode() for event in cursor.read()] for cursor in cursors)
+            assert sorted(map(repr, events)) == sorted(map(repr, sweep_events)), \
+                "chain reactions differ from sweeping the bombs, seed %d tick %d" % (seed, tick)
+            if sum(type == EventType.REMOVE_BOMB.value for type, _ in events) > 1:
+                results["chain_ticks"] += 1
+        games[0].tiles.check_passable()
+        results["late_chain_ticks"] += games[1].late_chain_ticks
+    assert results["chain_ticks"] and results["burning_placements"], "no chain reactions or bombs on burning tiles"
+    return results
+
+
+def reference_move_step(x: float, y: float, speed: float, dir: tuple, passable, height: int) -> tuple:
+    """ Movement.move_step before it was split into COLLISION_TABLES steps: one step at any speed.
+        The reference bench_movement checks move_step against.
+    """
+    player_tile_x, player_tile_y = (floor(x), floor(y))
+    x_dir, y_dir = dir
+    nx, ny = x + (speed * x_dir), y + (speed * y_dir)
+    slide = None
+    collision = False
+
+    # 3 Tiles to check: Tile in direction, and left and right of that (viewed in direction of movement)
+    #       □  upper
+    # --> o □  front
+    #       □  lower
+
+    front_x, front_y = player_tile_x + x_dir, player_tile_y + y_dir
+    left_offset_x, left_offset_y = TILE_OFFSETS[dir][0]
+    left_x, left_y = player_tile_x + left_offset_x, player_tile_y + left_offset_y
+    right_offset_x, right_offset_y = TILE_OFFSETS[dir][1]
+    right_x, right_y = player_tile_x + right_offset_x, player_tile_y + right_offset_y
+
+    if not passable[front_x * height + front_y]:
+        collision_point_x, collision_point_y = (nx + PLAYER_RADIUS * x_dir, ny + PLAYER_RADIUS * y_dir)
+        if (floor(collision_point_x), floor(collision_point_y)) == (front_x, front_y):
+            # Collision with frontal wall OR slide along it depending on position.
+            # Compare distance of the player to the center of the tile he is standing on
+            # by getting the vector of the tile center to the player position.
+            # the vector then denotes the slide direction too.
+            #           v-- player pos
+            #    ┌───────┐
+            #    │      T│ <- slide left
+            #    │      F│ <- no slide
+            #    │   x  F│ <- no slide
+            #    │      F│ <- no slide
+            #    │      T│ <- slide right
+            #    └───────┘
+            tile_center_x, tile_center_y = player_tile_x + 0.5, player_tile_y + 0.5
+            player_vector_x, player_vector_y = x - tile_center_x, y - tile_center_y
+
+            if player_vector_x * player_vector_x + player_vector_y * player_vector_y > FRONTAL_SLIDE_THRESHOLD:
+                # slide, player is at edge. First, get the direction to slide to:
+                front_tile_center_x, front_tile_center_y = front_x + 0.5, front_y + 0.5
+                forward_vector_x = front_tile_center_x - tile_center_x
+                forward_vector_y = front_tile_center_y - tile_center_y
+                slide_left = -player_vector_x * forward_vector_y + player_vector_y * forward_vector_x < 0
+                if slide_left:
+                    left_offset_x, left_offset_y = TILE_OFFSETS[dir][2]
+                    if passable[(player_tile_x + left_offset_x) * height + player_tile_y + left_offset_y] \
+                            and passable[left_x * height + left_y]:
+                        slide = "left"
+                    else:
+                        collision = True
+                else:
+                    right_offset_x, right_offset_y = TILE_OFFSETS[dir][3]
+                    if passable[(player_tile_x + right_offset_x) * height + player_tile_y + right_offset_y] \
+                            and passable[right_x * height + right_y]:
+                        slide = "right"
+                    else:
+                        collision = True
+            else:
+                collision = True
+
+    # Get nearer neighboring tile (left or right neighbour)
+    elif distance_squared((nx, ny), (right_x + 0.5, right_y + 0.5)) < distance_squared((nx, ny),
+                                                                                       (left_x + 0.5,
+                                                                                        left_y + 0.5)):  # closer to the right neighboring tile. compare to that.
+        if not passable[right_x * height + right_y]:
+
+            wall_corner_x, wall_corner_y = (
+                right_x + RIGHT_CORNER_OFFSETS[dir][0], right_y + RIGHT_CORNER_OFFSETS[dir][1])
+
+            # If corner would be inside player collision radius: Collision.
+            # player distance to that point < player radius ?
+            if distance_squared((wall_corner_x, wall_corner_y), (nx, ny)) < PLAYER_RADIUS ** 2:
+                slide = "left"
+
+    else:  # player in left half of the tile, check against left neighboring tile's closest corner
+        if not passable[left_x * height + left_y]:
+
+            wall_corner_x, wall_corner_y = (
+                left_x + LEFT_CORNER_OFFSETS[dir][0], left_y + LEFT_CORNER_OFFSETS[dir][1])
+
+            # If corner would be inside player collision circle: Collision.
+            # Distance < player radius ?
+            if distance_squared((wall_corner_x, wall_corner_y), (nx, ny)) < PLAYER_RADIUS ** 2:
+                slide = "right"
+
+    ### ELSE: we move.
+
+    if slide:
+        slide_factors = SLIDE_FACTORS[dir][slide]
+        return speed * 0.5 * slide_factors[0], speed * 0.5 * slide_factors[1]
+    elif collision:
+        return 0, 0  # Turns the player only
+    return speed * x_dir, speed * y_dir
+
+
+def random_board(rng: random.Random, width: int, height: int, walls: float) -> bytearray:
+    """ :returns: a passability bitmap with walls around the edges and on a random fraction of the other tiles """
+    return bytearray(0 < x < width - 1 and 0 < y < height - 1 and rng.random() >= walls
+                     for x in range(width) for y in range(height))
+
+
+def random_walks(rng: random.Random, boards: list, walks: int, steps: int, min_speed: float, max_speed: float):
+    """ Yields (x, y, speed, dir, passable, height) of players walking the boards at random,
+        each for a few steps in one direction at a time, so they run into walls and slide along them.
+        :param boards: (passability bitmap, width, height)
+        :returns: a generator that expects the (dx, dy) of each step sent back
+    """
+    dirs = list(DIR.values())
+    for _ in range(walks):
+        passable, width, height = rng.choice(boards)
+        tiles = [(x, y) for x in range(width) for y in range(height) if passable[x * height + y]]
+        x, y = rng.choice(tiles)
+        x, y = x + rng.random(), y + rng.random()
+        dir = rng.choice(dirs)
+        for _ in range(steps):
+            if rng.random() < 0.2:
+                dir = rng.choice(dirs)
+            dx, dy = yield x, y, rng.uniform(min_speed, max_speed), dir, passable, height
+            x, y = x + dx, y + dy
+
+
+@benchmark("movement")
+def bench_movement(rounds: int = 10, ticks: int = 600, walks: int = 400, steps: int = 200) -> dict:
+    """ Fuzzes Movement.move_step against reference_move_step with random walks on played and random boards.
+        Raises AssertionError at the first step they move differently at normal speeds, up to
+        BASE_SPEED + MAX_BONUS_SPEED. Then counts the steps either ends inside a blocked tile at up to a tile per tick.
+    """
+    rng = random.Random(0)
+    boards = []
+    for seed in range(rounds):
+        game = scripted_game(seed)
+        play_random_ticks(game, ticks, seed)
+        boards.append((bytes(game.tiles.passable), game.width, game.height))
+        boards.append((random_board(rng, game.width, game.height, 0.1 * (seed % 5)), game.width, game.height))
+
+    results = {"steps": 0, "collisions": 0, "slides": 0}
+    cases = []
+    walk = random_walks(rng, boards, walks, steps, BASE_SPEED, BASE_SPEED + MAX_BONUS_SPEED)
+    case = next(walk)
+    try:
+        while True:
+            expected = reference_move_step(*case)
+            moved = move_step(*case)
+            assert moved == expected, "move_step moves %r instead of %r at %r" % (moved, expected, case[:4])
+            cases.append(case)
+            results["steps"] += 1
+            results["collisions"] += moved == (0, 0)
+            results["slides"] += moved != (0, 0) and moved != (case[2] * case[3][0], case[2] * case[3][1])
+            case = walk.send(moved)
+    except StopIteration:
+        pass
+    results["reference_us"] = mean_us(lambda case: reference_move_step(*case), cases)
+    results["move_step_us"] = mean_us(lambda case: move_step(*case), cases)
+
+    for name, step in (("reference_tunnels", reference_move_step), ("tunnels", move_step)):
+        walk = random_walks(random.Random(1), boards, walks, steps, MAX_STEP, 1.)
+        results[name] = 0
+        x, y, _, _, passable, height = case = next(walk)
+        try:
+            while True:
+                dx, dy = step(*case)
+                # sampled along the way, the player is put back if it passed a blocked tile
+                if not all(passable[floor(x + dx * i / 8) * height + floor(y + dy * i / 8)] for i in range(1, 9)):
+                    results[name] += 1
+                    dx, dy = 0, 0
+                x, y, _, _, passable, height = case = walk.send((dx, dy))
+        except StopIteration:
+            pass
+    return results
+
+
+def play_actions(game: Game, actions: list) -> list:
+    """ :param actions: per tick the actions of both players and their anger values
+        :returns: the encoded events of every tick
+    """
+    events = game.events.subscribe()
+    recorded = []
+    for tick_actions, angers in actions:
+        for id, action in enumerate(tick_actions):
+            game.player_action(id, action)
+        game.raw_angers = angers
+        game.update()
+        recorded.append([event.encode() for event in events.read()])
+    return recorded
+
+
+@benchmark("snapshot")
+def bench_snapshot(rounds: int = 10, ticks: int = 600, repeats: int = 100) -> dict:
+    """ Game.snapshot and Game.restore against pickling the whole game, on played games.
+        Raises AssertionError if a restored game plays on differently than the game the snapshot was taken of.
+    """
+    results = {"snapshot_us": 0., "restore_us": 0., "snapshot_bytes": 0., "pickle_us": 0., "unpickle_us": 0.,
+               "pickle_bytes": 0.}
+    for seed in range(rounds):
+        game = scripted_game(seed)
+        play_random_ticks(game, ticks, seed)
+        rng = random.Random(seed)
+        actions = [((rng.choice(ACTIONS), rng.choice(ACTIONS)), [rng.random(), rng.random()]) for _ in range(ticks)]
+        snapshot = game.snapshot()
+        pickled = pickle.dumps(game)
+        results["snapshot_us"] += mean_us(lambda _: game.snapshot(), range(repeats)) / rounds
+        results["restore_us"] += mean_us(lambda _: game.restore(snapshot), range(repeats)) / rounds
+        results["pickle_us"] += mean_us(pickle.dumps, [game] * (repeats // 10)) / rounds
+        results["unpickle_us"] += mean_us(pickle.loads, [pickled] * (repeats // 10)) / rounds
+        results["snapshot_bytes"] += len(snapshot) / rounds
+        results["pickle_bytes"] += len(pickled) / rounds
+
+        played_events = play_actions(game, actions)
+        played = game.snapshot()
+        game.restore(snapshot)
+        assert game.snapshot() == snapshot, "restored game packs another snapshot, seed %d" % seed
+        game.tiles.check_passable()
+        assert play_actions(game, actions) == played_events, "restored game spawns other events, seed %d" % seed
+        assert game.snapshot() == played, "restored game ends in another state, seed %d" % seed
+    return results
+
+
+@benchmark("frame_compression")
+def bench_frame_compression(ticks: int = 3000) -> dict:
+    """ Event frames of one tick each, compressed per frame, on one zlib stream, and on one stream with bypass """
+    payloads = [encode_events(events) for events in play_random_ticks(scripted_game(), ticks)]
+    results = {"raw_bytes_per_frame": sum(len(frame(FRAME_EVENTS, p)) for p in payloads) / len(payloads),
+               "zlib_bytes_per_frame": sum(len(frame(FRAME_EVENTS, zlib.compress(p))) for p in payloads) / len(payloads),
+               "zlib_us_per_frame": mean_us(zlib.compress, payloads)}
+    for label, threshold in (("stream", 0), ("adaptive", None)):
+        compressor = FrameCompressor() if threshold is None else FrameCompressor(threshold)
+        frames = [compressor.frame(FRAME_EVENTS, p) for p in payloads]
+        reader = FrameReader()
+        for data in frames:
+            reader.feed(data)
+        results.update({
+            label + "_bytes_per_frame": compressor.sent_bytes / len(payloads),
+            label + "_compressed_frames": compressor.compressed_frames,
+            label + "_compress_us_per_frame": compressor.cpu_ns / len(payloads) / 1000,
+            label + "_decompress_us_per_frame": reader.cpu_ns / len(payloads) / 1000,
+        })
+    return results
+
+
+def movement_cases(game: Game, speed: float) -> dict:
+    """ Finds a start on the game's field for each case of Game.player_action's movement: a step on "open" floor,
+        walking into a "wall", a "slide" along a wall and brushing the "corner" of a diagonal wall
+        :returns: case name of MOVEMENT_CASES -> (x, y, action)
+    """
+    tiles = game.tiles
+    cases = {}
+    for x in range(1, game.width - 1):
+        for y in range(1, game.height - 1):
+            if not tiles.is_passable(x, y) or tiles.get_content(x, y) != NO_ENTITY:
+                continue
+            for action, (x_dir, y_dir) in DIR.items():
+                front_passable = tiles.is_passable(x + x_dir, y + y_dir)
+                open_front = front_passable and all(tiles.is_passable(x + dx, y + dy)
+                                                    for dx, dy in TILE_OFFSETS[(x_dir, y_dir)][:2])
+                for forward in (0, 0.1, 0.2, 0.25):
+                    for side in (0, -0.2, 0.2, -0.3, 0.3, -0.45, 0.45):  # across the direction of movement
+                        px, py = x + 0.5 + forward * x_dir + side * y_dir, y + 0.5 + forward * y_dir + side * x_dir
+                        dx, dy = move_step(px, py, speed, (x_dir, y_dir), tiles.passable, tiles.height)
+                        if (dx, dy) == (0, 0):
+                            case = None if front_passable else "wall"
+                        elif dx * x_dir + dy * y_dir == 0:
+                            case = "corner" if front_passable else "slide"
+                        else:
+                            case = "open" if open_front and forward == side == 0 else None
+                        if case is not None:
+                            cases.setdefault(case, (px, py, action))
+    return cases
+
+
+@benchmark("hot_paths")
+def bench_hot_paths(rounds: int = 2, ticks: int = 600, repeats: int = 500, max_power: int = 8,
+                    trials: int = 10) -> dict:
+    """ The hot paths of a match tick on scripted board states: Game.update on played games, Game.player_action
+        for each case of movement_cases(), Game.explode at each power level on every free tile of played games,
+        GameEvent.encode on the events of played games and utils.compress on their MAP_DATA and PLAYER_DATA.
+        Each time is the fastest of several trials, like the minimum of timeit.repeat. Every trial times all of
+        them and machine_us() in turn, so that the trials of one time spread over the whole run instead of a slow
+        second of it.
+        Raises AssertionError if the field lacks one of the MOVEMENT_CASES.
+    """
+    timers = {MACHINE_KEY: [machine_us]}  # result name -> functions timing a share of one trial of it in µs
+
+    def time_action(game: Game, x: float, y: float, action: str) -> float:
+        player = game.players[0]
+
+        def step(_):
+            player.x, player.y = x, y
+            game.player_action(0, action)
+        return mean_us(step, range(repeats))
+
+    def time_update(game: Game, snapshot: bytes) -> float:
+        game.restore(snapshot)
+        return mean_us(lambda _: game.update(), range(ticks)) / rounds
+
+    def time_explode(game: Game, snapshot: bytes, sites: list, power: int) -> float:
+        blast_ns = 0
+        for x, y in sites:
+            game.restore(snapshot)
+            bomb = game.entities.spawn(BOMB_KIND, x, y, owner=0, power=power)
+            start = time.perf_counter_ns()
+            game.explode(bomb)
+            blast_ns += time.perf_counter_ns() - start
+        return blast_ns / 1000
+
+    game = scripted_game()
+    cases = movement_cases(game, game.players[0].speed)
+    assert set(cases) == set(MOVEMENT_CASES), "no start found for " + str(set(MOVEMENT_CASES) - set(cases))
+    for name in MOVEMENT_CASES:
+        timers["player_action_us_" + name] = [partial(time_action, game, *cases[name])]
+
+    explosions = 0
+    events = []
+    map_data, player_data = [], []
+    for seed in range(rounds):
+        game = scripted_game(seed)
+        cursor = game.events.subscribe()
+        for _ in range(ticks // 60):
+            play_random_ticks(game, 60, seed * ticks + len(map_data))
+            map_data.append({"msg": "MAP_DATA", "fv": 0, "f": game.tiles.field_data(),
+                             "t": [(t.x, t.y, game.ticks_until(t)) for t in game.spike_traps]})
+            player_data.append({"msg": "PLAYER_DATA", "p": [{"id": id, "x": round(p.x, 2), "y": round(p.y, 2),
+                                                             "l": p.lifes, "b": p.bombs, "p": p.power}
+                                                            for id, p in enumerate(game.players)]})
+        events += cursor.read() or []
+        snapshot = game.snapshot()
+        timers.setdefault("update_us", []).append(partial(time_update, game, snapshot))
+
+        sites = [(x, y) for x in range(game.width) for y in range(game.height)
+                 if game.tiles.is_passable(x, y) and game.tiles.get_content(x, y) == NO_ENTITY]
+        explosions += len(sites)
+        for power in range(1, max_power + 1):
+            timers.setdefault("explode_us_power_%d" % power, []).append(
+                partial(time_explode, game, snapshot, sites, power))
+
+    timers["encode_us_per_event"] = [partial(mean_us, GameEvent.encode, events)]
+    for name, payloads in (("map_data", map_data), ("player_data", player_data)):
+        timers["compress_us_" + name] = [partial(mean_us, compress, payloads)]
+
+    results = dict.fromkeys(timers, float("inf"))
+    for _ in range(trials):
+        for key, shares in timers.items():
+            results[key] = min(results[key], sum(share() for share in shares))
+    for power in range(1, max_power + 1):
+        results["explode_us_power_%d" % power] /= explosions
+    for name, payloads in (("map_data", map_data), ("player_data", player_data)):
+        results["compress_bytes_" + name] = sum(len(compress(payload)) for payload in payloads) / len(payloads)
+    return results
+
+
+def is_cost(key: str) -> bool:
+    """ :returns: True for results where lower is better: times in µs and sizes in bytes """
+    words = key.split("_")
+    return "us" in words or "bytes" in words
+
+
+def relative(key: str, values: dict) -> float:
+    """ :returns: values[key], as a multiple of values[MACHINE_KEY] if it is a time and values has one """
+    if MACHINE_KEY in values and "us" in key.split("_"):
+        return values[key] / values[MACHINE_KEY]
+    return values[key]
+
+
+def run(names, repeat: int = 3) -> tuple:
+    """ :param repeat: runs of each benchmark. The best of each cost is kept, as noise only ever adds to them
+        :returns: benchmark name -> result name -> value, and the spread of each cost: benchmark name ->
+                  result name -> (worst - best) / best of relative() over the runs
+    """
+    results, spreads = {}, {}
+    for name in names:
+        print("[BENCHMARK]", name)
+        runs = [BENCHMARKS[name]() for _ in range(repeat)]
+        results[name], spreads[name] = dict(runs[0]), {}
+        for key in runs[0]:
+            if is_cost(key):
+                results[name][key] = min(values[key] for values in runs)
+                values = [relative(key, values) for values in runs]
+                spreads[name][key] = (max(values) - min(values)) / min(values) if min(values) else 0.
+        for key, value in results[name].items():
+            print("    {:<40} {:>12.3f}".format(key, value))
+    return results, spreads
+
+
+def compare(baseline: dict, results: dict, spreads: dict, threshold: float) -> tuple:
+    """ :param baseline: "results" and "spreads" of run(), as saved by --save
+        :param threshold: fraction a cost may grow by, e.g. 0.1 for 10 %. A cost whose runs in the baseline spread
+                          further apart may grow by that spread instead
+        :returns: (benchmark, result name, baseline value, value) of the costs that grew by more than they may,
+                  relative() to the machine_us() of each, and (benchmark, result name, spread, tolerance)
+                  of the costs whose runs now spread further apart than they may grow by. A noisy run does not
+                  widen the gate, so its results are less reliable and should be run again
+    """
+    regressions, noisy = [], []
+    for name, values in results.items():
+        old_values = baseline["results"].get(name, {})
+        for key, value in values.items():
+            old = old_values.get(key)
+            if old is None or not is_cost(key) or key == MACHINE_KEY:
+                continue
+            if (MACHINE_KEY in values) == (MACHINE_KEY in old_values):
+                value, old = relative(key, values), relative(key, old_values)
+            change = (value - old) / old if old else 0.
+            tolerance = max(threshold, baseline["spreads"].get(name, {}).get(key, 0.))
+            flags = []
+            if change > tolerance:
+                flags.append("REGRESSION")
+                regressions.append((name, key, old_values[key], values[key]))
+            if spreads[name][key] > tolerance:
+                flags.append("NOISY")
+                noisy.append((name, key, spreads[name][key], tolerance))
+            print("    {:<40} {:>12.3f} -> {:>12.3f} {:>+8.1%} (±{:.1%}) {}".format(
+                key, old_values[key], values[key], change, tolerance, " ".join(flags)))
+    return regressions, noisy
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("names", nargs="*", help="Benchmarks to run. One of: " + ", ".join(BENCHMARKS) + ". "
+                        "Defaults to all benchmarks, or with --compare to those of the baseline.")
+    parser.add_argument("--save", help="Write the results to this JSON baseline file.", default=None)
+    parser.add_argument("--compare", help="Compare the results to this JSON baseline file. Exits with status 1 "
+                        "if a time or size grew by more than the threshold.", default=None)
+    parser.add_argument("--threshold", help="Fraction a time or size may grow by before --compare flags it, "
+                        "unless its baseline runs spread further apart. Defaults to 0.1.", default=0.1, type=float)
+    parser.add_argument("--repeat", help="Runs of each benchmark, keeping the best times and sizes. Defaults to 3.",
+                        default=3, type=int)
+    args = parser.parse_args()
+
+    baseline = None
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    names = args.names or (list(baseline["results"]) if baseline is not None else list(BENCHMARKS))
+    results, spreads = run(names, args.repeat)
+    if args.save is not None:
+        with open(args.save, "w") as f:
+            json.dump({"results": results, "spreads": spreads}, f, indent=2, sort_keys=True)
+        print("[BENCHMARK] Saved results to", args.save)
+    if baseline is not None:
+        print("[BENCHMARK] Compared to", args.compare)
+        regressions, noisy = compare(baseline, results, spreads, args.threshold)
+        for name, key, spread, tolerance in noisy:
+            print("[BENCHMARK] Noisy runs of {} {}: spread {:.1%}, more than the ±{:.1%} it may grow by".format(
+                name, key, spread, tolerance))
+        for name, key, old, value in regressions:
+            print("[BENCHMARK] Regression in {} {}: {:.3f} -> {:.3f}".format(name, key, old, value))
+        if regressions:
+            sys.exit(1)
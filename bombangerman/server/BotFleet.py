@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+""" Load-tests a running Server.py with headless bots that play through the player protocol like Client.run.
+    Bots are spread over a pool of processes, each running its bots on one asyncio event loop.
+    Run from this directory: python BotFleet.py [-n PAIRS] [-b BEHAVIOURS] [-t SECONDS] [-o RESULTS.json]
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import random
+import time
+from collections import deque
+from typing import List, Optional
+
+import config
+from Events import EventType
+from TickLoop import TickLoop, TICK_RATE, MAX_PENDING_INPUTS
+from utils import FrameCompressor, FrameReader
+
+PACKET_SIZE = 4096
+ACTIONS = ["up", "up", "down", "down", "left", "left", "right", "right", "bomb", "wait", "slime", "taunt"]
+MOVES = ["up", "down", "left", "right"]
+# Actions a bot keeps unacknowledged at most. Below MAX_PENDING_INPUTS, so the server never drops any of them
+# and consumes exactly one per tick once the bot is ahead: the INPUT_ACKs then count the server's ticks
+IN_FLIGHT_ACTIONS = MAX_PENDING_INPUTS // 2
+PERCENTILES = (50, 95, 99)
+
+
+def idle(bot: "Bot") -> str:
+    return "wait"
+
+
+def walk(bot: "Bot") -> str:
+    """ Walks in one direction, turning now and then """
+    if bot.rng.random() < 1 / 30:
+        bot.direction = bot.rng.choice(MOVES)
+    return bot.direction
+
+
+def bomb(bot: "Bot") -> str:
+    """ Walks and drops a bomb about once a second """
+    if bot.rng.random() < 1 / TICK_RATE:
+        return "bomb"
+    return walk(bot)
+
+
+def mash(bot: "Bot") -> str:
+    """ Random actions, like the BatchRunner's players """
+    return bot.rng.choice(ACTIONS)
+
+
+BEHAVIOURS = {"idle": idle, "walk": walk, "bomb": bomb, "mash": mash}
+
+
+class Bot:
+    """ One headless player. Answers the handshake like Client.run: STARTUP/WAITING, MAP_DATA, PLAYER_DATA
+        and GAME_START. It then sends one action per tick, tagged with a sequence number, so the server's
+        INPUT_ACK of each action times its round trip. After GAME_OVER the bot plays again.
+    """
+    def __init__(self, behaviour: str, seed: int, tick_rate: int = TICK_RATE, max_games: Optional[int] = None):
+        """ :param behaviour: name of the BEHAVIOURS function choosing the actions
+            :param max_games: games to play before disconnecting, or None to play until the fleet stops
+        """
+        self.choose_action = BEHAVIOURS[behaviour]
+        self.rng = random.Random(seed)
+        self.direction = self.rng.choice(MOVES)
+        self.tick_rate = tick_rate
+        self.max_games = max_games
+        self.id = None
+        self.writer = None
+        self.frames = FrameReader()
+        self.compressor = FrameCompressor()
+        self.playing = False
+        self.next_seq = 0
+        self.sent = deque()  # (sequence number, send time) of the actions not acknowledged yet
+        self.acked_seq: Optional[int] = None  # of this game
+        self.acked_time = 0.
+        self.tick_loop: Optional[TickLoop] = None
+        # statistics
+        self.round_trips: List[float] = []  # seconds from sending an action to its INPUT_ACK
+        self.received_bytes = 0
+        self.sent_bytes = 0
+        self.actions = 0
+        self.ticks = 0  # server ticks counted by the INPUT_ACKs
+        self.playing_seconds = 0.  # between the first and last INPUT_ACK of each game
+        self.skipped_ticks = 0  # of the bot's own tick loop, if it can not keep up
+        self.held_ticks = 0  # ticks without an action because IN_FLIGHT_ACTIONS were not acknowledged yet
+        self.games = 0
+        self.error: Optional[str] = None
+
+    async def run(self, address: str, port: int) -> None:
+        try:
+            reader, self.writer = await asyncio.open_connection(address, port)
+        except OSError as e:
+            self.error = str(e)
+            return
+        try:
+            await self.handshake_and_play(reader)
+        except (ConnectionError, asyncio.IncompleteReadError) as e:
+            self.error = str(e)
+        finally:
+            self.playing = False
+            self.writer.close()
+
+    async def handshake_and_play(self, reader) -> None:
+        ticker = None
+        while True:
+            while not self.frames.has_message():
+                data = await reader.read(PACKET_SIZE)
+                if not data:
+                    return
+                self.received_bytes += len(data)
+                self.frames.feed(data)
+            message = self.frames.pop_message()
+            msg = message.get("msg", None)
+
+            if msg in ("STARTUP", "WAITING", "PLAYER_DATA"):
+                self.send_message({"msg": "ok"})
+            elif msg == "MAP_DATA":
+                self.id = message.get("id", self.id)  # map updates during the game carry no ID
+                if not self.playing:
+                    self.send_message({"msg": "ok"})
+            elif msg == "GAME_START":
+                self.send_message({"msg": "ok"})  # from now on, one action is sent per tick
+                self.playing = True
+                self.sent.clear()
+                self.acked_seq = None
+                self.tick_loop = TickLoop(self.tick, tick_rate=self.tick_rate)
+                ticker = asyncio.create_task(self.tick_loop.run(lambda: self.playing))
+            elif msg == "GAME_RUNNING":
+                self.handle_events(message["e"])
+            elif msg == "GAME_OVER":
+                self.playing = False
+                await ticker
+                self.skipped_ticks += self.tick_loop.skipped_ticks
+                self.games += 1
+                if self.max_games is not None and self.games >= self.max_games:
+                    return
+                self.send_message({"msg": "again"})
+            elif msg in ("CLOSE", "EXIT", None):
+                return
+
+    def handle_events(self, events: list) -> None:
+        now = time.perf_counter()
+        for type, data in events:
+            if type != EventType.INPUT_ACK.value or data["id"] != self.id:
+                continue
+            seq = data["s"]
+            while self.sent and self.sent[0][0] < seq:  # acknowledged in ticks that were coalesced into this one
+                self.sent.popleft()
+            if self.sent and self.sent[0][0] == seq:
+                self.round_trips.append(now - self.sent.popleft()[1])
+            if self.acked_seq is not None:
+                self.ticks += seq - self.acked_seq
+                self.playing_seconds += now - self.acked_time
+            self.acked_seq, self.acked_time = seq, now
+
+    def tick(self) -> None:
+        """ Sends the action of this tick, unless the server is IN_FLIGHT_ACTIONS behind """
+        if self.writer.is_closing():
+            return
+        if len(self.sent) >= IN_FLIGHT_ACTIONS:
+            self.held_ticks += 1
+            return
+        seq = self.next_seq
+        self.next_seq += 1
+        self.sent.append((seq, time.perf_counter()))
+        self.actions += 1
+        self.send_message({"id": self.id, "action": self.choose_action(self), "seq": seq})
+
+    def send_message(self, data: dict) -> None:
+        frame = self.compressor.encode(data)
+        self.sent_bytes += len(frame)
+        self.writer.write(frame)
+
+    def stats(self) -> dict:
+        return {"round_trips": self.round_trips, "received_bytes": self.received_bytes, "sent_bytes": self.sent_bytes,
+                "actions": self.actions, "ticks": self.ticks, "playing_seconds": self.playing_seconds,
+                "skipped_ticks": self.skipped_ticks, "held_ticks": self.held_ticks, "games": self.games,
+                "error": self.error}
+
+
+async def play(bots: List[Bot], address: str, port: int, seconds: float, connect_interval: float) -> None:
+    """ Connects the bots one after another and lets them play for the given number of seconds """
+    tasks = []
+    for bot in bots:
+        tasks.append(asyncio.create_task(bot.run(address, port)))
+        await asyncio.sleep(connect_interval)
+    _, pending = await asyncio.wait(tasks, timeout=seconds)
+    for task in pending:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def run_bots(behaviours: List[str], seeds: List[int], address: str, port: int, seconds: float,
+             connect_interval: float, tick_rate: int, max_games: Optional[int]) -> List[dict]:
+    """ Entry point of a fleet process. Runs one bot per behaviour and seed on one event loop
+        :returns: the stats of each bot
+    """
+    bots = [Bot(behaviour, seed, tick_rate, max_games) for behaviour, seed in zip(behaviours, seeds)]
+    asyncio.run(play(bots, address, port, seconds, connect_interval))
+    return [bot.stats() for bot in bots]
+
+
+def run_fleet(pairs: int, behaviours: List[str], address: str, port: int, seconds: float, processes: int = None,
+              connect_interval: float = 0.01, tick_rate: int = TICK_RATE, max_games: Optional[int] = None,
+              seed: int = 0) -> List[dict]:
+    """ Plays 2 * pairs bots against the server, dealt round robin over the processes (one per core by default).
+        :param behaviours: names of BEHAVIOURS, assigned to the bots in turn
+        :returns: the stats of each bot
+    """
+    processes = processes or multiprocessing.cpu_count()
+    bot_behaviours = [behaviours[i % len(behaviours)] for i in range(2 * pairs)]
+    jobs = [(bot_behaviours[i::processes], list(range(seed + i, seed + 2 * pairs, processes)), address, port, seconds,
+             connect_interval * processes, tick_rate, max_games) for i in range(min(processes, 2 * pairs))]
+    with multiprocessing.Pool(len(jobs)) as pool:
+        return [stats for job_stats in pool.starmap(run_bots, jobs) for stats in job_stats]
+
+
+def percentile(values: list, percent: float) -> float:
+    """ :param values: sorted values """
+    if not values:
+        return 0.
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+
+def summarize(stats: List[dict], seconds: float, tick_rate: int) -> dict:
+    """ :param seconds: wall clock time of the whole run """
+    round_trips = sorted(rtt * 1000 for bot in stats for rtt in bot["round_trips"])
+    tick_rates = [bot["ticks"] / bot["playing_seconds"] for bot in stats if bot["playing_seconds"] > 0]
+    summary = {"bots": len(stats), "errors": sum(bot["error"] is not None for bot in stats),
+               "games": sum(bot["games"] for bot in stats), "seconds": seconds,
+               "received_bytes_per_second": sum(bot["received_bytes"] for bot in stats) / seconds,
+               "sent_bytes_per_second": sum(bot["sent_bytes"] for bot in stats) / seconds,
+               "actions_per_second": sum(bot["actions"] for bot in stats) / seconds,
+               "bot_skipped_ticks": sum(bot["skipped_ticks"] for bot in stats),
+               "bot_held_ticks": sum(bot["held_ticks"] for bot in stats),
+               "tick_rate_mean": sum(tick_rates) / len(tick_rates) if tick_rates else 0.,
+               "tick_rate_min": min(tick_rates, default=0.)}
+    summary["tick_rate_drift"] = summary["tick_rate_mean"] / tick_rate - 1
+    summary.update({"rtt_ms_p%d" % percent: percentile(round_trips, percent) for percent in PERCENTILES})
+    summary["rtt_ms_max"] = round_trips[-1] if round_trips else 0.
+    return summary
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-a", "--address", help="Address of the server. Defaults to config.SERVER_ADRESS.",
+                        default=config.SERVER_ADRESS)
+    parser.add_argument("-p", "--port", help="Player port of the server. Defaults to 5555.", default=5555, type=int)
+    parser.add_argument("-n", "--pairs", help="Number of bot pairs, one match each. Defaults to 100.",
+                        default=100, type=int)
+    parser.add_argument("-b", "--behaviours", help="Comma separated behaviours, assigned to the bots in turn. "
+                        "Of: " + ", ".join(BEHAVIOURS) + ". Defaults to walk,bomb.", default="walk,bomb")
+    parser.add_argument("-t", "--seconds", help="Seconds to play. Defaults to 30.", default=30, type=float)
+    parser.add_argument("-g", "--games", help="Games each bot plays before disconnecting. "
+                        "Defaults to playing until the time is up.", default=None, type=int)
+    parser.add_argument("-w", "--workers", help="Number of bot processes. Defaults to the number of cores.",
+                        default=None, type=int)
+    parser.add_argument("-r", "--tick_rate", help="Actions per second of each bot, the server's tick rate. "
+                        "Defaults to %d." % TICK_RATE, default=TICK_RATE, type=int)
+    parser.add_argument("-i", "--connect_interval", help="Seconds between two bots connecting. Defaults to 0.01.",
+                        default=0.01, type=float)
+    parser.add_argument("-s", "--seed", help="Seed of the first bot's actions. Defaults to 0.", default=0, type=int)
+    parser.add_argument("-o", "--output", help="JSON file to write the summary and the stats of every bot to.",
+                        default=None)
+    args = parser.parse_args()
+    behaviours = args.behaviours.split(",")
+    for behaviour in behaviours:
+        if behaviour not in BEHAVIOURS:
+            parser.error("unknown behaviour " + behaviour)
+
+    start = time.perf_counter()
+    stats = run_fleet(args.pairs, behaviours, args.address, args.port, args.seconds, args.workers,
+                      args.connect_interval, args.tick_rate, args.games, args.seed)
+    summary = summarize(stats, time.perf_counter() - start, args.tick_rate)
+    print("[BOTS] {bots} bots played {games} games, {errors} connection errors in {seconds:.1f} s".format(**summary))
+    print("[BOTS] round trip p50 {rtt_ms_p50:.1f} ms, p95 {rtt_ms_p95:.1f} ms, p99 {rtt_ms_p99:.1f} ms, "
+          "max {rtt_ms_max:.1f} ms".format(**summary))
+    print("[BOTS] received {received_bytes_per_second:.0f} B/s, sent {sent_bytes_per_second:.0f} B/s, "
+          "{actions_per_second:.0f} actions/s".format(**summary))
+    print("[BOTS] server ticks/s mean {tick_rate_mean:.2f}, slowest match {tick_rate_min:.2f}, drift "
+          "{tick_rate_drift:+.2%}".format(**summary))
+    print("[BOTS] bot ticks skipped {bot_skipped_ticks}, held back waiting for INPUT_ACKs "
+          "{bot_held_ticks}".format(**summary))
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump({"summary": summary, "bots": stats}, f)
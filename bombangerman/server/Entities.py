@@ -1,7 +1,9 @@
+from array import array
 from enum import Enum
-from typing import Tuple
+from typing import List, Tuple, Optional
 from math import floor
 import random
+import struct
 from Events import GameEvent, EventType
 
 class EntityType(Enum):
@@ -13,118 +15,159 @@ class EntityType(Enum):
     CRUSHING_BOX = 5
     POWER_UP = 6
 
+# EntityType values as plain ints for the TileGrid arrays. Enum.value is too slow for hot paths
+BOX_KIND = EntityType.BOX.value
+BOMB_KIND = EntityType.BOMB.value
+POWER_UP_KIND = EntityType.POWER_UP.value
+CRUSHING_BOX_KIND = EntityType.CRUSHING_BOX.value
+EXPLOSION_KIND = EntityType.EXPLOSION.value
+FALLING_BOX_KIND = EntityType.FALLING_BOX.value
+BLOCKING_KINDS = frozenset((BOX_KIND, BOMB_KIND, CRUSHING_BOX_KIND))  # kinds of content players can not traverse
+
+FREE = -1  # kind of the unused rows of an EntityStore
+NO_ENTITY = -1  # entity ID of no entity, e.g. the content of an empty tile
+NO_TIMER = -1  # fire tick of entities that are not scheduled
+NO_OWNER = -1
+STORE_STATE = struct.Struct("<IIq")  # rows, free rows, next_seq. Packed in front of the columns
+
 class PowerUpType(Enum):
     INVERT_KEYBOARD = 0
     AUTOWALK = 1
     POWER_PLUS = 2
     BOMB_PLUS = 3
 
-class Entity:
-    """ Represents an object that sits on the map, such as a crate or a bomb.
-        This class should not be instanciated directly, instead, one subclass
-        is present for each kind of Entity.
+class EntityStore:
+    """ The entities that sit on the map: boxes, bombs, explosions, falling and crushing boxes and power-ups.
+        Stored as struct-of-arrays columns indexed by entity ID, one row per entity: its kind (EntityType value,
+        FREE for unused rows), tile position, the absolute tick its timer fires at (NO_TIMER if none), its timer's
+        sequence number, the ticks it lasts, and owner ID and power of bombs. Power-ups keep their PowerUpType value
+        in the power column. Tiles refer to their content by entity ID, see TileGrid.contents.
+        Removed entities leave their row to a free list, the next spawned entity reuses the row,
+        so the columns only grow to the most entities alive at once.
     """
-    def __init__(self, x, y, ent_type:EntityType):
+    def __init__(self):
+        self.kinds = array("b")
+        self.xs = array("B")
+        self.ys = array("B")
+        self.fire_ticks = array("q")  # set by the Timers.EntityTimerQueue the entity is scheduled in
+        self.timer_seqs = array("q")  # spawn order. Unique, so a reused row never matches a stale timer
+        self.durations = array("H")  # ticks_to_expiration, counted from when it is scheduled
+        self.owners = array("b")
+        self.powers = array("B")
+        self.free = array("i")  # unused rows, the last freed one is reused first
+        self.next_seq = 0
+
+    def __len__(self) -> int:
+        return len(self.kinds) - len(self.free)
+
+    def columns(self) -> tuple:
+        return (self.kinds, self.xs, self.ys, self.fire_ticks, self.timer_seqs, self.durations, self.owners,
+                self.powers)
+
+    def spawn(self, kind: int, x: int, y: int, duration: int = 0, owner: int = NO_OWNER, power: int = 0) -> int:
+        """ :param kind: EntityType value, e.g. BOMB_KIND
+            :param duration: ticks until it expires once it is scheduled
+            :returns: the ID of the new entity
+        """
+        if self.free:
+            entity = self.free.pop()
+            self.kinds[entity] = kind
+            self.xs[entity] = x
+            self.ys[entity] = y
+            self.fire_ticks[entity] = NO_TIMER
+            self.timer_seqs[entity] = self.next_seq
+            self.durations[entity] = duration
+            self.owners[entity] = owner
+            self.powers[entity] = power
+        else:
+            entity = len(self.kinds)
+            self.kinds.append(kind)
+            self.xs.append(x)
+            self.ys.append(y)
+            self.fire_ticks.append(NO_TIMER)
+            self.timer_seqs.append(self.next_seq)
+            self.durations.append(duration)
+            self.owners.append(owner)
+            self.powers.append(power)
+        self.next_seq += 1
+        return entity
+
+    def remove(self, entity: int) -> None:
+        """ Frees the entity's row. Its timer, if scheduled, is dropped once it comes up """
+        self.kinds[entity] = FREE
+        self.fire_ticks[entity] = NO_TIMER
+        self.free.append(entity)
+
+    def count(self, kind: int) -> int:
+        """ :returns: the number of live entities of this kind """
+        return self.kinds.count(kind)
+
+    def ids_of(self, kind: int) -> List[int]:
+        """ :returns: the IDs of all entities of this kind, in the order they were spawned """
+        kinds = self.kinds
+        return sorted((entity for entity in range(len(kinds)) if kinds[entity] == kind),
+                      key=self.timer_seqs.__getitem__)
+
+    def position(self, entity: int) -> Tuple[int, int]:
+        return self.xs[entity], self.ys[entity]
+
+    @property
+    def state_size(self) -> int:
+        """ Bytes packed by pack_into() """
+        return (STORE_STATE.size + sum(column.itemsize for column in self.columns()) * len(self.kinds)
+                + self.free.itemsize * len(self.free))
+
+    def pack_into(self, buffer: bytearray, offset: int) -> int:
+        """ Packs all rows, used or not, and the free list into the buffer, see Game.snapshot()
+            :returns: the offset after the state
+        """
+        STORE_STATE.pack_into(buffer, offset, len(self.kinds), len(self.free), self.next_seq)
+        offset += STORE_STATE.size
+        for column in (*self.columns(), self.free):
+            size = column.itemsize * len(column)
+            buffer[offset:offset + size] = column
+            offset += size
+        return offset
+
+    def unpack_from(self, buffer, offset: int) -> int:
+        """ Replaces all rows with the ones packed by pack_into(), so every entity keeps its ID
+            :returns: the offset after the state
+        """
+        rows, free_rows, self.next_seq = STORE_STATE.unpack_from(buffer, offset)
+        offset += STORE_STATE.size
+        for column in self.columns():
+            size = column.itemsize * rows
+            del column[:]
+            column.frombytes(buffer[offset:offset + size])
+            offset += size
+        size = self.free.itemsize * free_rows
+        del self.free[:]
+        self.free.frombytes(buffer[offset:offset + size])
+        return offset + size
+
+
+class SpikeTrap:
+    """ A Trap is a tile that periodically spawns an effect that can kill players.
+        Traversable. Not kept in the EntityStore, the game keeps its few traps in a list.
+    """
+    __slots__ = ("x", "y", "type", "rng", "min_delay_ticks", "max_delay_ticks", "delay_delta", "activation_duration",
+                 "activation_ticks_remaining", "armed", "ticks_to_activation", "fire_tick", "timer_seq")
+
+    def __init__(self,x,y,min_delay_ticks,max_delay_ticks,active_ticks=1,armed=True,rng:random.Random=None):
+        """ :param rng: draws the random delays, e.g. the game's seeded Random. Defaults to the random module """
         self.x = x
         self.y = y
-        self.type = ent_type
-
-    def is_of_type(self, type:EntityType):
-        return self.type == type
-
-    def get_pos(self) -> Tuple[float,float]:
-        """ :returns: (x,y) """
-        return self.x,self.y
-
-    def get_tile_pos(self) -> Tuple[int,int]:
-        """ :returns: (floor(x),floor(y)) """
-        return (int(floor(self.x)),int(floor(self.y)))
-
-class TimerEntity(Entity):
-    """ Entity with a timer that can be ticked down via self.tick().
-        Check expiration with self.timer_expired() """
-    def __init__(self,x,y,type:EntityType,ticks_to_expiration:int):
-        super().__init__(x,y,type)
-        self.ticks_to_expiration = ticks_to_expiration
-
-    def tick(self) -> None:
-        """ Ticks the internal timer down by 1 step """
-        self.ticks_to_expiration -= 1
-
-    def timer_expired(self) -> bool:
-        """ Returns true if the ticking timer has expired and the bomb should explode """
-        return self.ticks_to_expiration <= 0
-
-class Traversable():
-    """ Base interface class to provide is_traversable() -> True """
-    def __init__(self,*args,**kwargs): # discards any arguments
-        pass
-
-    def is_traversable(self):
-        return True
-
-class NotTraversable():
-    """ Base interface class to provide is_traversable() -> False """
-    def __init__(self,*args,**kwargs): # discards any arguments
-        pass
-
-    def is_traversable(self):
-        return False
-
-class FallingBox(TimerEntity, Traversable):
-    """ A falling box. The Tile is still traversable """
-    def __init__(self,x,y,ticks_to_expiration):
-        super().__init__(x,y,EntityType.FALLING_BOX,ticks_to_expiration)
-
-class CrushingBox(TimerEntity, NotTraversable):
-    """ A box so close to the ground that it smashes the player. Not traversable. """
-    def __init__(self,x,y,ticks_to_expiration):
-        super().__init__(x,y,EntityType.CRUSHING_BOX,ticks_to_expiration)
-
-class Box(Entity, NotTraversable):
-    """ Represents an impassable, destructible Box object. """
-    def __init__(self,x,y):
-        super().__init__(x,y,EntityType.BOX)
-
-class Explosion(TimerEntity, Traversable):
-    """ Represents an passable explosion object. """
-    def __init__(self,x,y,ticks_to_expiration):
-        super().__init__(x,y,EntityType.EXPLOSION, ticks_to_expiration)
-
-class Bomb(TimerEntity, NotTraversable):
-    """ Represents a bomb about to explode """
-    def __init__(self,x,y,power,owner_id,ticks_to_explosion):
-        super().__init__(x,y,EntityType.BOMB,ticks_to_explosion)
-        self.power = power
-        self.owner_id = owner_id
-
-    def get_owner_id(self):
-        return self.owner_id
-
-    def get_power(self) -> int:
-        return self.power
-
-class PowerUp(Entity, Traversable):
-    """ Represents a collectable power-Up item on the ground """
-    def __init__(self, x, y, power_up_type:PowerUpType):
-        super().__init__(x,y,EntityType.POWER_UP)
-        self.power_up_type = power_up_type
-
-    def get_power_up_type(self) -> PowerUpType:
-        return self.power_up_type
-
-
-class SpikeTrap(Entity, Traversable):
-    """ A Trap is a tile that periodically spawns an effect that can kill players """
-    def __init__(self,x,y,min_delay_ticks,max_delay_ticks,active_ticks=1,armed=True):
-        super().__init__(x,y,EntityType.SPIKE_TRAP)
+        self.type = EntityType.SPIKE_TRAP
+        self.rng = random if rng is None else rng
         self.min_delay_ticks = min_delay_ticks
         self.max_delay_ticks = max_delay_ticks
         self.delay_delta = max_delay_ticks - min_delay_ticks
         self.activation_duration = active_ticks
         self.activation_ticks_remaining = -1
         self.armed = armed
-        self.ticks_to_activation = max_delay_ticks
+        self.ticks_to_activation = max_delay_ticks  # counted from the last reset
+        self.fire_tick = None  # set by the Timers.TimerQueue of the game
+        self.timer_seq = None
         self.reset_delay()
 
     def info_dict(self):
@@ -133,20 +176,27 @@ class SpikeTrap(Entity, Traversable):
         """
         return {"x":self.x,"y":self.y,"ticks":self.ticks_to_activation,"active":self.is_active()}
 
-    def tick(self, game) -> None:
-        """ Ticks down the timers of this trap.
-            if is_active:
-                ticks down remaining active time
-            else if is_armed:
-                ticks down remaining time to activation
+    def fire(self, game) -> Optional[int]:
+        """ Called by the game at the ticks this trap is due at: every tick while it is active,
+            else once its time to activation ran out.
+            :returns: the number of ticks until the trap is due again, or None if it is disarmed
         """
         if self.activation_ticks_remaining > 0:
             self.activation_ticks_remaining -= 1
-            if self.activation_ticks_remaining == 0:
-                self.reset_delay(mode="random")
-                game.register_event(GameEvent(EventType.RESET_TRAP, {"x": self.x, "y": self.y, "t": self.ticks_to_activation}))
-        elif self.armed:
-            self.ticks_to_activation -= 1
+            if self.activation_ticks_remaining > 0:
+                self.handle_damage(game.players, game)
+                return 1
+            self.reset_delay(mode="random")
+            game.register_event(GameEvent(EventType.RESET_TRAP, {"x": self.x, "y": self.y, "t": self.ticks_to_activation}))
+            if not self.should_activate():
+                return self.ticks_to_activation if self.armed else None
+        elif not self.armed:
+            return None
+        # spring the trap!
+        self.activate()
+        game.register_event(GameEvent(EventType.ACTIVATE_TRAP, {"x": self.x, "y": self.y}))
+        self.handle_damage(game.players, game)
+        return 1
 
     def reset_delay(self,mode="random") -> None:
         """ :param mode: one of "min" "max" "random". Defaults to "random"
@@ -156,10 +206,14 @@ class SpikeTrap(Entity, Traversable):
         elif mode == "max":
             self.ticks_to_activation = self.max_delay_ticks
         elif mode == "random":
-            self.ticks_to_activation = int(self.min_delay_ticks + (random.random() * self.delay_delta))
+            self.ticks_to_activation = int(self.min_delay_ticks + (self.rng.random() * self.delay_delta))
         else:
             raise NotImplementedError("reset_delay has mode",mode,"not implemented!")
 
+    def get_tile_pos(self) -> Tuple[int,int]:
+        """ :returns: (floor(x),floor(y)) """
+        return (int(floor(self.x)),int(floor(self.y)))
+
     def is_active(self):
         return self.activation_ticks_remaining > 0
 
@@ -179,6 +233,7 @@ class SpikeTrap(Entity, Traversable):
                     game.register_event(GameEvent(EventType.PLAYER_DAMAGED, {"id": id, "dmg": 1}))
 
     def set_is_armed(self, is_armed:bool=True) -> None:
+        """ A disarmed trap drops out of the game's schedule. Re-arm it with Game.schedule_trap() """
         self.armed = is_armed
 
     def is_armed(self) -> bool:
@@ -0,0 +1,88 @@
+from typing import List, Optional, Tuple
+
+from EventCodec import encode_events, decode_events
+from Events import EventType
+
+# event type value -> data keys naming the state the event sets. A later event with the same
+# type and key values overwrites this state on the client, so the earlier one can be dropped.
+SUPERSEDED_EVENTS = {
+    EventType.PLAYER_MOVED.value: ("id",),
+    EventType.ANGER_INFO.value: (),
+    EventType.INPUT_ACK.value: ("id",),
+}
+
+
+class EventLog:
+    """ Append-only ring buffer shared by all consumers of an event stream.
+        Every consumer reads through its own EventCursor, so appending costs the same
+        no matter how many consumers there are. Items older than the capacity are dropped;
+        a cursor that has not read them yet is overrun and has to be resynced.
+    """
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.buffer = [None] * capacity
+        self.end = 0  # sequence number of the next item
+
+    def append(self, item) -> None:
+        self.buffer[self.end % self.capacity] = item
+        self.end += 1
+
+    def subscribe(self, start: Optional[int] = None) -> "EventCursor":
+        """ :param start: sequence number of the first item to read. Defaults to the items appended from now on
+            :returns: a new cursor
+        """
+        return EventCursor(self, self.end if start is None else start)
+
+    def read(self, start: int) -> Optional[list]:
+        """ :returns: the items from sequence number start to the end, or None if some of them were dropped """
+        if start < self.end - self.capacity:
+            return None
+        first, last = start % self.capacity, self.end % self.capacity
+        if first < last or start == self.end:
+            return self.buffer[first:last]
+        return self.buffer[first:] + self.buffer[:last]
+
+
+class EventCursor:
+    """ The read position of one consumer of an EventLog """
+    def __init__(self, log: EventLog, position: int):
+        self.log = log
+        self.position = position
+
+    def lag(self) -> int:
+        """ :returns: the number of items appended since the last read """
+        return self.log.end - self.position
+
+    def read(self) -> Optional[list]:
+        """ :returns: the items appended since the last read, or None if the log already dropped some
+                      of them. The cursor then stays where it is until it is replaced.
+        """
+        items = self.log.read(self.position)
+        if items is not None:
+            self.position = self.log.end
+        return items
+
+
+def coalesce_events(events: List[Tuple[int, dict]]) -> List[Tuple[int, dict]]:
+    """ Drops state events that a later event of the same state supersedes.
+        All other events, e.g. spawns and removals, are kept in their order.
+        :param events: (type, data_dict) tuples as returned by GameEvent.encode()
+    """
+    latest = {}  # (type, key values) -> index of the latest event setting this state
+    for i, (type, data) in enumerate(events):
+        keys = SUPERSEDED_EVENTS.get(type)
+        if keys is not None:
+            latest[(type,) + tuple(data[key] for key in keys)] = i
+    if len(latest) == sum(type in SUPERSEDED_EVENTS for type, _ in events):
+        return events
+    kept = set(latest.values())
+    return [event for i, event in enumerate(events) if event[0] not in SUPERSEDED_EVENTS or i in kept]
+
+
+def coalesce_packed(chunks: List[bytes]) -> bytes:
+    """ :param chunks: events packed by EventCodec, e.g. one chunk per tick
+        :returns: all chunks packed as one, without superseded events
+    """
+    if len(chunks) == 1:
+        return chunks[0]
+    return encode_events(coalesce_events(decode_events(b"".join(chunks))))
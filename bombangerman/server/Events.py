@@ -32,6 +32,10 @@ class EventType(Enum):
     PLAYER_CHANGE_POWER_AMOUNT = 28
     PLAYER_AUTOWALK_ON = 29
     PLAYER_AUTOWALK_OFF = 30
+    FIELD_CHANGED = 31
+    RESYNC = 32
+    PLAYER_STATE = 33
+    INPUT_ACK = 34
 
 
 class GameEvent:
@@ -1,65 +1,22 @@
 from Player import Player
-from math import floor
 from collections import deque
-import pygame
+from math import floor
 import random
-from typing import Optional, List
+import struct
+from typing import Optional, List, Tuple
 import json
 from Events import EventType, GameEvent
 from Entities import *
-from Tiles import TileType, Tile
+from Tiles import TileType, TileGrid, FieldHistory
+from EventLog import EventLog
 from Schedulers import FallingBoxScheduler, PowerUpScheduler
+from Timers import TimerQueue, EntityTimerQueue
+from AngerHistory import AngerHistory, ANGER_HISTORY_LEN, ANGER_HISTORY_DECAY_FACTOR
+from Movement import DIR, move_step
+from TickProfiler import (TickProfiler, ACTIONS_PHASE, ANGER_PHASE, CRUSHING_BOXES_PHASE, FALLING_BOXES_PHASE,
+                          SPAWNS_PHASE, BOMBS_PHASE, TRAPS_PHASE, EXPLOSIONS_PHASE, PLAYERS_PHASE)
 
-# fraction. 0.0 -> never slide, 1.0 always slide.
-# FRONTAL_SLIDE_THRESHOLD only handles slide when the frontal tile is solid
-# Slides upon entering open frontal tiles along corners of diagonally adjacent walls
-# are not handled by this threshold but instead always happen on collision with the corner.
-FRONTAL_SLIDE_THRESHOLD_FACTOR = 0.1
-
-PLAYER_RADIUS = 0.3  # Collision radius, must be 0 < x < 0.5!
-
-# used in sliding detection for FRONTAL_SLIDE_THRESHOLD
-# minimum sideways player distance from tile center
-MIN_PLAYER_SIDE_OFFSET = (0.5 - PLAYER_RADIUS) ** 2
-# maximum sideways player distance from tile center
-MAX_PLAYER_SIDE_OFFSET = (0.5 ** 2) + ((0.5 - PLAYER_RADIUS) ** 2)
-# If the player is further away from the tile center than this, sliding will happen upon frontal collision
-FRONTAL_SLIDE_THRESHOLD = ((
-                                   MAX_PLAYER_SIDE_OFFSET - MIN_PLAYER_SIDE_OFFSET) * FRONTAL_SLIDE_THRESHOLD_FACTOR) + MIN_PLAYER_SIDE_OFFSET
-
-DIR = {"right": (1, 0),
-       "left": (-1, 0),
-       "up": (0, -1),
-       "down": (0, 1)}
-
-# diag_left, diag_right, left, right
-TILE_OFFSETS = {
-    (1, 0): ((1, -1), (1, 1), (0, -1), (0, 1)),
-    (0, 1): ((1, 1), (-1, 1), (1, 0), (-1, 0)),
-    (-1, 0): ((-1, 1), (-1, -1), (0, 1), (0, -1)),
-    (0, -1): ((-1, -1), (1, -1), (-1, 0), (1, 0)),
-}
-
-RIGHT_CORNER_OFFSETS = {
-    (1, 0): (0, 0),
-    (0, 1): (+1, 0),
-    (-1, 0): (+1, +1),
-    (0, -1): (0, +1),
-}
-
-LEFT_CORNER_OFFSETS = {
-    (1, 0): (0, +1),
-    (0, 1): (0, 0),
-    (-1, 0): (+1, 0),
-    (0, -1): (+1, +1),
-}
-
-SLIDE_FACTORS = {
-    (1, 0): {"left": (0, -1), "right": (0, +1)},
-    (0, 1): {"left": (1, 0), "right": (-1, 0)},
-    (-1, 0): {"left": (0, +1), "right": (0, -1)},
-    (0, -1): {"left": (-1, 0), "right": (+1, 0)}
-}
+DEBUG_PASSABILITY = False  # check the passability bitmap against the tiles after every tick. Slow
 
 TIME_TILL_EXPLOSION = 60 * 5 # TODO export configs into a config file
 EXPLOSION_DURATION = 60
@@ -70,73 +27,107 @@ INVERTED_KEYBOARD_TICKS = 60 * 10
 AUTOWALK_TICKS = 60 * 10
 SLIME_COOLDOWN = 60 * 30
 
-ANGER_HISTORY_LEN = 400
-ANGER_HISTORY_DECAY_FACTOR = 1/ANGER_HISTORY_LEN
 ANGER_INPUT_RETENTION_TICKS = 18
 
+EVENT_LOG_CAPACITY = 4096  # events kept for consumers that have not read them yet
+
+# Layout of Game.snapshot(), all little-endian: the header, then per player and spike trap one record, the anger
+# state, the random state, the EntityStore with its columns as they are, and the tile arrays of the field
+# (types, sprite ids, content entity IDs).
+SNAPSHOT_VERSION = 2
+# version, width, height, ticks, winner or -1, field version, grace counters of the falling box and power-up
+# schedulers, next sequence number of the trap timers, then the number of players and spike traps
+SNAPSHOT_HEADER = struct.Struct("<BBBqiIHHIBH")
+# x, y, speed, base_speed, max_bonus_speed, lifes, bombs, power, immortal_ticks, slime_cooldown_ticks, facing,
+# inverted_ticks, slime, autowalk_ticks, last_action as index into LAST_ACTIONS
+PLAYER_STATE = struct.Struct("<5d9iB")
+LAST_ACTIONS = list(DIR)
+LAST_ACTION_CODES = {action: code for code, action in enumerate(LAST_ACTIONS)}
+# activation_ticks_remaining, ticks_to_activation, fire_tick or -1, timer_seq or -1, armed
+TRAP_STATE = struct.Struct("<iiqq?")
+# raw angers, aggregated angers, anger retention counters and values. The AngerHistory states follow
+ANGER_STATE = struct.Struct("<2d2d2i2d")
+RANDOM_STATE = struct.Struct("<625I?d")  # random.Random.getstate(): the Mersenne Twister key and position, gauss_next
+
 class Game:
-    def __init__(self, width: int = 15, height: int = 16, file=None):
+    def __init__(self, width: int = 15, height: int = 16, file=None,
+                 anger_history_len: int = ANGER_HISTORY_LEN, anger_decay: float = ANGER_HISTORY_DECAY_FACTOR,
+                 seed: Optional[int] = None):
         """
         :param width: width of the game in Boxes
         :param height: height of the game in Boxes
         :param file: file from where a game floor should be loaded
+        :param seed: seed of all random decisions of the game, so the same seed and inputs play the same game.
+                     Random if None
+        :param anger_history_len: ticks of anger values the aggregated angers are made of
+        :param anger_decay: fraction every anger value loses per tick
         """
         self.width: int = width
         self.height: int = height
+        self.seed: int = random.getrandbits(32) if seed is None else seed
+        self.random = random.Random(self.seed)
         self.players: list = []
-        self.tiles: list = [[0 for _ in range(self.height)] for _ in range(self.width)]
+        self.entities = EntityStore()  # all entities but the spike traps, tiles refer to them by ID
+        self.tiles = TileGrid(self.width, self.height, self.entities)
         self.starts: list = []
-        self.bombs: List[Bomb] = []  # TODO couple entities into a single interface and list
-        self.explosions: List[Explosion] = []
-        self.falling_boxes: List[FallingBox] = []
-        self.crushing_boxes: List[CrushingBox] = []
         self.spike_traps: list = []
+        # Each kind of entity is only touched at the ticks its timer fires at
+        self.ticks: int = 0  # ticks simulated so far
+        self.bomb_timers = EntityTimerQueue(self.entities)
+        self.explosion_timers = EntityTimerQueue(self.entities)
+        self.falling_box_timers = EntityTimerQueue(self.entities)
+        self.crushing_box_timers = EntityTimerQueue(self.entities)
+        self.trap_timers = TimerQueue()
         self.field_version: int = 0
+        self.field_history = FieldHistory()
         self.winner: Optional[int] = None
-        self.events: list = [deque(), deque()]
+        self.events = EventLog(EVENT_LOG_CAPACITY)  # read through self.events.subscribe()
         self.raw_angers: List[float] = [0.,0.]
         self.aggregated_angers: List[float] = [0.,0.]
-        self.anger_histories: Tuple[List[float],List[float]] = ([0. for _ in range(ANGER_HISTORY_LEN)],[0. for _ in range(ANGER_HISTORY_LEN)])
-        self.anger_history_max = self.precompute_anger_history_max()
+        self.anger_histories: Tuple[AngerHistory,AngerHistory] = (AngerHistory(anger_history_len, anger_decay),
+                                                                   AngerHistory(anger_history_len, anger_decay))
         self.anger_retention_container = [[0,0.],[0,0.]] # counter,anger_val
 
         self.falling_box_scheduler = FallingBoxScheduler(spawn_rate=0.015, grace_period_ticks=180, allow_spawn_on_player=True)
 
         self.power_up_scheduler = PowerUpScheduler(spawn_rate=0.15, grace_period_ticks=0, relative_spawn_rates={PowerUpType.AUTOWALK: 0.9, PowerUpType.INVERT_KEYBOARD: 1.0, PowerUpType.POWER_PLUS: 0.1, PowerUpType.BOMB_PLUS: 0.2})
+        self.snapshot_buffer = bytearray(4 * RANDOM_STATE.size)  # reused by snapshot(), grown when too small
+        # times the phases of update() if set. Its start() is called before the tick's player actions
+        self.profiler: Optional[TickProfiler] = None
 
         if file is None:
             # Build upper wall-tops
-            self.tiles[0][0] = Tile(TileType.WALL, 33, 0, 0)
-            self.tiles[-1][0] = Tile(TileType.WALL, 36, 0, 0)
+            self.tiles.set_tile(0, 0, TileType.WALL, 33)
+            self.tiles.set_tile(-1, 0, TileType.WALL, 36)
             for x in range(1, self.width - 1):
-                self.tiles[x][0] = Tile(TileType.WALL, random.choice([34, 35]), x, 0)
-            self.tiles[3][0] = Tile(TileType.WALL, 22, 3, 0)  # Special Tile for eye candy
+                self.tiles.set_tile(x, 0, TileType.WALL, self.random.choice([34, 35]))
+            self.tiles.set_tile(3, 0, TileType.WALL, 22)  # Special Tile for eye candy
             # Build upper wall tiles
-            self.tiles[0][1] = Tile(TileType.WALL, 49, 0, 0)
-            self.tiles[-1][1] = Tile(TileType.WALL, 52, 0, 0)
+            self.tiles.set_tile(0, 1, TileType.WALL, 49)
+            self.tiles.set_tile(-1, 1, TileType.WALL, 52)
             for x in range(1, self.width - 1):
-                self.tiles[x][1] = Tile(TileType.WALL, random.choice([16, 17, 18, 38, 50, 51, 115]), x, 1)
+                self.tiles.set_tile(x, 1, TileType.WALL, self.random.choice([16, 17, 18, 38, 50, 51, 115]))
             # Build left and right wall tiles
             x = 0
             for y in range(2, self.height - 1):
-                self.tiles[0][y] = Tile(TileType.WALL, 49, 0, y)
-                self.tiles[-1][y] = Tile(TileType.WALL, 52, -1, y)
+                self.tiles.set_tile(0, y, TileType.WALL, 49)
+                self.tiles.set_tile(-1, y, TileType.WALL, 52)
             # Build bottom wall tiles
-            self.tiles[0][-1] = Tile(TileType.WALL, 81, 0, 0)
-            self.tiles[-1][-1] = Tile(TileType.WALL, 84, 0, 0)
+            self.tiles.set_tile(0, -1, TileType.WALL, 81)
+            self.tiles.set_tile(-1, -1, TileType.WALL, 84)
             for x in range(1, self.width - 1):
-                self.tiles[x][-1] = Tile(TileType.WALL, 82, x, -1)
-            self.tiles[11][-1] = Tile(TileType.WALL, 6, 11, -1)  # eye candy tile
+                self.tiles.set_tile(x, -1, TileType.WALL, 82)
+            self.tiles.set_tile(11, -1, TileType.WALL, 6)  # eye candy tile
 
             # Build center area with paths and pillars
             for y in range(2, self.height - 1):
                 for x in range(1, self.width - 1):
                     if y % 2 != 0 and x % 2 != 1:
-                        self.tiles[x][y] = Tile(TileType.WALL, random.choice([97, 113]), x, y)
+                        self.tiles.set_tile(x, y, TileType.WALL, self.random.choice([97, 113]))
                     else:
-                        self.tiles[x][y] = Tile(TileType.EMPTY, random.choice(
+                        self.tiles.set_tile(x, y, TileType.EMPTY, self.random.choice(
                             [1, 1, 1, 1, 1, 1, 1, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 3, 3, 3, 3, 4, 4, 4, 4, 19, 19,
-                             19, 20]), x, y)
+                             19, 20]))
             # Place some boxes
             box_locations = [(2,6), (8,1),(8,2),(8,3),(8,4),(8,5),(8,6),(8,8),(8,9),(8,10),(8,11),(8,12),(8,13),
                              (2,7),(3,7),(4,7),(5,7),(6,7),(7,7),(9,7),(10,7),(11,7),(12,7),(13,7),(14,7)]
@@ -144,42 +135,192 @@ class Game:
                 self.place_box(x,y)
 
             # Place spike traps
-            self.spike_traps.append(SpikeTrap(4, 2, 600, 900, active_ticks=90, armed=True))
-            self.spike_traps.append(SpikeTrap(10, 2, 600, 1000, active_ticks=90, armed=True))
-            self.spike_traps.append(SpikeTrap(10, 14, 600, 1000, active_ticks=90, armed=True))
-            self.spike_traps.append(SpikeTrap(4, 14, 600, 900, active_ticks=90, armed=True))
-            self.spike_traps.append(SpikeTrap(1, 5, 600, 1000, active_ticks=90, armed=True))
-            self.spike_traps.append(SpikeTrap(1, 11, 600, 900, active_ticks=90, armed=True))
-            self.spike_traps.append(SpikeTrap(13, 11, 600, 1000, active_ticks=90, armed=True))
-            self.spike_traps.append(SpikeTrap(13, 5, 600, 900, active_ticks=90, armed=True))
-
-            self.spike_traps.append(SpikeTrap(5, 6, 500, 800, active_ticks=90, armed=True))
-            self.spike_traps.append(SpikeTrap(5, 10, 500, 800, active_ticks=90, armed=True))
-            self.spike_traps.append(SpikeTrap(9, 6, 500, 800, active_ticks=90, armed=True))
-            self.spike_traps.append(SpikeTrap(9, 10, 500, 800, active_ticks=90, armed=True))
+            self.spike_traps.append(SpikeTrap(4, 2, 600, 900, active_ticks=90, armed=True, rng=self.random))
+            self.spike_traps.append(SpikeTrap(10, 2, 600, 1000, active_ticks=90, armed=True, rng=self.random))
+            self.spike_traps.append(SpikeTrap(10, 14, 600, 1000, active_ticks=90, armed=True, rng=self.random))
+            self.spike_traps.append(SpikeTrap(4, 14, 600, 900, active_ticks=90, armed=True, rng=self.random))
+            self.spike_traps.append(SpikeTrap(1, 5, 600, 1000, active_ticks=90, armed=True, rng=self.random))
+            self.spike_traps.append(SpikeTrap(1, 11, 600, 900, active_ticks=90, armed=True, rng=self.random))
+            self.spike_traps.append(SpikeTrap(13, 11, 600, 1000, active_ticks=90, armed=True, rng=self.random))
+            self.spike_traps.append(SpikeTrap(13, 5, 600, 900, active_ticks=90, armed=True, rng=self.random))
+
+            self.spike_traps.append(SpikeTrap(5, 6, 500, 800, active_ticks=90, armed=True, rng=self.random))
+            self.spike_traps.append(SpikeTrap(5, 10, 500, 800, active_ticks=90, armed=True, rng=self.random))
+            self.spike_traps.append(SpikeTrap(9, 6, 500, 800, active_ticks=90, armed=True, rng=self.random))
+            self.spike_traps.append(SpikeTrap(9, 10, 500, 800, active_ticks=90, armed=True, rng=self.random))
+            for trap in self.spike_traps:
+                self.schedule_trap(trap)
 
             # Place power up
-            p_up = PowerUp(7,8,PowerUpType.BOMB_PLUS)
-            self.tiles[7][8].set_content(p_up)
-            self.register_event(GameEvent(EventType.SPAWN_POWER_UP, {"x": p_up.x, "y":p_up.y,"t":p_up.get_power_up_type().value}))
-
-            p_up = PowerUp(10,4,PowerUpType.POWER_PLUS)
-            self.tiles[10][4].set_content(p_up)
-            self.register_event(GameEvent(EventType.SPAWN_POWER_UP, {"x": p_up.x, "y":p_up.y,"t":p_up.get_power_up_type().value}))
-
-            p_up = PowerUp(4,12,PowerUpType.POWER_PLUS)
-            self.tiles[4][12].set_content(p_up)
-            self.register_event(GameEvent(EventType.SPAWN_POWER_UP, {"x": p_up.x, "y":p_up.y,"t":p_up.get_power_up_type().value}))
+            self.place_power_up(7, 8, PowerUpType.BOMB_PLUS)
+            self.place_power_up(10, 4, PowerUpType.POWER_PLUS)
+            self.place_power_up(4, 12, PowerUpType.POWER_PLUS)
 
             # Define player starting positions
             self.starts = [(1, 2), (13, 14)]
         else:
             self.load_from_file(file)
 
+    def schedule_trap(self, trap: SpikeTrap) -> None:
+        """ Schedules an armed trap's next activation """
+        self.trap_timers.schedule(trap, self.ticks + trap.ticks_to_activation)
+
+    def ticks_until(self, trap: SpikeTrap) -> int:
+        """ :returns: the ticks until the trap's timer fires """
+        if trap.fire_tick is None:  # a disarmed trap
+            return trap.ticks_to_activation
+        return trap.fire_tick - self.ticks
+
     def register_event(self, event):
         """ :param event: GameEvent instance """
-        for i in range(len(self.events)):
-            self.events[i].append(event)
+        self.events.append(event)
+
+    def snapshot_events(self) -> list:
+        """ :returns: encoded events that rebuild the current game state on a client, starting with a RESYNC
+                      that clears the client's state. For consumers of self.events that fell too far behind.
+        """
+        events = [(EventType.RESYNC.value, {})]
+        for id, p in enumerate(self.players):
+            events.append((EventType.PLAYER_STATE.value, {"id": id, "x": round(p.x, 2), "y": round(p.y, 2),
+                                                          "f": p.facing, "l": p.lifes, "b": p.bombs, "p": p.power,
+                                                          "i": p.is_immortal(), "s": p.slime > 0,
+                                                          "k": p.is_inverted(), "a": p.is_autowalking()}))
+        entities = self.entities
+        for x, y in self.tiles.positions_of(EntityType.BOX):
+            events.append((EventType.SPAWN_BOX.value, {"x": x, "y": y}))
+        for x, y in self.tiles.positions_of(EntityType.POWER_UP):
+            power_up = self.tiles.get_content(x, y)
+            events.append((EventType.SPAWN_POWER_UP.value, {"x": x, "y": y, "t": entities.powers[power_up]}))
+        for kind, event_type in ((BOMB_KIND, EventType.SPAWN_BOMB), (EXPLOSION_KIND, EventType.SPAWN_EXPLOSION),
+                                 (FALLING_BOX_KIND, EventType.SPAWN_FALLING_BOX),
+                                 (CRUSHING_BOX_KIND, EventType.SPAWN_CRUSHING_BOX)):
+            for entity in entities.ids_of(kind):
+                data = {"x": entities.xs[entity], "y": entities.ys[entity]}
+                if kind != EXPLOSION_KIND:
+                    data["t"] = entities.fire_ticks[entity] - self.ticks
+                events.append((event_type.value, data))
+        for trap in self.spike_traps:
+            if trap.is_active():
+                events.append((EventType.ACTIVATE_TRAP.value, {"x": trap.x, "y": trap.y}))
+            else:
+                events.append((EventType.RESET_TRAP.value, {"x": trap.x, "y": trap.y, "t": self.ticks_until(trap)}))
+        events.append((EventType.ANGER_INFO.value, {"0": self.aggregated_angers[0], "1": self.aggregated_angers[1]}))
+        return events
+
+    def snapshot(self) -> bytes:
+        """ Packs everything the following ticks depend on: players, entities, timers, the schedulers,
+            the random state and the anger aggregates. Not the events or the field history.
+            Packed into a buffer kept between calls, see SNAPSHOT_HEADER for the layout.
+            :returns: the state, for restore()
+        """
+        tiles = self.tiles
+        size = (SNAPSHOT_HEADER.size + PLAYER_STATE.size * len(self.players) + TRAP_STATE.size * len(self.spike_traps)
+                + ANGER_STATE.size + sum(history.state_size for history in self.anger_histories)
+                + RANDOM_STATE.size + self.entities.state_size + tiles.types.nbytes + tiles.sprite_ids.nbytes
+                + tiles.contents.nbytes)
+        if len(self.snapshot_buffer) < size:
+            self.snapshot_buffer = bytearray(2 * size)
+        buffer = self.snapshot_buffer
+
+        SNAPSHOT_HEADER.pack_into(buffer, 0, SNAPSHOT_VERSION, self.width, self.height, self.ticks,
+                                  -1 if self.winner is None else self.winner, self.field_version,
+                                  self.falling_box_scheduler.grace_counter, self.power_up_scheduler.grace_counter,
+                                  self.trap_timers.next_seq, len(self.players), len(self.spike_traps))
+        offset = SNAPSHOT_HEADER.size
+        for p in self.players:
+            PLAYER_STATE.pack_into(buffer, offset, p.x, p.y, p.speed, p.base_speed, p.max_bonus_speed, p.lifes,
+                                   p.bombs, p.power, p.immortal_ticks, p.slime_cooldown_ticks, p.facing,
+                                   p.inverted_ticks, p.slime, p.autowalk_ticks, LAST_ACTION_CODES[p.last_action])
+            offset += PLAYER_STATE.size
+        for trap in self.spike_traps:
+            TRAP_STATE.pack_into(buffer, offset, trap.activation_ticks_remaining, trap.ticks_to_activation,
+                                 -1 if trap.fire_tick is None else trap.fire_tick,
+                                 -1 if trap.timer_seq is None else trap.timer_seq, trap.armed)
+            offset += TRAP_STATE.size
+        (counter_0, anger_0), (counter_1, anger_1) = self.anger_retention_container
+        ANGER_STATE.pack_into(buffer, offset, *self.raw_angers, *self.aggregated_angers,
+                              counter_0, counter_1, anger_0, anger_1)
+        offset += ANGER_STATE.size
+        for history in self.anger_histories:
+            offset = history.pack_into(buffer, offset)
+        _, key, gauss_next = self.random.getstate()
+        RANDOM_STATE.pack_into(buffer, offset, *key, gauss_next is not None, gauss_next or 0.)
+        offset += RANDOM_STATE.size
+        offset = self.entities.pack_into(buffer, offset)
+        for array in (tiles.types, tiles.sprite_ids, tiles.contents):
+            buffer[offset:offset + array.nbytes] = array.tobytes()
+            offset += array.nbytes
+        return bytes(memoryview(buffer)[:size])
+
+    def restore(self, snapshot: bytes) -> None:
+        """ Sets the game to the state of a snapshot() of this game, or of a game with the same spike traps.
+            The event consumers are not told, e.g. send them snapshot_events()
+            :raises ValueError: if the snapshot is of another version or of a game of another size
+        """
+        (version, width, height, ticks, winner, field_version, falling_box_grace, power_up_grace, trap_seq,
+         num_players, num_traps) = SNAPSHOT_HEADER.unpack_from(snapshot)
+        if version != SNAPSHOT_VERSION:
+            raise ValueError("snapshot version", version, "is not", SNAPSHOT_VERSION)
+        if (width, height, num_traps) != (self.width, self.height, len(self.spike_traps)):
+            raise ValueError("snapshot of a", width, "x", height, "game with", num_traps, "traps")
+        self.ticks = ticks
+        self.winner = None if winner < 0 else winner
+        if field_version != self.field_version:
+            self.field_version = field_version
+            self.field_history.reset(field_version)
+        self.falling_box_scheduler.grace_counter = falling_box_grace
+        self.power_up_scheduler.grace_counter = power_up_grace
+
+        offset = SNAPSHOT_HEADER.size
+        del self.players[num_players:]
+        while len(self.players) < num_players:
+            self.players.append(Player(0, 0))
+        for p in self.players:
+            (p.x, p.y, p.speed, p.base_speed, p.max_bonus_speed, p.lifes, p.bombs, p.power, p.immortal_ticks,
+             p.slime_cooldown_ticks, p.facing, p.inverted_ticks, p.slime, p.autowalk_ticks,
+             last_action) = PLAYER_STATE.unpack_from(snapshot, offset)
+            p.last_action = LAST_ACTIONS[last_action]
+            offset += PLAYER_STATE.size
+        for trap in self.spike_traps:
+            (trap.activation_ticks_remaining, trap.ticks_to_activation, fire_tick, timer_seq,
+             trap.armed) = TRAP_STATE.unpack_from(snapshot, offset)
+            trap.fire_tick = None if fire_tick < 0 else fire_tick
+            trap.timer_seq = None if timer_seq < 0 else timer_seq
+            offset += TRAP_STATE.size
+        self.trap_timers.restore(self.spike_traps, trap_seq)
+
+        (raw_0, raw_1, aggregated_0, aggregated_1, counter_0, counter_1, anger_0,
+         anger_1) = ANGER_STATE.unpack_from(snapshot, offset)
+        self.raw_angers = [raw_0, raw_1]
+        self.aggregated_angers = [aggregated_0, aggregated_1]
+        self.anger_retention_container = [[counter_0, anger_0], [counter_1, anger_1]]
+        offset += ANGER_STATE.size
+        for history in self.anger_histories:
+            offset = history.unpack_from(snapshot, offset)
+        state = RANDOM_STATE.unpack_from(snapshot, offset)
+        has_gauss_next, gauss_next = state[-2:]
+        self.random.setstate((random.Random.VERSION, state[:-2], gauss_next if has_gauss_next else None))
+        offset += RANDOM_STATE.size
+
+        # entities keep their IDs, so the tiles refer to them as they did
+        entities = self.entities
+        offset = entities.unpack_from(snapshot, offset)
+        tiles = self.tiles
+        size = tiles.types.nbytes
+        tiles.set_field(snapshot[offset:offset + size], snapshot[offset + size:offset + 3 * size])
+        tiles.set_contents(snapshot[offset + 3 * size:offset + 7 * size])
+        explosions = entities.ids_of(EXPLOSION_KIND)
+        for explosion in explosions:
+            tiles.add_explosion(entities.xs[explosion], entities.ys[explosion])
+        self.bomb_timers.restore(entities.ids_of(BOMB_KIND))
+        self.explosion_timers.restore(explosions)
+        self.falling_box_timers.restore(entities.ids_of(FALLING_BOX_KIND))
+        self.crushing_box_timers.restore(entities.ids_of(CRUSHING_BOX_KIND))
+
+    def set_tile(self, x: int, y: int, type: TileType, sprite_id: int):
+        """ Changes the static field. Clients are patched to the new field version """
+        self.tiles.set_tile(x, y, type, sprite_id)
+        self.field_version = self.field_history.record(x, y, type, sprite_id)
 
     def create_player(self):
         id = len(self.players)
@@ -187,23 +328,22 @@ class Game:
         self.players.append(player)
         return id, player
 
-    @staticmethod
-    def distance_squared(p1, p2):
-        return (p1[0] - p2[0]) ** 2 + (p1[1] - p2[1]) ** 2
-
     def player_action(self, id, action):
         p = self.players[id]
 
         ### Powerup Collection ###
         # Is before the action to happen also on a 'wait' action if the P-Up spawned below the player last tick # TODO maybe make powerups be non-collectable for a seconds upon spawning so that the client can even SEE such spawns?
         player_tile_x, player_tile_y = (floor(p.x), floor(p.y))
-        current_player_tile = self.tiles[player_tile_x][player_tile_y]
+        tiles = self.tiles
+        passable = tiles.passable  # bitmap indexed x * height + y, see TileGrid
+        height = tiles.height
 
-        if current_player_tile.has_content():
-            if current_player_tile.get_content().is_of_type(EntityType.POWER_UP):
-                self.apply_power_up(p, id, current_player_tile.get_content())
-                current_player_tile.set_content(None)
-                self.register_event(GameEvent(EventType.REMOVE_POWER_UP, {"x": player_tile_x, "y": player_tile_y}))
+        if tiles.content_is(player_tile_x, player_tile_y, POWER_UP_KIND):
+            power_up = tiles.get_content(player_tile_x, player_tile_y)
+            self.apply_power_up(p, id, power_up)
+            self.entities.remove(power_up)
+            tiles.set_content(player_tile_x, player_tile_y, NO_ENTITY)
+            self.register_event(GameEvent(EventType.REMOVE_POWER_UP, {"x": player_tile_x, "y": player_tile_y}))
 
         # invert player input upon affliction
         if p.is_inverted() and action in ["up","down","left","right"]:
@@ -243,102 +383,8 @@ class Game:
         # Move action
         # if p.automove:
         #     action = p.last_action
-        dir = DIR[action]
-        x_dir, y_dir = dir
-        nx, ny = p.x + (p.speed * x_dir), p.y + (p.speed * y_dir)
-        slide = None
-        collision = False
-
-        # 3 Tiles to check: Tile in direction, and left and right of that (viewed in direction of movement)
-        #       □  upper
-        # --> o □  front
-        #       □  lower
-
-        front_tile = self.tiles[player_tile_x + x_dir][player_tile_y + y_dir]
-        left_offset_x, left_offset_y = TILE_OFFSETS[(x_dir, y_dir)][0]
-        left_tile = self.tiles[player_tile_x + left_offset_x][player_tile_y + left_offset_y]
-        right_offset_x, right_offset_y = TILE_OFFSETS[(x_dir, y_dir)][1]
-        right_tile = self.tiles[player_tile_x + right_offset_x][player_tile_y + right_offset_y]
-
-        if not front_tile.is_passable():
-            collision_point_x, collision_point_y = (nx + PLAYER_RADIUS * x_dir, ny + PLAYER_RADIUS * y_dir)
-            tile_at_col_point = self.tiles[floor(collision_point_x)][floor(collision_point_y)]
-            if tile_at_col_point == front_tile:
-                # Collision with frontal wall OR slide along it depending on position.
-                # Compare distance of the player to the center of the tile he is standing on
-                # by getting the vector of the tile center to the player position.
-                # the vector then denotes the slide direction too.
-                #           v-- player pos
-                #    ┌───────┐
-                #    │      T│ <- slide left
-                #    │      F│ <- no slide
-                #    │   x  F│ <- no slide
-                #    │      F│ <- no slide
-                #    │      T│ <- slide right
-                #    └───────┘
-                tile_center_x, tile_center_y = player_tile_x + 0.5, player_tile_y + 0.5
-                player_vector = pygame.math.Vector2((p.x - tile_center_x, p.y - tile_center_y))
-
-                if player_vector.length_squared() > FRONTAL_SLIDE_THRESHOLD:
-                    # slide, player is at edge. First, get the direction to slide to:
-                    front_tile_center_x, front_tile_center_y = front_tile.get_center()
-                    forward_vector = pygame.math.Vector2(
-                        (front_tile_center_x - tile_center_x, front_tile_center_y - tile_center_y))
-                    slide_left = -player_vector.x * forward_vector.y + player_vector.y * forward_vector.x < 0
-                    if slide_left:
-                        left_offset_x, left_offset_y = TILE_OFFSETS[(x_dir, y_dir)][2]
-                        left_side_wall_tile = self.tiles[player_tile_x + left_offset_x][player_tile_y + left_offset_y]
-                        if left_side_wall_tile.is_passable() and left_tile.is_passable():
-                            slide = "left"
-                        else:
-                            collision = True
-                    else:
-                        right_offset_x, right_offset_y = TILE_OFFSETS[(x_dir, y_dir)][3]
-                        right_side_wall_tile = self.tiles[player_tile_x + right_offset_x][
-                            player_tile_y + right_offset_y]
-                        if right_side_wall_tile.is_passable() and right_tile.is_passable():
-                            slide = "right"
-                        else:
-                            collision = True
-                else:
-                    collision = True
-
-        # Get nearer neighboring tile (left or right neighbour)
-        elif self.distance_squared((nx, ny), (right_tile.x + 0.5, right_tile.y + 0.5)) < self.distance_squared((nx, ny),
-                                                                                                               (
-                                                                                                                       left_tile.x + 0.5,
-                                                                                                                       left_tile.y + 0.5)):  # closer to the right neighboring tile. compare to that.
-            if not right_tile.is_passable():
-
-                wall_corner_x, wall_corner_y = (
-                    right_tile.x + RIGHT_CORNER_OFFSETS[dir][0], right_tile.y + RIGHT_CORNER_OFFSETS[dir][1])
-
-                # If corner would be inside player collision radius: Collision.
-                # player distance to that point < player radius ?
-                if self.distance_squared((wall_corner_x, wall_corner_y), (nx, ny)) < PLAYER_RADIUS ** 2:
-                    slide = "left"
-
-
-        else:  # player in left half of the tile, check against left neighboring tile's closest corner
-            if not left_tile.is_passable():
-
-                wall_corner_x, wall_corner_y = (
-                    left_tile.x + LEFT_CORNER_OFFSETS[dir][0], left_tile.y + LEFT_CORNER_OFFSETS[dir][1])
-
-                # If corner would be inside player collision circle: Collision.
-                # Distance < player radius ?
-                if self.distance_squared((wall_corner_x, wall_corner_y), (nx, ny)) < PLAYER_RADIUS ** 2:
-                    slide = "right"
-
-        ### ELSE: we move.
-
-        if slide:
-            slide_factors = SLIDE_FACTORS[dir][slide]
-            p.move(p.speed * 0.5 * slide_factors[0], p.speed * 0.5 * slide_factors[1], action=action)
-        elif collision:
-            p.move(0, 0, action=action)  # Turns the player only
-        else:
-            p.move(p.speed * x_dir, p.speed * y_dir, action=action)
+        dx, dy = move_step(p.x, p.y, p.speed, DIR[action], passable, height)
+        p.move(dx, dy, action=action)
 
         self.register_event(GameEvent(EventType.PLAYER_MOVED, {"id": id,
                                                                "x": round(p.x, 2),
@@ -346,36 +392,42 @@ class Game:
                                                                "f": p.facing}))
 
     def place_box(self, x: int, y: int):
-        if not self.tiles[x][y].has_content():
-            box = Box(x,y)
-            self.tiles[x][y].set_content(box)
+        if not self.tiles.has_content(x, y):
+            box = self.entities.spawn(BOX_KIND, x, y)
+            self.tiles.set_content(x, y, box)
             self.register_event(GameEvent(EventType.SPAWN_BOX, {"x": x, "y": y}))
 
+    def place_power_up(self, x: int, y: int, power_up_type: PowerUpType):
+        power_up = self.entities.spawn(POWER_UP_KIND, x, y, power=power_up_type.value)
+        self.tiles.set_content(x, y, power_up)
+        self.register_event(GameEvent(EventType.SPAWN_POWER_UP, {"x": x, "y": y, "t": power_up_type.value}))
+
     def place_bomb(self, id: int):
         player = self.players[id]
         x, y = (floor(p) for p in player.get_pos())
-        tile = self.tiles[x][y]
-
-        if tile.has_content() or player.bombs <= 0:
+        if self.tiles.has_content(x, y) or player.bombs <= 0:
             return
         else:
             player.bombs -= 1
             self.register_event(GameEvent(EventType.PLAYER_CHANGE_BOMBS_COUNT, {"id": id, "b": player.bombs}))
-        bomb = Bomb(x,y,player.power,id,TIME_TILL_EXPLOSION)
-        self.bombs.append(bomb) # TODO needed or make Entity[] ?
-        tile.set_content(bomb)
+        bomb = self.entities.spawn(BOMB_KIND, x, y, TIME_TILL_EXPLOSION, owner=id, power=player.power)
+        if self.tiles.has_explosion(x, y):  # goes off in the next bomb phase, like a bomb caught in a blast
+            self.bomb_timers.schedule(bomb, self.ticks + 1)
+        else:
+            self.bomb_timers.schedule(bomb, self.ticks + TIME_TILL_EXPLOSION)
+        self.tiles.set_content(x, y, bomb)
         self.register_event(GameEvent(EventType.SPAWN_BOMB, {"x": x, "y": y, "t": TIME_TILL_EXPLOSION}))
 
-    def update(self, id: int):
-        """ :param id: player ID calling this function. The Game will only update for player ID 0 """
-        if id != 1:  # TODO workaround. without this, both clients call this method, resulting in 2x game speed
-            return
+    def update(self):
+        """ Advances the game by one tick. Called by the server's TickLoop, after the tick's player actions """
+        self.ticks += 1
+        now = self.ticks
+        profiler = self.profiler
+        if profiler is not None:
+            profiler.mark(ACTIONS_PHASE)
 
         # update anger display
         for id in range(len(self.players)):
-            anger_history = self.anger_histories[id]
-            for i in range(1,len(anger_history)):
-                anger_history[i-1] = anger_history[i] - (ANGER_HISTORY_DECAY_FACTOR * anger_history[i])
             current_raw_anger = self.raw_angers[id]
             if (current_raw_anger >= self.anger_retention_container[id][1]) or (current_raw_anger > 0 and self.anger_retention_container[id][0] == 0):
                 self.anger_retention_container[id] = [ANGER_INPUT_RETENTION_TICKS, current_raw_anger]
@@ -383,114 +435,80 @@ class Game:
                 self.anger_retention_container[id][0] -= 1
                 if self.anger_retention_container[id][1] > current_raw_anger:
                     current_raw_anger = self.anger_retention_container[id][1]
-            anger_history[-1] = current_raw_anger
-            self.aggregated_angers[id] = sum(anger_history) / self.anger_history_max
+            self.aggregated_angers[id] = self.anger_histories[id].add(current_raw_anger)
 
         self.register_event(GameEvent(EventType.ANGER_INFO, {"0":self.aggregated_angers[0],"1":self.aggregated_angers[1]}))
-
-        # Update Crushing Boxes
-        i = 0
-        while i < len(self.crushing_boxes):
-            crushing_box = self.crushing_boxes[i]
-            crushing_box.tick()
-            x,y = crushing_box.get_pos()
-            for id, player in enumerate(self.players):
-                px, py = player.get_tile_pos()
-                if px == int(x) and py == int(y) and player.is_immortal() == False:
-                    player.lifes -= 1
-                    player.set_immortal_time(200)
-                    self.register_event(GameEvent(EventType.PLAYER_DAMAGED, {"id": id, "dmg": 1}))
-                    # TODO push player aside upon crush? without, he can freely walk inside the falling box until he leaves the tile. but that can be as desired too.
-            if crushing_box.timer_expired():
-                tile = self.tiles[int(x)][int(y)]
-                tile.set_content(Box(x,y))
-                del self.crushing_boxes[i]
-                self.register_event(GameEvent(EventType.SPAWN_BOX, {"x": x, "y": y}))
-                self.register_event(GameEvent(EventType.REMOVE_CRUSHING_BOX, {"x":x,"y":y}))
-            else:
-                i += 1
-
-        # Update Falling Boxes
-        i = 0
-        while i < len(self.falling_boxes):
-            falling_box = self.falling_boxes[i]
-            falling_box.tick()
-            if falling_box.timer_expired():
-                x,y = falling_box.get_pos()
-                tile = self.tiles[int(x)][int(y)]
-                crushing_box = CrushingBox(x,y,CRUSHING_BOX_DURATION)
-                tile.set_content(crushing_box)
-                self.crushing_boxes.append(crushing_box)
-                del self.falling_boxes[i]
-                self.register_event(GameEvent(EventType.REMOVE_FALLING_BOX, {"x":x,"y":y}))
-                self.register_event(GameEvent(EventType.SPAWN_CRUSHING_BOX, {"x":x,"y":y,"t":crushing_box.ticks_to_expiration}))
-            else:
-                i += 1
+        if profiler is not None:
+            profiler.mark(ANGER_PHASE)
+
+        tiles = self.tiles
+        entities = self.entities
+
+        # Crushing Boxes damage the players below them
+        for id, player in enumerate(self.players):
+            px, py = player.get_tile_pos()
+            if tiles.content_is(px, py, CRUSHING_BOX_KIND) and player.is_immortal() == False:
+                player.lifes -= 1
+                player.set_immortal_time(200)
+                self.register_event(GameEvent(EventType.PLAYER_DAMAGED, {"id": id, "dmg": 1}))
+                # TODO push player aside upon crush? without, he can freely walk inside the falling box until he leaves the tile. but that can be as desired too.
+        for crushing_box in self.crushing_box_timers.pop_due(now):
+            x,y = entities.position(crushing_box)
+            entities.remove(crushing_box)
+            tiles.set_content(x, y, entities.spawn(BOX_KIND, x, y))
+            self.register_event(GameEvent(EventType.SPAWN_BOX, {"x": x, "y": y}))
+            self.register_event(GameEvent(EventType.REMOVE_CRUSHING_BOX, {"x":x,"y":y}))
+        if profiler is not None:
+            profiler.mark(CRUSHING_BOXES_PHASE)
+
+        # Falling Boxes turn into Crushing Boxes
+        for falling_box in self.falling_box_timers.pop_due(now):
+            x,y = entities.position(falling_box)
+            entities.remove(falling_box)
+            crushing_box = entities.spawn(CRUSHING_BOX_KIND, x, y, CRUSHING_BOX_DURATION)
+            tiles.set_content(x, y, crushing_box)
+            self.crushing_box_timers.schedule(crushing_box, now + CRUSHING_BOX_DURATION)
+            self.register_event(GameEvent(EventType.REMOVE_FALLING_BOX, {"x":x,"y":y}))
+            self.register_event(GameEvent(EventType.SPAWN_CRUSHING_BOX, {"x":x,"y":y,"t":CRUSHING_BOX_DURATION}))
+        if profiler is not None:
+            profiler.mark(FALLING_BOXES_PHASE)
 
         # Spawn new falling boxes
         box = self.falling_box_scheduler.tick(self)
-        if box:
-            self.register_event(GameEvent(EventType.SPAWN_FALLING_BOX, {"x":box.x,"y":box.y,"t":box.ticks_to_expiration}))
-
-        # handle bombs
-        i = 0
-        while i < len(self.bombs):
-            bomb = self.bombs[i]
-            bomb.tick()
-            exploded = False
-            if bomb.timer_expired():
-                exploded = True
-            for explosion in self.explosions:
-                if bomb.x == explosion.x and bomb.y == explosion.y:
-                    exploded = True
-                    break
-            if exploded:
-                player = self.players[bomb.get_owner_id()]
-                player.bombs += 1
-                self.register_event(GameEvent(EventType.PLAYER_CHANGE_BOMBS_COUNT, {"id": id, "b": player.bombs}))
-                bx, by = bomb.get_pos()
-                self.explode(bomb)
-                self.tiles[int(bx)][int(by)].set_content(None)
-                del self.bombs[i]
-                self.register_event(GameEvent(EventType.REMOVE_BOMB, {"x": bx, "y": by}))
-                ## TODO code structuring / levels of event creation
-                continue
-            else:
-                i += 1
+        if box is not None:
+            self.add_falling_box(box)
+            self.register_event(GameEvent(EventType.SPAWN_FALLING_BOX, {"x": entities.xs[box], "y": entities.ys[box],
+                                                                        "t": entities.durations[box]}))
+        if profiler is not None:
+            profiler.mark(SPAWNS_PHASE)
 
+        self.explode_due_bombs(now)
+        if profiler is not None:
+            profiler.mark(BOMBS_PHASE)
 
         # handle spike traps
-        for trap in self.spike_traps:
-            trap.tick(self)
-            if trap.should_activate():
-                # spring the trap!
-                trap.activate()
-                self.register_event(GameEvent(EventType.ACTIVATE_TRAP, {"x": trap.x, "y": trap.y}))
-                trap.handle_damage(self.players, self)
-            elif trap.is_active():
-                trap.handle_damage(self.players, self)
-
+        for trap in self.trap_timers.pop_due(now):
+            ticks_to_fire = trap.fire(self)
+            if ticks_to_fire is not None:
+                self.trap_timers.schedule(trap, now + ticks_to_fire)
+        if profiler is not None:
+            profiler.mark(TRAPS_PHASE)
 
         # handle explosions
-        i = 0
-        while i < len(self.explosions):
-            explosion = self.explosions[i]
-            explosion.tick()
-            ex, ey = explosion.get_pos()
-            # check if player is here
-            for id, player in enumerate(self.players):
-                if not player.is_immortal():
-                    # print(floor(player.x - 0.5), floor(player.y - 0.5))
-                    if floor(player.x) == ex and floor(player.y) == ey:
-                        player.lifes -= 1
-                        player.set_immortal_time(200)
-                        self.register_event(GameEvent(EventType.PLAYER_DAMAGED, {"id": id, "dmg": 1}))
-
-            if explosion.timer_expired():
-                self.register_event(GameEvent(EventType.REMOVE_EXPLOSION, {"x": ex, "y": ey}))
-                del self.explosions[i]
-            else:
-                i += 1
+        for id, player in enumerate(self.players):
+            # check if player is in an explosion
+            if not player.is_immortal() and tiles.has_explosion(floor(player.x), floor(player.y)):
+                player.lifes -= 1
+                player.set_immortal_time(200)
+                self.register_event(GameEvent(EventType.PLAYER_DAMAGED, {"id": id, "dmg": 1}))
+        xs, ys = entities.xs, entities.ys
+        for explosion in self.explosion_timers.pop_due(now):
+            x, y = xs[explosion], ys[explosion]
+            entities.remove(explosion)
+            tiles.remove_explosion(x, y)
+            self.register_event(GameEvent(EventType.REMOVE_EXPLOSION, {"x": x, "y": y}))
+        if profiler is not None:
+            profiler.mark(EXPLOSIONS_PHASE)
 
         # handle players
         for i, player in enumerate(self.players):
@@ -526,33 +544,87 @@ class Game:
                 self.winner = int(not (i))
                 self.register_event(GameEvent(EventType.WINNER, {"id": self.winner}))
 
-    def explode(self, bomb: Bomb):
-        power = bomb.get_power()
-        origin_x, origin_y = bomb.get_pos()
-        explosion = Explosion(origin_x, origin_y, EXPLOSION_DURATION)
-        self.explosions.append(explosion)
-        for dir in DIR.values():
-            for i in range(power):
-                current_x = int(origin_x + dir[0] * i)
-                current_y = int(origin_y + dir[1] * i)
-                tile = self.tiles[current_x][current_y]
-                if tile.type == TileType.EMPTY or (tile.has_content() and tile.get_content().is_of_type(EntityType.BOX)):
-                    explosion = Explosion(current_x, current_y, EXPLOSION_DURATION)
-                    self.explosions.append(explosion)
-                    self.register_event(GameEvent(EventType.SPAWN_EXPLOSION, {"x": current_x, "y": current_y}))
-
-                    # Destroy Boxes
-                    if tile.has_content() and tile.get_content().is_of_type(EntityType.BOX):
-                        tile.set_content(None)
-                        self.register_event(GameEvent(EventType.REMOVE_BOX, {"x": current_x, "y": current_y}))
-                        # On an empty Tile: Attempt to spawn a power-Up:
-                        if tile.type == TileType.EMPTY:
-                            power_up = self.power_up_scheduler.tick(current_x, current_y, self)
-                            if power_up:
-                                self.register_event(GameEvent(EventType.SPAWN_POWER_UP, {"x": power_up.x, "y":power_up.y,"t":power_up.get_power_up_type().value}))
-                        break
-                else:
+        if DEBUG_PASSABILITY:
+            self.tiles.check_passable()
+        if profiler is not None:
+            profiler.mark(PLAYERS_PHASE)
+
+    def add_falling_box(self, box: int) -> None:
+        """ :param box: entity ID of a falling box already placed on its tile """
+        self.falling_box_timers.schedule(box, self.ticks + self.entities.durations[box])
+
+    def add_explosion(self, x: int, y: int, duration: int = EXPLOSION_DURATION) -> int:
+        """ :returns: the entity ID of the new explosion """
+        explosion = self.entities.spawn(EXPLOSION_KIND, x, y, duration)
+        self.tiles.add_explosion(x, y)
+        # Explosions are spawned in the bomb phase and already count the explosion phase of this tick
+        self.explosion_timers.schedule(explosion, self.ticks + duration - 1)
+        return explosion
+
+    def explode_due_bombs(self, now: int) -> None:
+        """ The bomb phase of update(). Bombs caught in a blast go off in the same tick, breadth first,
+            so a whole chain reaction is resolved in one pass
+        """
+        entities = self.entities
+        exploding = deque(self.bomb_timers.pop_due(now))
+        while exploding:
+            bomb = exploding.popleft()
+            # caught in more than one blast, already went off. No bombs are spawned here, so a freed row
+            # was reused by an explosion or power-up if at all
+            if entities.kinds[bomb] != BOMB_KIND:
+                continue
+            owner = entities.owners[bomb]
+            player = self.players[owner]
+            player.bombs += 1
+            self.register_event(GameEvent(EventType.PLAYER_CHANGE_BOMBS_COUNT, {"id": owner, "b": player.bombs}))
+            bx, by = entities.position(bomb)
+            for caught_bomb in self.explode(bomb):
+                self.bomb_timers.cancel(caught_bomb)
+                exploding.append(caught_bomb)
+            self.tiles.set_content(bx, by, NO_ENTITY)
+            entities.remove(bomb)
+            self.register_event(GameEvent(EventType.REMOVE_BOMB, {"x": bx, "y": by}))
+            ## TODO code structuring / levels of event creation
+
+    def explode(self, bomb: int) -> List[int]:
+        """ Spawns the explosions of the bomb along its blast rays and destroys the first box on each ray.
+            :param bomb: entity ID of the bomb
+            :returns: the entity IDs of the other bombs caught in the blast
+        """
+        entities = self.entities
+        power = entities.powers[bomb]
+        origin_x, origin_y = entities.position(bomb)
+        self.add_explosion(origin_x, origin_y)
+        tiles = self.tiles
+        content_kinds = tiles.content_kinds
+        caught_bombs = []
+        for ray, ends_at_wall in tiles.blast_rays(origin_x, origin_y):
+            reach = min(power, len(ray))
+            for i in range(reach):
+                current_x, current_y = ray[i]
+                kind = content_kinds.item(current_x, current_y)
+                at_wall = ends_at_wall and i == len(ray) - 1
+                if at_wall and kind != BOX_KIND:
+                    break
+                self.add_explosion(current_x, current_y)
+                self.register_event(GameEvent(EventType.SPAWN_EXPLOSION, {"x": current_x, "y": current_y}))
+
+                # Destroy Boxes
+                if kind == BOX_KIND:
+                    entities.remove(tiles.get_content(current_x, current_y))
+                    tiles.set_content(current_x, current_y, NO_ENTITY)
+                    self.register_event(GameEvent(EventType.REMOVE_BOX, {"x": current_x, "y": current_y}))
+                    # On an empty Tile: Attempt to spawn a power-Up:
+                    if not at_wall:
+                        power_up = self.power_up_scheduler.tick(current_x, current_y, self)
+                        if power_up is not None:
+                            self.register_event(GameEvent(EventType.SPAWN_POWER_UP, {"x": current_x, "y": current_y, "t": entities.powers[power_up]}))
                     break
+                if kind == BOMB_KIND:
+                    caught_bomb = tiles.get_content(current_x, current_y)
+                    if caught_bomb != bomb:
+                        caught_bombs.append(caught_bomb)
+        return caught_bombs
 
     def load_from_file(self, filename):
         f = open(filename, 'r')
@@ -563,9 +635,10 @@ class Game:
         self.height = len(tiles)
         self.width = len(tiles[0])
 
-        self.tiles = [[Tile(TileType(tile['type']), tile['sprite'], x, y) for y, tile in enumerate(row)]
-                      for x, row
-                      in enumerate(tiles)]
+        self.tiles = TileGrid(len(tiles), len(tiles[0]), self.entities)
+        for x, row in enumerate(tiles):
+            for y, tile in enumerate(row):
+                self.tiles.set_tile(x, y, TileType(tile['type']), tile['sprite'])
 
         # place objects (such as boxes) on
         objects = field['objects']
@@ -585,14 +658,14 @@ class Game:
         f = open('field.json', 'w')
         f.write(json.dumps({
             'tiles': [[{
-                'type': tile.type.value,
-                'sprite': tile.sprite_id
-            } for tile in row] for row in self.tiles],
+                'type': type,
+                'sprite': sprite_id
+            } for type, sprite_id in row] for row in self.tiles.field_data()],
             'objects': [{
                 'type': 'box',
-                'x': box.x,
-                'y': box.y
-            } for box in map(lambda t: t.get_content(), filter(lambda t: t.has_content() and t.get_content.is_of_type(EntityType.BOX), self.tiles))],
+                'x': x,
+                'y': y
+            } for x, y in self.tiles.positions_of(EntityType.BOX)],
             'starts': [{
                 'x': position[0],
                 'y': position[1]
@@ -600,20 +673,22 @@ class Game:
         }))
         f.close()
 
-    def apply_power_up(self, player:Player, id:int, power_up:PowerUp):
-        if power_up.get_power_up_type() == PowerUpType.INVERT_KEYBOARD:
+    def apply_power_up(self, player:Player, id:int, power_up:int):
+        """ :param power_up: entity ID of the collected power-up """
+        power_up_type = PowerUpType(self.entities.powers[power_up])
+        if power_up_type == PowerUpType.INVERT_KEYBOARD:
             player.set_invertion_time(INVERTED_KEYBOARD_TICKS)
             self.register_event(GameEvent(EventType.PLAYER_INVERT_KEYBOARD_ON, {"id": id}))
 
-        elif power_up.get_power_up_type() == PowerUpType.AUTOWALK:
+        elif power_up_type == PowerUpType.AUTOWALK:
             player.set_autowalk_time(AUTOWALK_TICKS)
             self.register_event(GameEvent(EventType.PLAYER_AUTOWALK_ON, {"id": id}))
 
-        elif power_up.get_power_up_type() == PowerUpType.POWER_PLUS:
+        elif power_up_type == PowerUpType.POWER_PLUS:
             player.power += 1
             self.register_event(GameEvent(EventType.PLAYER_CHANGE_POWER_AMOUNT, {"id": id, "p": player.power}))
 
-        elif power_up.get_power_up_type() == PowerUpType.BOMB_PLUS:
+        elif power_up_type == PowerUpType.BOMB_PLUS:
             player.bombs += 1
             self.register_event(GameEvent(EventType.PLAYER_CHANGE_BOMBS_COUNT, {"id": id, "b": player.bombs}))
 
@@ -628,10 +703,3 @@ class Game:
         self.players[not id].slime_cooldown_ticks = SLIME_COOLDOWN
         self.register_event(GameEvent(EventType.PLAYER_SLIMED, {"id": id}))
 
-    def precompute_anger_history_max(self):
-        temp_history = [1.0 for _ in range(ANGER_HISTORY_LEN)]
-        for _ in range(ANGER_HISTORY_LEN):
-            for i in range(1, ANGER_HISTORY_LEN):
-                temp_history[i-1] = temp_history[i] - (temp_history[i] * ANGER_HISTORY_DECAY_FACTOR)
-                temp_history[-1] = 1.0
-        return sum(temp_history)
@@ -1,11 +1,17 @@
+import base64
+import json
+import struct
 import time
+import zlib
 
 
 class GameSerializer:
-    def __init__(self, dir_name, buffer_size=1000):
+    def __init__(self, dir_name, buffer_size=1000, match_id=0):
+        """ :param match_id: the first match of a server run writes game.csv, later matches game_<match_id>.csv """
         self.rows = []
         self.buffer_size = buffer_size
-        self.file_name = "../replays/" + dir_name + "/game.csv"
+        file_name = "game.csv" if match_id == 0 else "game_" + str(match_id) + ".csv"
+        self.file_name = "../replays/" + dir_name + "/" + file_name
 
     def write_header(self, field, traps, player_data):
         with open(self.file_name, "a") as f:
@@ -13,11 +19,69 @@ class GameSerializer:
             f.write(str(traps) + "\n")
             f.write(str(player_data) + "\n")
 
-    def add_events(self, events):
-        t = time.time()
-        self.rows.append((t, [x.encode() for x in events]))
+    def add_events(self, packed_events: bytes, t: float = None):
+        """ :param packed_events: the events of one tick, packed by EventCodec. Written base64 encoded
+            :param t: the time of the tick. Defaults to now
+        """
+        if t is None:
+            t = time.time()
+        self.rows.append((t, base64.b64encode(packed_events).decode()))
         if len(self.rows) > self.buffer_size:
-            with open(self.file_name, "a") as f:
-                for row in self.rows:
-                    f.write(";".join([str(x) for x in row]) + "\n" )
-            self.rows = []
+            self.flush()
+
+    def flush(self):
+        with open(self.file_name, "a") as f:
+            for row in self.rows:
+                f.write(";".join([str(x) for x in row]) + "\n" )
+        self.rows = []
+
+
+INPUT_ACTIONS = ["wait", "up", "down", "left", "right", "bomb", "slime", "taunt"]  # index = action code
+INPUT_ACTION_CODES = {action: code for code, action in enumerate(INPUT_ACTIONS)}
+ANGERS_RECORD = 0xFF  # record marker, followed by the anger value of each player as a double
+ANGERS_FORMAT = "!2d"
+
+
+class InputRecorder:
+    """ Records a 2-player match as its seed plus the inputs of every tick, instead of every event.
+        Re-simulating the inputs (see InputReplay.py) plays the same match and gives back its events,
+        so a recording is a tiny fraction of the size of a GameSerializer file.
+        The file is one zlib stream: a JSON header line, then one byte per tick holding the action codes
+        of both players (4 bits each, player 0 first). An ANGERS_RECORD sets the anger values
+        for the ticks that follow it.
+    """
+    def __init__(self, dir_name, seed: int, match_id=0, tick_rate: int = 60, buffer_size=4096):
+        """ :param seed: the seed of the match's Game
+            :param buffer_size: bytes collected before they are compressed and written
+        """
+        file_name = "game.replay" if match_id == 0 else "game_" + str(match_id) + ".replay"
+        self.file_name = "../replays/" + dir_name + "/" + file_name
+        self.buffer_size = buffer_size
+        self.compressor = zlib.compressobj(9)
+        self.data = bytearray(json.dumps({"seed": seed, "start": time.time(), "tick_rate": tick_rate}).encode() + b"\n")
+        self.angers = [0., 0.]
+
+    def set_angers(self, angers: list) -> None:
+        """ :param angers: the raw anger value of each player from the next tick on """
+        if angers != self.angers:
+            self.angers = list(angers)
+            self.data.append(ANGERS_RECORD)
+            self.data += struct.pack(ANGERS_FORMAT, *angers)
+
+    def add_tick(self, actions: list) -> None:
+        """ :param actions: the action of each player this tick """
+        self.data.append(INPUT_ACTION_CODES[actions[0]] << 4 | INPUT_ACTION_CODES[actions[1]])
+        if len(self.data) >= self.buffer_size:
+            self.write(self.compressor.compress(self.data))
+
+    def write(self, compressed: bytes) -> None:
+        self.data = bytearray()
+        with open(self.file_name, "ab") as f:
+            f.write(compressed)
+
+    def close(self) -> None:
+        """ Ends the recording """
+        if self.compressor is None:
+            return
+        self.write(self.compressor.compress(self.data) + self.compressor.flush())
+        self.compressor = None
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+""" Re-simulates a match recorded by GameSerializer.InputRecorder and writes its events in the
+    GameSerializer format, which the client's GameReplay.py plays.
+    Run from this directory: python InputReplay.py <replay dir> [match ID]
+"""
+import argparse
+import json
+import os
+import struct
+import zlib
+from typing import Iterator, Tuple
+
+from EventCodec import encode_events
+from GameSerializer import GameSerializer, INPUT_ACTIONS, ANGERS_RECORD, ANGERS_FORMAT
+from Match import Match, NUM_PLAYERS
+from Tiles import FieldHistory
+
+
+def read_recording(file_name: str) -> Tuple[dict, bytes]:
+    """ :returns: the header and the tick records of an InputRecorder file """
+    with open(file_name, "rb") as f:
+        data = zlib.decompressobj().decompress(f.read())  # also reads recordings that were cut off
+    header, records = data.split(b"\n", 1)
+    return json.loads(header), records
+
+
+def start_match(header: dict) -> Match:
+    """ :returns: the recorded match before its first tick """
+    match = Match(0, seed=header["seed"])
+    for player_id in range(NUM_PLAYERS):
+        match.set_ready(player_id)
+    return match
+
+
+def resimulate(match: Match, records: bytes) -> Iterator[bytes]:
+    """ Plays the recorded match again
+        :param match: see start_match()
+        :returns: per tick the events the match packed for its GameSerializer
+    """
+    angers_size = struct.calcsize(ANGERS_FORMAT)
+    i = 0
+    while i < len(records):
+        if records[i] == ANGERS_RECORD:
+            match.set_angers(struct.unpack_from(ANGERS_FORMAT, records, i + 1))
+            i += 1 + angers_size
+            continue
+        match.put_input(0, INPUT_ACTIONS[records[i] >> 4])
+        match.put_input(1, INPUT_ACTIONS[records[i] & 0x0F])
+        i += 1
+        output = match.tick()
+        packed_events = output["e"]
+        if "fp" in output:
+            packed_events = encode_events(FieldHistory.to_events(output["fp"])) + packed_events
+        yield packed_events
+
+
+def write_events(dir_name: str, match_id: int = 0) -> str:
+    """ Re-simulates a recording of the replays sub-directory and writes its events next to it
+        :returns: the name of the events file
+    """
+    file_name = "game.replay" if match_id == 0 else "game_" + str(match_id) + ".replay"
+    header, records = read_recording("../replays/" + dir_name + "/" + file_name)
+    serializer = GameSerializer(dir_name, match_id=match_id)
+    if os.path.exists(serializer.file_name):
+        print("[REPLAY]", serializer.file_name, "already exists")
+        return serializer.file_name
+    match = start_match(header)
+    serializer.write_header(match.field_data(), match.trap_data(), match.player_data())
+    ticks = 0
+    for packed_events in resimulate(match, records):
+        serializer.add_events(packed_events, header["start"] + ticks / header["tick_rate"])
+        ticks += 1
+    serializer.flush()
+    print("[REPLAY] Re-simulated", ticks, "ticks into", serializer.file_name)
+    return serializer.file_name
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("replay_dir", help="Folder name of the recording in ../replays/")
+    parser.add_argument("match_id", help="Match ID of the recording. Defaults to 0.", nargs="?", default=0, type=int)
+    args = parser.parse_args()
+    write_events(args.replay_dir, args.match_id)
@@ -0,0 +1,100 @@
+import asyncio
+from collections import deque
+from typing import Optional
+
+from Match import NUM_PLAYERS
+from utils import FrameCompressor, FrameReader, CLIENT_FRAME_TYPES
+
+PACKET_SIZE = 4096
+
+
+class PlayerSession:
+    """ A connected player client, in the lobby or in a match """
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.addr = writer.get_extra_info("peername")
+        self.match = None  # MatchHandle
+        self.player_id: Optional[int] = None
+        self.events = None  # EventCursor into the match's packed events
+        self.snapshot: Optional[bytes] = None  # packed events that resync the client, sent before the next events
+        self.resyncing = False  # a snapshot was requested
+        self.updated = asyncio.Event()  # set when the match produced output for this session
+        self.frames = FrameReader(CLIENT_FRAME_TYPES)
+        self.compressor = FrameCompressor()
+
+    async def receive(self):
+        """ :returns: the next message of the client, or None if it disconnected """
+        while not self.frames.has_message():
+            data = await self.reader.read(PACKET_SIZE)
+            if not data:
+                return None
+            self.frames.feed(data)
+        return self.frames.pop_message()
+
+    async def send(self, data) -> None:
+        self.writer.write(self.compressor.encode(data))
+        await self.writer.drain()
+
+    async def send_frame(self, frame_type: int, payload: bytes) -> None:
+        self.writer.write(self.compressor.frame(frame_type, payload))
+        await self.writer.drain()
+
+    def compression_stats(self) -> dict:
+        stats = self.compressor.stats()
+        stats["decompress_cpu_ms"] = self.frames.cpu_ns / 1e6
+        return stats
+
+    def notify(self) -> None:
+        """ Wakes up the handler of this session to send the match's latest output """
+        self.updated.set()
+
+    def read_events(self) -> Optional[list]:
+        """ :returns: the packed events of the ticks not yet sent to the client, or None if the client
+                      fell so far behind that the match's event log dropped some of them
+        """
+        if self.resyncing:
+            return []
+        chunks = self.events.read()
+        if chunks is not None and self.snapshot is not None:
+            chunks.insert(0, self.snapshot)
+            self.snapshot = None
+        return chunks
+
+    def resync(self, snapshot: bytes) -> None:
+        """ :param snapshot: packed events that rebuild the game state at the match's latest tick """
+        self.snapshot = snapshot
+        self.events = self.match.events.subscribe()
+        self.resyncing = False
+        self.notify()
+
+    def join_match(self, match, player_id: int) -> None:
+        self.match = match
+        self.player_id = player_id
+        self.events = match.events.subscribe()
+        self.snapshot = None
+        self.resyncing = False
+        self.updated.clear()
+
+    def leave_match(self) -> None:
+        self.match = None
+        self.player_id = None
+        self.events = None
+        self.snapshot = None
+
+
+class Lobby:
+    """ Pairs waiting players into matches in the order they arrived """
+    def __init__(self, match_manager):
+        self.match_manager = match_manager
+        self.waiting = deque()
+
+    def join(self, session: PlayerSession) -> None:
+        session.leave_match()
+        self.waiting.append(session)
+        while len(self.waiting) >= NUM_PLAYERS and self.match_manager.can_host():
+            self.match_manager.create_match([self.waiting.popleft() for _ in range(NUM_PLAYERS)])
+
+    def leave(self, session: PlayerSession) -> None:
+        if session in self.waiting:
+            self.waiting.remove(session)
@@ -0,0 +1,133 @@
+from typing import Optional
+
+from EventCodec import encode_events
+from EventLog import coalesce_events
+from Events import EventType
+from Game import Game
+from GameSerializer import GameSerializer, InputRecorder
+from Tiles import FieldHistory
+from TickLoop import InputQueue
+from TickProfiler import TickProfiler, OUTPUT_PHASE
+
+NUM_PLAYERS = 2
+
+
+class Match:
+    """ One 2-player game hosted by a match worker process.
+        The connections to the players live in the main server process, which forwards
+        their actions here and receives the output of every tick.
+    """
+    def __init__(self, match_id: int, replay_dir: Optional[str] = None, record_inputs: bool = False,
+                 seed: Optional[int] = None, profiler: Optional[TickProfiler] = None):
+        """ :param match_id: ID given to this match by the MatchManager
+            :param replay_dir: replays sub-directory to serialize the game into, or None
+            :param record_inputs: record only the seed and the inputs of the game instead of all its events
+            :param seed: seed of the game. Random if None
+            :param profiler: times the phases of every tick, e.g. shared by all matches of a worker. None to not profile
+        """
+        self.match_id = match_id
+        self.game = Game(seed=seed)
+        self.game.profiler = profiler
+        for _ in range(NUM_PLAYERS):
+            self.game.create_player()
+        self.inputs = InputQueue(NUM_PLAYERS)
+        self.ready_players = set()  # IDs of players that finished the GAME_START handshake
+        self.events = self.game.events.subscribe(0)  # including the events of the game's setup
+        self.field_version = self.game.field_version  # last field version sent to the main process
+        self.finished = False
+        self.game_serializer = None
+        self.input_recorder = None
+        if replay_dir is not None and record_inputs:
+            self.input_recorder = InputRecorder(replay_dir, self.game.seed, match_id=match_id)
+        elif replay_dir is not None:
+            self.game_serializer = GameSerializer(replay_dir, match_id=match_id)
+            self.game_serializer.write_header(self.field_data(), self.trap_data(), self.player_data())
+
+    def field_data(self) -> list:
+        return self.game.tiles.field_data()
+
+    def trap_data(self) -> list:
+        return [(t.x, t.y, self.game.ticks_until(t)) for t in self.game.spike_traps]
+
+    def player_data(self) -> list:
+        return [{"id": id, "x": round(p.x, 2), "y": round(p.y, 2), "l": p.lifes, "b": p.bombs, "p": p.power}
+                for id, p in enumerate(self.game.players)]
+
+    def start_data(self) -> dict:
+        """ :returns: everything the main process needs for the MAP_DATA and PLAYER_DATA handshake """
+        return {"fv": self.field_version, "f": self.field_data(), "t": self.trap_data(), "p": self.player_data()}
+
+    def put_input(self, player_id: int, action: str, seq: Optional[int] = None) -> None:
+        """ :param seq: the client's sequence number of the action, acknowledged with INPUT_ACK once applied """
+        self.inputs.put(player_id, action, seq)
+
+    def set_ready(self, player_id: int) -> None:
+        self.ready_players.add(player_id)
+
+    def set_angers(self, angers: list) -> None:
+        """ :param angers: raw anger value per player ID """
+        for i in range(NUM_PLAYERS):
+            self.game.raw_angers[i] = angers[i]
+        if self.input_recorder is not None:
+            self.input_recorder.set_angers(self.game.raw_angers)
+
+    def tick(self) -> Optional[dict]:
+        """ Advances the game by one tick once both players are ready.
+            :returns: the output of this tick for the main process, or None if nothing happened.
+                      "e": the events packed by EventCodec, followed by the INPUT_ACKs of the tick,
+                      "w": the winner or None,
+                      plus "fv" and the patch "fp" when the field changed. If the patch
+                      is no longer known, the full field "f" and traps "t" instead.
+        """
+        if self.finished or len(self.ready_players) < NUM_PLAYERS:
+            return None
+        profiler = self.game.profiler
+        if profiler is not None:
+            profiler.start()
+        acked_seqs = list(self.inputs.consumed_seqs)
+        actions = self.inputs.pop_batch()
+        if self.input_recorder is not None:
+            self.input_recorder.add_tick(actions)
+        for id, action in enumerate(actions):
+            self.game.player_action(id, action)
+        self.game.update()
+
+        # Both players see the same events, the main process fans them out
+        new_game_events = self.events.read()
+        if new_game_events is None:  # more events in one tick than the log holds
+            self.events = self.game.events.subscribe()
+            packed_events = self.snapshot()
+        else:
+            packed_events = encode_events(coalesce_events([event.encode() for event in new_game_events]))
+        # Tell the predicting clients up to which action their player's position is authoritative
+        acks = [(EventType.INPUT_ACK.value, {"id": id, "s": seq}) for id, seq in enumerate(self.inputs.consumed_seqs)
+                if seq != acked_seqs[id]]
+        output = {"e": packed_events + encode_events(acks) if acks else packed_events, "w": self.game.winner}
+
+        if self.field_version != self.game.field_version:
+            changes = self.game.field_history.changes_since(self.field_version)
+            self.field_version = self.game.field_version
+            if changes is None:  # more changes in one tick than the history holds
+                output.update({"fv": self.field_version, "f": self.field_data(), "t": self.trap_data()})
+            else:
+                output.update({"fv": self.field_version, "fp": changes})
+                packed_events = encode_events(FieldHistory.to_events(changes)) + packed_events
+        if self.game_serializer is not None:
+            self.game_serializer.add_events(packed_events)
+        if self.game.winner is not None:
+            self.close()
+        if profiler is not None:
+            profiler.mark(OUTPUT_PHASE)
+            profiler.end_tick()
+        return output
+
+    def snapshot(self) -> bytes:
+        """ :returns: the packed events that resync a client to the current game state """
+        return encode_events(self.game.snapshot_events())
+
+    def close(self) -> None:
+        self.finished = True
+        if self.game_serializer is not None:
+            self.game_serializer.flush()
+        if self.input_recorder is not None:
+            self.input_recorder.close()
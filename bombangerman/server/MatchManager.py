@@ -0,0 +1,375 @@
+import asyncio
+import multiprocessing
+import os
+import traceback
+from typing import Dict, List, Optional
+
+from EventLog import EventLog
+from Match import Match, NUM_PLAYERS
+from Spectators import broadcast_frames
+from Tiles import FieldHistory
+from TickLoop import TickLoop
+from TickProfiler import TickProfiler
+
+MATCH_LOG_TICKS = 256  # ticks of events kept for players that are behind, about 4 seconds
+
+
+def match_worker(conn, tick_rate: int, profile_ticks: bool = False) -> None:
+    """ Entry point of a match worker process. Ticks all matches assigned to this worker
+        at tick_rate and sends their output back to the main process once per tick.
+        :param conn: this worker's end of the Pipe to the MatchManager
+        :param profile_ticks: time the phases of the ticks of all matches in one TickProfiler,
+                              sent to the main process when it asks and when the worker stops
+    """
+    matches: Dict[int, Match] = {}
+    profiler = TickProfiler() if profile_ticks else None
+
+    def fail(match_id: int) -> None:
+        """ Closes a match whose game raised, so that the other matches of this worker keep running """
+        print("[ERROR] Match", match_id, "failed")
+        traceback.print_exc()
+        match = matches.pop(match_id, None)
+        if match is not None:
+            match.close()
+        conn.send(("failed", match_id))
+
+    def tick_all():
+        outputs = []
+        for match_id, match in list(matches.items()):
+            try:
+                output = match.tick()
+            except Exception:
+                fail(match_id)
+                continue
+            if output is not None:
+                outputs.append((match_id, output))
+            if match.finished:
+                del matches[match_id]
+        if outputs:
+            conn.send(("tick", outputs))
+
+    tick_loop = TickLoop(tick_all, tick_rate=tick_rate)
+    try:
+        running = True
+        while running:
+            timeout = tick_loop.step()
+            # waiting for commands doubles as the sleep until the next tick
+            while running and conn.poll(timeout):
+                command, *args = conn.recv()
+                if command == "input":
+                    match_id, player_id, action, seq = args
+                    if match_id in matches:
+                        matches[match_id].put_input(player_id, action, seq)
+                elif command == "angers":
+                    match_id, angers = args
+                    if match_id in matches:
+                        matches[match_id].set_angers(angers)
+                elif command == "ready":
+                    match_id, player_id = args
+                    if match_id in matches:
+                        matches[match_id].set_ready(player_id)
+                elif command == "snapshot":
+                    match_id = args[0]
+                    if match_id in matches:
+                        conn.send(("snapshot", match_id, matches[match_id].snapshot()))
+                elif command == "create":
+                    match_id, replay_dir, record_inputs = args
+                    try:
+                        match = Match(match_id, replay_dir, record_inputs, profiler=profiler)
+                    except Exception:
+                        fail(match_id)
+                    else:
+                        matches[match_id] = match
+                        conn.send(("started", match_id, match.start_data()))
+                elif command == "close":
+                    match = matches.pop(args[0], None)
+                    if match is not None:
+                        match.close()
+                elif command == "profile":
+                    conn.send(("profile", profiler))
+                elif command == "stop":
+                    running = False
+                else:
+                    raise NotImplementedError("match worker command", command, "is not implemented")
+                timeout = 0
+    except (KeyboardInterrupt, EOFError):
+        pass
+    finally:
+        for match in matches.values():
+            match.close()
+        if profiler is not None:
+            try:
+                conn.send(("profile", profiler))
+            except (BrokenPipeError, OSError):
+                pass
+
+
+def print_profile(profiler: TickProfiler, label: str) -> None:
+    print("[PROFILE]", label + ":", profiler.ticks, "ticks")
+    for line in profiler.report():
+        print("[PROFILE]", line)
+
+
+class MatchHandle:
+    """ The main process' view of a match running in a worker process """
+    def __init__(self, match_id: int, worker_index: int, sessions: list):
+        """ :param sessions: the PlayerSessions of this match, indexed by player ID """
+        self.match_id = match_id
+        self.worker_index = worker_index
+        self.sessions = sessions
+        self.started = asyncio.get_running_loop().create_future()  # resolves to the start data
+        self.field_version = 0
+        self.field = None
+        self.traps = None
+        self.field_history = FieldHistory()  # to patch clients that are behind the current field version
+        self.events = EventLog(MATCH_LOG_TICKS)  # packed events, one entry per tick
+        self.spectators = []
+        self.spectator_frames = EventLog(MATCH_LOG_TICKS)  # frames of each tick, encoded once for all spectators
+        self.resyncing = []  # sessions and spectators waiting for a snapshot of the game
+        self.winner: Optional[int] = None
+        self.aborted = False  # the match failed in its worker and ended without a winner
+
+    def is_over(self) -> bool:
+        return self.winner is not None or self.aborted
+
+    def notify_all(self) -> None:
+        for watcher in self.sessions + self.spectators:
+            watcher.notify()
+
+    def set_field(self, field_version: int, field: list, traps: list) -> None:
+        self.field_version, self.field, self.traps = field_version, field, traps
+        self.field_history.reset(field_version)
+
+    def apply_field_patch(self, changes: list) -> None:
+        """ :param changes: FieldHistory changes of the match's Game """
+        for change in changes:
+            _, x, y, type, sprite_id = change
+            self.field[x][y] = (type, sprite_id)
+            self.field_history.add(change)
+        self.field_version = self.field_history.version
+
+
+class MatchManager:
+    """ Hosts any number of 2-player matches across a pool of worker processes (one per core by default).
+        Each match is assigned to the worker with the fewest matches and stays there until it ends.
+        Player actions and anger values are routed to the worker hosting the match,
+        tick output is routed back to the PlayerSessions of the match.
+        A match that fails in its worker, or whose worker dies, ends without a winner.
+    """
+    def __init__(self, num_workers: Optional[int] = None, tick_rate: int = 60, replay_dir: Optional[str] = None,
+                 record_inputs: bool = False, profile_ticks: bool = False):
+        """ :param num_workers: number of worker processes. Defaults to the number of cores
+            :param replay_dir: replays sub-directory to serialize all matches into, or None
+            :param record_inputs: record only the seed and inputs of each match, see GameSerializer.InputRecorder
+            :param profile_ticks: time the phases of all ticks, see request_profiles()
+        """
+        self.num_workers = num_workers or os.cpu_count() or 1
+        self.tick_rate = tick_rate
+        self.replay_dir = replay_dir
+        self.record_inputs = record_inputs
+        self.profile_ticks = profile_ticks
+        self.profiles: List[TickProfiler] = []  # answers to the pending request_profiles()
+        self.awaited_profiles = 0
+        self.connections = []
+        self.processes = []
+        self.worker_loads = {index: 0 for index in range(self.num_workers)}  # number of matches per live worker
+        self.matches: Dict[int, MatchHandle] = {}
+        self.next_match_id = 0
+
+    def start_workers(self) -> None:
+        """ Must be called before the asyncio event loop and the pygame window are started """
+        for _ in range(self.num_workers):
+            conn, worker_conn = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=match_worker, args=(worker_conn, self.tick_rate, self.profile_ticks),
+                                              daemon=True)
+            process.start()
+            self.connections.append(conn)
+            self.processes.append(process)
+        print("[SERVER] Started", self.num_workers, "match worker processes")
+
+    def attach(self, loop: asyncio.AbstractEventLoop) -> None:
+        """ Starts reading worker output on the given event loop """
+        for index, conn in enumerate(self.connections):
+            loop.add_reader(conn.fileno(), self.on_worker_readable, index)
+
+    def stop_workers(self) -> None:
+        for conn in self.connections:
+            try:
+                conn.send(("stop",))
+            except (BrokenPipeError, OSError):
+                pass
+        if self.profile_ticks:
+            print_profile(TickProfiler.merged(self.read_final_profiles()), "all ticks")
+        for process in self.processes:
+            process.join(timeout=2)
+            if process.is_alive():
+                process.terminate()
+
+    def can_host(self) -> bool:
+        """ :returns: False once all workers died """
+        return len(self.worker_loads) > 0
+
+    def create_match(self, sessions: list) -> MatchHandle:
+        """ :param sessions: one PlayerSession per player. Their index is the player ID """
+        assert len(sessions) == NUM_PLAYERS
+        worker_index = min(self.worker_loads, key=self.worker_loads.get)
+        match = MatchHandle(self.next_match_id, worker_index, sessions)
+        self.next_match_id += 1
+        self.matches[match.match_id] = match
+        self.worker_loads[worker_index] += 1
+        for player_id, session in enumerate(sessions):
+            session.join_match(match, player_id)
+        print("[SERVER] Match", match.match_id, "assigned to worker", worker_index)
+        self.send(worker_index, ("create", match.match_id, self.replay_dir, self.record_inputs))
+        return match
+
+    def send(self, worker_index: int, command: tuple) -> None:
+        """ Sends a command to a worker. A worker that can no longer be reached is treated as dead """
+        if worker_index not in self.worker_loads:
+            return
+        try:
+            self.connections[worker_index].send(command)
+        except (BrokenPipeError, OSError):
+            self.worker_died(worker_index)
+
+    def read_final_profiles(self) -> List[TickProfiler]:
+        """ :returns: the profile each worker sends when it stops. Call after sending "stop" """
+        profiles = []
+        for conn in self.connections:
+            profile = None
+            try:
+                while conn.poll(2):
+                    message = conn.recv()
+                    if message[0] == "profile":
+                        profile = message[1]
+            except (EOFError, OSError):
+                pass
+            if profile is not None:
+                profiles.append(profile)
+        return profiles
+
+    def request_profiles(self) -> None:
+        """ Asks all workers for their tick profiles. The merged profile is printed once all of them answered """
+        if self.profile_ticks and not self.awaited_profiles and self.can_host():
+            self.awaited_profiles = len(self.worker_loads)
+            self.profiles = []
+            for worker_index in list(self.worker_loads):
+                self.send(worker_index, ("profile",))
+
+    def print_profiles(self) -> None:
+        """ Prints the merged profile once all workers asked by request_profiles() answered """
+        if self.awaited_profiles and len(self.profiles) >= self.awaited_profiles:
+            print_profile(TickProfiler.merged(self.profiles), "ticks so far")
+            self.awaited_profiles = 0
+
+    def oldest_match(self) -> Optional[MatchHandle]:
+        return min(self.matches.values(), key=lambda m: m.match_id, default=None)
+
+    def send_input(self, match: MatchHandle, player_id: int, action: str, seq: Optional[int] = None) -> None:
+        """ :param seq: the client's sequence number of the action, see InputQueue """
+        self.send(match.worker_index, ("input", match.match_id, player_id, action, seq))
+
+    def set_ready(self, match: MatchHandle, player_id: int) -> None:
+        self.send(match.worker_index, ("ready", match.match_id, player_id))
+
+    def set_angers(self, match: MatchHandle, angers: List[float]) -> None:
+        self.send(match.worker_index, ("angers", match.match_id, angers))
+
+    def request_snapshot(self, match: MatchHandle, session) -> None:
+        """ Resyncs a PlayerSession or Spectator that fell further behind than the match's logs go,
+            or a Spectator that just started watching.
+        """
+        session.resyncing = True
+        match.resyncing.append(session)
+        if len(match.resyncing) == 1:
+            self.send(match.worker_index, ("snapshot", match.match_id))
+
+    def forfeit(self, match: MatchHandle, player_id: int) -> None:
+        """ Ends the match because a player left. The other player wins """
+        if not match.is_over():
+            match.winner = int(not player_id)
+            self.close_match(match)
+            match.notify_all()
+
+    def close_match(self, match: MatchHandle) -> None:
+        if self.matches.pop(match.match_id, None) is None:
+            return
+        if not match.started.done():  # sessions waiting for the handshake go back to the lobby
+            match.started.set_result(None)
+        self.worker_loads[match.worker_index] -= 1
+        self.send(match.worker_index, ("close", match.match_id))
+
+    def abort_match(self, match: MatchHandle) -> None:
+        """ Ends a match that failed in its worker without a winner. Its players are told that the game is over """
+        if self.matches.pop(match.match_id, None) is None:
+            return
+        match.aborted = True
+        if not match.started.done():  # sessions waiting for the handshake go back to the lobby
+            match.started.set_result(None)
+        if match.worker_index in self.worker_loads:
+            self.worker_loads[match.worker_index] -= 1
+        match.notify_all()
+
+    def worker_died(self, index: int) -> None:
+        """ Ends the matches of a dead worker and assigns no more matches to it """
+        if self.worker_loads.pop(index, None) is None:
+            return
+        print("[ERROR] Match worker", index, "died")
+        asyncio.get_running_loop().remove_reader(self.connections[index].fileno())
+        for match in [match for match in self.matches.values() if match.worker_index == index]:
+            self.abort_match(match)
+        if self.awaited_profiles:  # the dead worker will not answer
+            self.awaited_profiles -= 1
+            self.print_profiles()
+        if not self.can_host():
+            print("[ERROR] No match workers left, no more matches can start")
+
+    def on_worker_readable(self, index: int) -> None:
+        conn = self.connections[index]
+        try:
+            while conn.poll():
+                self.handle_worker_message(conn.recv())
+        except (EOFError, OSError):
+            self.worker_died(index)
+
+    def handle_worker_message(self, message: tuple) -> None:
+        kind, *args = message
+        if kind == "tick":
+            for match_id, output in args[0]:
+                match = self.matches.get(match_id)
+                if match is None:
+                    continue
+                if "fp" in output:
+                    match.apply_field_patch(output["fp"])
+                elif "fv" in output:
+                    match.set_field(output["fv"], output["f"], output["t"])
+                if output["w"] is not None:
+                    match.winner = output["w"]
+                    self.close_match(match)
+                match.events.append(output["e"])
+                if match.spectators:
+                    match.spectator_frames.append(broadcast_frames(output))
+                match.notify_all()
+        elif kind == "started":
+            match_id, start_data = args
+            match = self.matches.get(match_id)
+            if match is not None:
+                match.set_field(start_data["fv"], start_data["f"], start_data["t"])
+                match.started.set_result(start_data)
+        elif kind == "failed":
+            match = self.matches.get(args[0])
+            if match is not None:
+                print("[ERROR] Match", match.match_id, "failed in worker", match.worker_index)
+                self.abort_match(match)
+        elif kind == "profile":
+            self.profiles.append(args[0])
+            self.print_profiles()
+        elif kind == "snapshot":
+            match_id, snapshot = args
+            match = self.matches.get(match_id)
+            if match is not None:
+                for session in match.resyncing:
+                    session.resync(snapshot)
+                match.resyncing.clear()
+        else:
+            raise NotImplementedError("match worker message", kind, "is not implemented")
@@ -1,9 +1,6 @@
 import math
 
-DOWN = 0
-RIGHT = 1
-UP = 2
-LEFT = 3
+from Movement import BASE_SPEED, MAX_BONUS_SPEED, DOWN, RIGHT, UP, LEFT
 
 
 class Player:
@@ -15,8 +12,8 @@ class Player:
         self.x = box_x + 0.5
         self.y = box_y + 0.5
         self.lifes = 3
-        self.base_speed = 0.05
-        self.max_bonus_speed = 0.1
+        self.base_speed = BASE_SPEED
+        self.max_bonus_speed = MAX_BONUS_SPEED
         self.speed = self.base_speed  # how far can the player move in one Frame
         self.bombs = 1  # how many bombs can the player place at once
         self.power = 3  # range of explosion in fields TODO make anger-dependant
@@ -1,10 +1,9 @@
 #!/usr/bin/env python3
 
 import Game
-from typing import Union, Dict
-from Entities import FallingBox, PowerUpType, PowerUp
+from typing import Optional, Dict
+from Entities import PowerUpType, POWER_UP_KIND, FALLING_BOX_KIND
 from Tiles import TileType
-import random
 
 FALLING_BOX_DURATION_UNTIL_CRUSH = 60 * 3
 
@@ -32,7 +31,7 @@ class PowerUpScheduler():
         total_prob_mass = sum(relative_spawn_rates.get(type,1.0) for type in PowerUpType)
         return [relative_spawn_rates.get(type,1.0) / total_prob_mass for type in PowerUpType]
 
-    def tick(self, x:int, y:int, game):
+    def tick(self, x:int, y:int, game) -> Optional[int]:
         """ Activates the scheduler, that may then spawn a power up to the game at
             the given tile location.
             This scheduler will always begin a grace period of self.grace_period_ticks
@@ -40,17 +39,17 @@ class PowerUpScheduler():
             and spawn something with a probability of self.spawn_rate if not graceful.
             :param x: x Tile coordinate to spawn at
             :param y: y Tile coordinate to spawn at
-            :returns: None or a new FallingBox object at a random location
+            :returns: None or the entity ID of the new power up
         """
         if self.grace_counter > 0:
             self.grace_counter -= 1
             return None
 
-        if random.random() >= self.spawn_rate:
+        if game.random.random() >= self.spawn_rate:
             return None
         else:
             # choose power up tipe with relative probabilities
-            random_float = random.random()
+            random_float = game.random.random()
             i = 0
             consumed_prob = self.power_up_probs[0]
             while i < len(self.power_up_probs) and random_float > consumed_prob:
@@ -64,9 +63,8 @@ class PowerUpScheduler():
                 i -= 1
 
             chosen_type = PowerUpType(min(i,len(self.power_up_probs)-1))
-            powerUp = PowerUp(x,y,chosen_type)
-            tile = game.tiles[x][y]
-            tile.set_content(powerUp)
+            powerUp = game.entities.spawn(POWER_UP_KIND, x, y, power=chosen_type.value)
+            game.tiles.set_content(x, y, powerUp)
             return powerUp
 
 class FallingBoxScheduler():
@@ -77,35 +75,35 @@ class FallingBoxScheduler():
         self.grace_period_ticks = grace_period_ticks
         self.grace_counter = 0
 
-    def tick(self, game) -> Union[None,FallingBox]:
+    def tick(self, game) -> Optional[int]:
         """ Activates the scheduler, that may then spawn a falling box to the game.
             It will always begin a grace period of self.grace_period_ticks after each spawn,
             and spawn something with a probability of self.spawn_rate if not graceful.
-            :returns: None or a new FallingBox object at a random location
+            :returns: None or the entity ID of a new falling box at a random location
         """
         if self.grace_counter > 0:
             self.grace_counter -= 1
             return None
 
-        if random.random() >= self.spawn_rate:
+        if game.random.random() >= self.spawn_rate:
             return None
         else:
             ### Try to spawn a Falling Box ###
             w = game.width
             h = game.height
-            rand_loc = (random.randint(0,w-1),random.randint(0,h-1))
-            rand_tile = game.tiles[rand_loc[0]][rand_loc[1]]
+            rand_loc = (game.random.randint(0,w-1),game.random.randint(0,h-1))
+            rand_tile = game.tiles[rand_loc]
             tries = 0
             # Try to find an empty tile
             while tries < 20 and rand_tile.has_content() and self.player_blocks_spawn(rand_tile, game.players):
-                rand_loc = (random.randint(0,w-1),random.randint(0,h-1))
-                rand_tile = game.tiles[rand_loc[0]][rand_loc[1]]
+                rand_loc = (game.random.randint(0,w-1),game.random.randint(0,h-1))
+                rand_tile = game.tiles[rand_loc]
                 tries += 1
             if not rand_tile.type == TileType.WALL and not rand_tile.has_content():
                 ### Spawn Falling Box ###
-                falling_box = FallingBox(rand_tile.x,rand_tile.y,FALLING_BOX_DURATION_UNTIL_CRUSH)
+                falling_box = game.entities.spawn(FALLING_BOX_KIND, rand_tile.x, rand_tile.y,
+                                                  FALLING_BOX_DURATION_UNTIL_CRUSH)
                 rand_tile.set_content(falling_box)
-                game.falling_boxes.append(falling_box)
                 # Reset grace counter
                 self.grace_counter = self.grace_period_ticks
                 return falling_box
@@ -1,20 +1,27 @@
 import argparse
+import asyncio
+import signal
 import socket
 import sys
 import time
 import os
-from _thread import *
 from enum import Enum
 
-from GameSerializer import GameSerializer
 from utils import *
 
-import pygame
-
 import config
-from Game import Game
+from Lobby import Lobby, PlayerSession
+from MatchManager import MatchManager
+from Spectators import Spectator
+from EventCodec import encode_events
+from EventLog import coalesce_packed
+from GameSerializer import INPUT_ACTIONS
+from Tiles import FieldHistory
 
 PACKET_SIZE = 4096
+SERVER_VIEW_FPS = 20
+MAX_ANGER_CLIENTS = 1
+MAX_INPUT_SEQ = 2 ** 32  # INPUT_ACK packs the sequence numbers of actions as uint32
 
 
 class Mode(Enum):
@@ -25,22 +32,24 @@ class Mode(Enum):
 
 
 class Server:
-    def __init__(self, player_port=5555, anger_port=5556, serialize=False):
+    def __init__(self, player_port=5555, anger_port=5556, spectator_port=5557, serialize=False, workers=None,
+                 headless=False, record_inputs=False, profile_ticks=False):
         assert player_port == player_port
         self.mode = Mode.STARTUP
-        self.player_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.anger_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.address = config.SERVER_ADRESS
         self.player_port = player_port
         self.anger_port = anger_port
+        self.spectator_port = spectator_port
         self.server_ip = socket.gethostbyname(self.address)
-        # self.game = Game(file='field.json')  # TODO
-        self.game = Game()
-        self.reset_game_gen = self.reset_game()
         self.running = True
-        self.serialize = serialize
+        self.serialize = serialize or record_inputs
+        self.headless = headless  # no server window, so no pygame or display is needed
         self.replay_dir = str(time.strftime("%Y_%d_%m-%H_%M_%S"))
-        self.game_serializer = GameSerializer(self.replay_dir)
+        self.match_manager = MatchManager(workers, replay_dir=self.replay_dir if serialize or record_inputs else None,
+                                          record_inputs=record_inputs, profile_ticks=profile_ticks)
+        self.lobby = Lobby(self.match_manager)
+        self.num_anger_clients = 0
+        self.connection_tasks = set()  # handler tasks of all open connections, cancelled on shutdown
 
     def start(self):
         print("Server running at ", self.address)
@@ -50,70 +59,111 @@ class Server:
             except OSError:
                 print("Creation of replays directory failed")
         self.mode = Mode.WAITING
-        start_new_thread(self.server_view, ())
-        start_new_thread(self.wait_for_players, ())
-        self.wait_for_anger()  # <- starts a asyncio loop: must be done from main thread
-        while True:
-            time.sleep(2)
-            if not self.running:
-                break
+        self.match_manager.start_workers()  # before the event loop and pygame exist in this process
+        try:
+            asyncio.run(self.serve())
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.match_manager.stop_workers()
         print("[SERVER] <start> method ended.")
 
-    def wait_for_anger(self):
+    async def serve(self):
+        """ Runs all sockets and the server view on one asyncio event loop until the server exits """
         try:
-            self.anger_socket.bind((self.address, self.anger_port))
-        except:
+            player_server = await asyncio.start_server(self.accept_player, self.address, self.player_port)
+            anger_server = await asyncio.start_server(self.accept_anger_client, self.address, self.anger_port)
+            spectator_server = await asyncio.start_server(self.accept_spectator, self.address, self.spectator_port)
+        except OSError:
             print("[ERROR]", sys.exc_info()[1])
             sys.exit(1)
-        self.anger_socket.settimeout(0.2)
-        self.anger_socket.listen(1)
-        num_connections = 0
+        print("[SERVER] Listening for Clients at port", self.player_port)
         print("[SERVER] Listening for Anger-Streaming-Server at port", self.anger_port)
-        while num_connections < 1:
-            if not self.running:
-                self.anger_socket.close()
-                break
-            try:
-                conn, addr = self.anger_socket.accept()
-                start_new_thread(self.handle_anger_client, (conn,))
-                print("[SERVER] Connected to Anger-Streaming-Server: ", addr)
-                num_connections += 1
-            except:
-                pass
-        print("[SERVER] <wait_for_anger> method ended.")
-
-    def wait_for_players(self):
+        print("[SERVER] Listening for Spectators at port", self.spectator_port)
+        self.match_manager.attach(asyncio.get_running_loop())
+        if self.match_manager.profile_ticks and hasattr(signal, "SIGUSR1"):
+            asyncio.get_running_loop().add_signal_handler(signal.SIGUSR1, self.match_manager.request_profiles)
+            print("[SERVER] Profiling ticks. Send SIGUSR1 to process", os.getpid(), "for a report")
+
         try:
-            self.player_socket.bind((self.address, self.player_port))
-        except:
-            print("[ERROR]", sys.exc_info()[1])
-            sys.exit(1)
-        self.player_socket.settimeout(0.2)
-        num_players = 0
-        self.player_socket.listen(2)
-        print("[SERVER] Listening for Clients at port", self.player_port)
-        while self.mode != Mode.EXIT and num_players < 2:  # dont search for connections when all are full
-            if not self.running:
-                self.player_socket.close()
-                break
-            try:
-                conn, addr = self.player_socket.accept()
-                print("[SERVER] Connected to Client: ", addr)
-                start_new_thread(self.handle_player_client, (conn,))
-                num_players += 1
-            except:
-                pass
-        if self.mode != Mode.EXIT:
-            self.mode = Mode.GAME_RUNNING
-        print("[SERVER] <wait_for_players> thread ended.")
-
-    def server_view(self):
+            if self.headless:
+                await self.wait_for_exit()  # returns on KeyboardInterrupt
+            else:
+                await self.server_view()  # returns when the server window is closed
+        finally:
+            self.mode = Mode.EXIT
+            for server in (player_server, anger_server, spectator_server):
+                server.close()
+            tasks = list(self.connection_tasks)
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            for server in (player_server, anger_server, spectator_server):
+                await server.wait_closed()
+        print("[SERVER] <serve> method ended.")
+
+    async def accept_player(self, reader, writer):
+        if self.mode == Mode.EXIT:
+            writer.close()
+            return
+        session = PlayerSession(reader, writer)
+        print("[SERVER] Connected to Client: ", session.addr)
+        try:
+            await self.run_connection(self.handle_player_client(session), writer)
+        finally:
+            print("[SERVER] Compression for", session.addr, session.compression_stats())
+            self.lobby.leave(session)
+            if session.match is not None:
+                self.match_manager.forfeit(session.match, session.player_id)
+
+    async def accept_spectator(self, reader, writer):
+        if self.mode == Mode.EXIT:
+            writer.close()
+            return
+        spectator = Spectator(reader, writer)
+        print("[SERVER] Connected to Spectator: ", spectator.addr)
+        try:
+            await self.run_connection(self.handle_spectator(spectator), writer)
+        finally:
+            spectator.leave()
+
+    async def accept_anger_client(self, reader, writer):
+        addr = writer.get_extra_info("peername")
+        if self.mode == Mode.EXIT or self.num_anger_clients >= MAX_ANGER_CLIENTS:
+            print("[SERVER] Rejected Anger-Streaming-Server: ", addr)
+            writer.close()
+            return
+        print("[SERVER] Connected to Anger-Streaming-Server: ", addr)
+        self.num_anger_clients += 1
+        await self.run_connection(self.handle_anger_client(reader, writer), writer)
+        self.num_anger_clients -= 1
+
+    async def run_connection(self, handler, writer):
+        """ Runs a connection handler so that it is cancelled on shutdown and always closes its socket """
+        task = asyncio.current_task()
+        self.connection_tasks.add(task)
+        try:
+            await handler
+        except (ConnectionError, asyncio.IncompleteReadError):
+            print("[SERVER] Connection lost: ", writer.get_extra_info("peername"))
+        except FrameError as e:
+            print("[SERVER] Dropped client", writer.get_extra_info("peername"), "after a malformed frame:", e)
+        finally:
+            self.connection_tasks.discard(task)
+            writer.close()
+
+    async def wait_for_exit(self):
+        while self.running:
+            await asyncio.sleep(1 / SERVER_VIEW_FPS)
+        self.mode = Mode.EXIT
+
+    async def server_view(self):
+        import pygame  # only here, so a headless server runs without pygame installed
         self.screen = pygame.display.set_mode((300, 300))
         pygame.display.set_caption('Server')
         self.screen.fill((0, 0, 0))
-        clock = pygame.time.Clock()
         while self.running:
-            clock.tick(20)
+            await asyncio.sleep(1 / SERVER_VIEW_FPS)
             # pygame.display.update() # we dont draw anything right now
             # exit condition
             for event in pygame.event.get():
@@ -124,141 +174,199 @@ class Server:
         self.mode = Mode.EXIT
         pygame.display.quit()
         pygame.quit()
-        print("[SERVER] <server_view> thread ended.")
+        print("[SERVER] <server_view> task ended.")
 
-    def handle_player_client(self, conn):
+    async def handle_player_client(self, session: PlayerSession):
         while not self.mode == Mode.EXIT:  # START NEW GAME
-            ### At this point this is a connected player, but maybe the game has not started yet for lack of a second player ###
-            id, _ = self.game.create_player()
-
-            # Waiting for the server to start the game
-            while self.mode != Mode.GAME_RUNNING:
-                if len(self.game.players) == 2:
-                    self.mode = Mode.GAME_RUNNING
-                else:
-                    conn.send(compress({"msg": self.mode.name}))
-                    _ = conn.recv(PACKET_SIZE)
-
-            # mode == GAME_RUNNING. Send Map first
-            conn.send(compress({"msg": "MAP_DATA",
-                                "id": id,
-                                "f": [[(tile.type.value, tile.sprite_id) for tile in row] for row in
-                                          self.game.tiles],
-                                "t": [(t.x, t.y, t.ticks_to_activation) for t in self.game.spike_traps]}))
-            _ = conn.recv(PACKET_SIZE)
-
-            client_field_version = self.game.field_version
-
-            p1, p2 = self.game.players
-            conn.send(compress({
-                "msg": "PLAYER_DATA", "p": [
-                    {"id": 0, "x": round(p1.x, 2), "y": round(p1.y, 2), "l": p1.lifes, "b": p1.bombs, "p": p1.power},
-                    {"id": 1, "x": round(p2.x, 2), "y": round(p2.y, 2), "l": p2.lifes, "b": p2.bombs, "p": p2.power}]}))
-            _ = conn.recv(PACKET_SIZE)
-            if id == 0 and self.serialize:
-                self.game_serializer.write_header([[(tile.type.value, tile.sprite_id) for tile in row] for row in
-                                                   self.game.tiles],
-                                                  [(t.x, t.y, t.ticks_to_activation) for t in self.game.spike_traps], [
-                                                      {"id": 0, "x": round(p1.x, 2), "y": round(p1.y, 2), "l": p1.lifes,
-                                                       "b": p1.bombs, "p": p1.power},
-                                                      {"id": 1, "x": round(p2.x, 2), "y": round(p2.y, 2), "l": p2.lifes,
-                                                       "b": p2.bombs, "p": p2.power}])
-
-            conn.send(compress({"msg": "GAME_START"}))  # Tells Client the game starts
-            _ = conn.recv(PACKET_SIZE)
+            ### At this point this is a connected player in the lobby, waiting for a second player ###
+            self.lobby.join(session)
+            while session.match is None:
+                await session.send({"msg": Mode.WAITING.name})
+                if await session.receive() is None:
+                    return
+
+            match, id = session.match, session.player_id
+            start_data = await match.started
+            if match.is_over():  # the opponent left before the game started
+                continue
+
+            # The game is set up in its worker. Send Map first
+            await session.send({"msg": "MAP_DATA", "id": id, "f": start_data["f"], "t": start_data["t"]})
+            await session.receive()
+
+            await session.send({"msg": "PLAYER_DATA", "p": start_data["p"]})
+            await session.receive()
+
+            await session.send({"msg": "GAME_START"})  # Tells Client the game starts
+            if await session.receive() is None:
+                return
+            self.match_manager.set_ready(match, id)  # the match starts ticking once both players are ready
 
             ### ONE GAME ROUND ###
-            print("[SERVER] Started game loop for player", id)
-
-            while self.mode != Mode.EXIT:
-
-                ### Get Client message. The client will send 1 package per Client tick ###
-                data = conn.recv(PACKET_SIZE).decode()
-
-                if data == "":
-                    conn.send(compress({"msg": "CLOSE"}))
-                    break
-                else:
-                    data = json.loads(data)
-
-                ### If the map changed, resend map ###
-                # TODO currently every send action is one Client tick. So its either map or events and never both. that should maybe be done differently, sending both map and events in one Client tick.
-
-                if client_field_version != self.game.field_version:
-                    print("[SERVER] Sending map to player", id, "FieldVersion:", self.game.field_version)
-                    conn.send(compress({"msg": "MAP_DATA",
-                                        "fv": self.game.field_version,
-                                        "f": [[(tile.type.value, tile.sprite_id) for tile in row] for row in
-                                                  self.game.tiles],
-                                        "t": [(t.x, t.y, t.ticks_to_activation) for t in self.game.spike_traps]}))
-                    client_field_version = self.game.field_version
-                    continue
-
-                ### ELSE process the game loop ###
-
-                action = data["action"]
-                player = self.game.players[id]
-
-                self.game.player_action(id, action)
-                self.game.update(
-                    id)  # current workaround: update will pass for ID != 0 to prevent 2x game speed from happening
-
-                new_game_events = self.game.events[id]  # get the deque for this client
-                if id == 0 and self.serialize:
-                    self.game_serializer.add_events(new_game_events)
-                # debug start
-                # print("[SERVER] Player",id," Num of events to send:",len(new_game_events))
-                if len(new_game_events) > 100:
-                    print("[SERVER]", [event.type for event in new_game_events])
-                # debug end
-                if new_game_events:
-                    events_json = []
-                    while new_game_events:
-                        event = new_game_events.popleft()
-                        events_json.append(event.encode())  # [type,data_dict]
-                    data_send = {"msg": self.mode.name, "e": events_json}
-                else:
-                    data_sent = {"msg": self.mode.name, "e": []}
+            print("[SERVER] Started game loop for player", id, "in match", match.match_id)
 
-                # End loop upon win
-                if not self.game.winner is None:
-                    self.mode = Mode.WAITING
-                    conn.send(compress({"msg": "GAME_OVER", "id": self.game.winner}))
-                    break
-                else:
-                    conn.send(compress(data_send))
+            # From here on both directions are pipelined: the client sends one action per client tick
+            # while the server pushes the output of every match tick, without waiting for each other.
+            receive_task = asyncio.create_task(self.receive_actions(session, match))
+            try:
+                connected = await self.send_match_output(session, match, start_data["fv"], receive_task)
+            finally:
+                receive_task.cancel()
+                await asyncio.gather(receive_task, return_exceptions=True)
+            if not connected:
+                print("[SERVER] Player", id, "of match", match.match_id, "disconnected")
+                return
 
             if self.mode != Mode.EXIT:
-                _ = conn.recv(4049)  # msg = "again"
+                # skip actions that were still in flight
+                message = await session.receive()
+                while message is not None and message.get("msg") != "again":
+                    message = await session.receive()
+                if message is None:
+                    return
                 print("[SERVER] recieved again message")
-                next(self.reset_game_gen)
-                # start again
-
-        print("[SERVER] <handle_player_client> thread ended.")
-
-    def reset_game(self):
-        # todo: maybe there is a not so hacky solution
-        i = 0
-        while True:
-            if i % 2 == 0:
-                self.game = Game()
-                self.player_id = 0
-                yield
-            else:
-                yield
-            i += 1
+                # start again, back in the lobby
+
+        print("[SERVER] <handle_player_client> task ended.")
 
-    def handle_anger_client(self, conn):
+    async def receive_actions(self, session: PlayerSession, match):
+        """ Forwards the actions of a playing client to its match until it disconnects.
+            A client that sends an unknown action, or a sequence number that is not a uint32,
+            is dropped, so that neither reaches the match worker.
+        """
+        try:
+            while True:
+                data = await session.receive()
+                if data is None:
+                    return
+                if "action" in data:
+                    if data["action"] not in INPUT_ACTIONS:
+                        print("[SERVER] Dropped client", session.addr, "after an unknown action:", data["action"])
+                        return
+                    seq = data.get("seq")
+                    if seq is not None and not (isinstance(seq, int) and 0 <= seq < MAX_INPUT_SEQ):
+                        print("[SERVER] Dropped client", session.addr, "after an invalid sequence number:", seq)
+                        return
+                    self.match_manager.send_input(match, session.player_id, data["action"], seq)
+        except ConnectionError:
+            return
+        except FrameError as e:  # a client that sends garbage is dropped like a disconnected one
+            print("[SERVER] Dropped client", session.addr, "after a malformed frame:", e)
+            return
+        finally:
+            session.notify()  # lets send_match_output notice the disconnect
+
+    async def send_match_output(self, session: PlayerSession, match, client_field_version: int, receive_task) -> bool:
+        """ Sends the match's events to the client as they arrive, until the match is over.
+            :returns: False if the client disconnected
+        """
+        while self.mode != Mode.EXIT:
+            await session.updated.wait()
+            session.updated.clear()
+            if receive_task.done():
+                return False
+
+            new_game_events = session.read_events()  # packed events, one entry per tick
+            if new_game_events is None:
+                print("[SERVER] Player", session.player_id, "is", session.events.lag(), "ticks behind, resyncing")
+                self.match_manager.request_snapshot(match, session)
+                new_game_events = []
+
+            ### If the map changed, patch the client's map, or resend it if the client is too far behind ###
+            if client_field_version != match.field_version:
+                changes = match.field_history.changes_since(client_field_version)
+                if changes is None:
+                    print("[SERVER] Sending map to player", session.player_id, "FieldVersion:", match.field_version)
+                    await session.send({"msg": "MAP_DATA", "fv": match.field_version, "f": match.field,
+                                        "t": match.traps})
+                else:
+                    # the patch rides in front of the events in the same frame
+                    new_game_events.insert(0, encode_events(FieldHistory.to_events(changes)))
+                client_field_version = match.field_version
+            # debug start
+            if len(new_game_events) > 100:
+                print("[SERVER] Player", session.player_id, "is", len(new_game_events), "ticks behind")
+            # debug end
+            if new_game_events:
+                # all pending ticks go out in one frame, with superseded positions and angers dropped
+                data_send = coalesce_packed(new_game_events)
+                await session.send_frame(FRAME_EVENTS, data_send)
+
+            # End loop upon win
+            if match.is_over():
+                await session.send({"msg": "GAME_OVER", "id": match.winner})
+                return True
+        return True
+
+    async def handle_spectator(self, spectator: Spectator):
+        """ Shows matches to a spectator until it disconnects. The spectator names the match to watch
+            in its SPECTATE message. Without one, or once that match is over, it watches the longest running match.
+        """
+        request = await spectator.receive()
+        if request is None:
+            return
+        match_id = request.get("match")
+        while self.mode != Mode.EXIT:
+            match = self.match_manager.matches.get(match_id) or self.match_manager.oldest_match()
+            if match is None:
+                await spectator.send({"msg": Mode.WAITING.name})
+                await asyncio.sleep(1)
+                continue
+            match_id = None
+            start_data = await match.started
+            if match.is_over():
+                continue
+
+            print("[SERVER] Spectator", spectator.addr, "watches match", match.match_id)
+            await spectator.send({"msg": "PLAYER_DATA", "p": start_data["p"]})
+            spectator.watch(match)
+            self.match_manager.request_snapshot(match, spectator)  # the snapshot brings the spectator up to date
+            try:
+                if not await self.send_spectator_frames(spectator, match):
+                    print("[SERVER] Dropped Spectator", spectator.addr, "that stopped reading")
+                    return
+            finally:
+                spectator.leave()
+            await spectator.send({"msg": "GAME_OVER", "id": match.winner})
+
+    async def send_spectator_frames(self, spectator: Spectator, match) -> bool:
+        """ Sends the frames of the match to the spectator as they arrive, until the match is over.
+            :returns: False if the spectator was too slow to accept them
+        """
+        while self.mode != Mode.EXIT:
+            await spectator.updated.wait()
+            spectator.updated.clear()
+            frames = spectator.read_frames()
+            if frames is None:
+                print("[SERVER] Spectator", spectator.addr, "is", spectator.frames.lag(), "ticks behind, resyncing")
+                self.match_manager.request_snapshot(match, spectator)
+                frames = []
+            if frames and not await spectator.send_frames(frames):
+                return False
+            if match.is_over():
+                return True
+        return True
+
+    async def handle_anger_client(self, reader, writer):
         if self.serialize:
-            conn.send(str.encode(json.dumps({"msg": "SERIALIZE", "replay_dir": self.replay_dir})))
+            writer.write(str.encode(json.dumps({"msg": "SERIALIZE", "replay_dir": self.replay_dir})))
         else:
-            conn.send(str.encode(json.dumps({"msg": "NOT SERIALIZE"})))
+            writer.write(str.encode(json.dumps({"msg": "NOT SERIALIZE"})))
+        await writer.drain()
         while self.mode != Mode.EXIT:
-            data = json.loads(conn.recv(PACKET_SIZE).decode())
-            for i in [0, 1]:
-                self.game.raw_angers[i] = data[str(i)]["anger"]
+            data = await reader.read(PACKET_SIZE)
+            if not data:
+                break
+            data = json.loads(data.decode())
+            # Anger values may name their match. Without one, they belong to the longest running match
+            if "match" in data:
+                match = self.match_manager.matches.get(data["match"])
+            else:
+                match = self.match_manager.oldest_match()
+            if match is not None:
+                self.match_manager.set_angers(match, [data[str(i)]["anger"] for i in [0, 1]])
 
-        print("[SERVER] <handle_anger_client> thread ended.")
+        print("[SERVER] <handle_anger_client> task ended.")
 
 
 if __name__ == '__main__':
@@ -268,8 +376,18 @@ if __name__ == '__main__':
                         default=5555, type=int)
     parser.add_argument("-a", "--anger_port", help="The Port the server software should listen at. Defaults to 5556.",
                         default=5556, type=int)
+    parser.add_argument("-v", "--spectator_port", help="The Port spectators connect to. Defaults to 5557.",
+                        default=5557, type=int)
     parser.add_argument("-s", "--serialize", help="game_serializer",
                         default=False, action="store_true")
+    parser.add_argument("-w", "--workers", help="Number of match worker processes. Defaults to the number of cores.",
+                        default=None, type=int)
+    parser.add_argument("-i", "--record_inputs", help="Record matches as their seed and inputs only. "
+                        "Replay them with InputReplay.py.", default=False, action="store_true")
+    parser.add_argument("--headless", help="Run without the server window, e.g. on machines without a display.",
+                        default=False, action="store_true")
+    parser.add_argument("--profile-ticks", help="Time each phase of the match ticks. Prints p50/p95/p99 per phase "
+                        "on exit and on SIGUSR1.", default=False, action="store_true")
     args = vars(parser.parse_args())
 
     # Game server
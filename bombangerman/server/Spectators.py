@@ -0,0 +1,100 @@
+import asyncio
+from typing import Optional
+
+from EventCodec import encode_events
+from Tiles import FieldHistory
+from utils import FrameReader, encode_frame, event_frame, CLIENT_FRAME_TYPES
+
+PACKET_SIZE = 4096
+SPECTATOR_DRAIN_TIMEOUT = 5.0  # seconds a spectator may take to accept a write before it is dropped
+
+
+def broadcast_frames(output: dict) -> bytes:
+    """ :param output: the output of one match tick, see Match.tick()
+        :returns: the frames that show the tick to a spectator. Encoded once, sent to all spectators of the match
+    """
+    packed_events = output["e"]
+    if "fp" in output:
+        packed_events = encode_events(FieldHistory.to_events(output["fp"])) + packed_events
+    data = event_frame(packed_events)
+    if "f" in output:
+        data = encode_frame({"msg": "MAP_DATA", "fv": output["fv"], "f": output["f"], "t": output["t"]}) + data
+    return data
+
+
+class Spectator:
+    """ A read-only client watching a match. It is sent the frames every spectator of the match
+        gets, so a spectator that can not keep up is resynced, and dropped if it stops reading.
+    """
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.addr = writer.get_extra_info("peername")
+        self.match = None  # MatchHandle
+        self.frames = None  # EventCursor into the match's spectator frames
+        self.snapshot: Optional[bytes] = None  # frames that resync the spectator, sent before the next frames
+        self.resyncing = False  # a snapshot was requested
+        self.updated = asyncio.Event()
+        self.messages = FrameReader(CLIENT_FRAME_TYPES)
+
+    async def receive(self):
+        """ :returns: the next message of the client, or None if it disconnected """
+        while not self.messages.has_message():
+            data = await self.reader.read(PACKET_SIZE)
+            if not data:
+                return None
+            self.messages.feed(data)
+        return self.messages.pop_message()
+
+    async def send(self, data) -> None:
+        self.writer.write(encode_frame(data))
+        await self.writer.drain()
+
+    async def send_frames(self, frames: list) -> bool:
+        """ :returns: False if the spectator did not accept the frames in time """
+        self.writer.writelines(frames)
+        try:
+            await asyncio.wait_for(self.writer.drain(), SPECTATOR_DRAIN_TIMEOUT)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    def read_frames(self) -> Optional[list]:
+        """ :returns: the frames not yet sent to the spectator, or None if the spectator
+                      fell so far behind that the match dropped some of them
+        """
+        if self.resyncing:
+            return []
+        frames = self.frames.read()
+        if frames is not None and self.snapshot is not None:
+            frames.insert(0, self.snapshot)
+            self.snapshot = None
+        return frames
+
+    def resync(self, snapshot: bytes) -> None:
+        """ :param snapshot: packed events that rebuild the game state """
+        match = self.match
+        self.snapshot = encode_frame({"msg": "MAP_DATA", "fv": match.field_version, "f": match.field,
+                                      "t": match.traps}) + event_frame(snapshot)
+        self.frames = match.spectator_frames.subscribe()
+        self.resyncing = False
+        self.notify()
+
+    def notify(self) -> None:
+        self.updated.set()
+
+    def watch(self, match) -> None:
+        """ Starts watching the match. It is shown once the snapshot requested for it arrived """
+        self.match = match
+        self.frames = match.spectator_frames.subscribe()
+        self.snapshot = None
+        self.updated.clear()
+        match.spectators.append(self)
+
+    def leave(self) -> None:
+        if self.match is not None:
+            for spectators in (self.match.spectators, self.match.resyncing):
+                if self in spectators:
+                    spectators.remove(self)
+        self.match = None
+        self.frames = None
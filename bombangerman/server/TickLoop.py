@@ -0,0 +1,89 @@
+import asyncio
+import time
+from collections import deque
+from typing import Callable, List, Optional
+
+TICK_RATE = 60  # authoritative game ticks per second
+MAX_CATCH_UP_TICKS = 5  # ticks simulated back to back before the loop gives up and skips ahead
+MAX_PENDING_INPUTS = 8  # per player. Older inputs are dropped when a client floods the server
+
+
+class InputQueue:
+    """ Collects player actions from the connection handlers.
+        Each tick consumes exactly one action per player, so both players' inputs
+        are applied together and in a fixed order (player 0 first).
+        Clients that predict their own movement tag their actions with sequence numbers.
+        The queue remembers the sequence number of the last action it consumed of each player,
+        which tells the client which of its predicted actions the server has applied.
+    """
+    def __init__(self, num_players: int = 2, max_pending: int = MAX_PENDING_INPUTS):
+        self.max_pending = max_pending
+        self.pending = [deque(maxlen=max_pending) for _ in range(num_players)]  # (action, sequence number)
+        self.consumed_seqs: List[Optional[int]] = [None] * num_players
+
+    def put(self, id: int, action: str, seq: Optional[int] = None) -> None:
+        """ :param id: the ID of the player sending the action
+            :param seq: the client's sequence number of the action, if it sends them
+        """
+        self.pending[id].append((action, seq))
+
+    def pop_batch(self) -> List[str]:
+        """ :returns: one action per player, "wait" for players without pending input """
+        actions = []
+        for id, queue in enumerate(self.pending):
+            if queue:
+                action, seq = queue.popleft()
+                if seq is not None:
+                    self.consumed_seqs[id] = seq
+                actions.append(action)
+            else:
+                actions.append("wait")
+        return actions
+
+    def clear(self) -> None:
+        for queue in self.pending:
+            queue.clear()
+
+
+class TickLoop:
+    """ Calls tick_function at a fixed rate, independent of how fast the clients send packets.
+        When the loop falls behind (e.g. the machine stalls), up to max_catch_up_ticks ticks
+        are simulated back to back. Anything beyond that is skipped so the game
+        does not fast-forward after a long hiccup.
+    """
+    def __init__(self, tick_function: Callable[[], None], tick_rate: int = TICK_RATE,
+                 max_catch_up_ticks: int = MAX_CATCH_UP_TICKS):
+        self.tick_function = tick_function
+        self.tick_duration = 1 / tick_rate
+        self.max_catch_up_ticks = max_catch_up_ticks
+        self.next_tick_time = None
+        self.ticks = 0  # ticks simulated so far
+        self.skipped_ticks = 0  # ticks dropped by the catch-up limit
+
+    def due_ticks(self, now: float) -> int:
+        """ :returns: the number of ticks to simulate at time now. Skips ahead if too far behind. """
+        if self.next_tick_time is None:
+            self.next_tick_time = now
+        due = 0
+        while self.next_tick_time <= now and due < self.max_catch_up_ticks:
+            self.next_tick_time += self.tick_duration
+            due += 1
+        if self.next_tick_time <= now:
+            skipped = int((now - self.next_tick_time) / self.tick_duration) + 1
+            self.skipped_ticks += skipped
+            self.next_tick_time += skipped * self.tick_duration
+        return due
+
+    def step(self) -> float:
+        """ Runs all due ticks.
+            :returns: seconds until the next tick is due
+        """
+        for _ in range(self.due_ticks(time.perf_counter())):
+            self.tick_function()
+            self.ticks += 1
+        return max(0., self.next_tick_time - time.perf_counter())
+
+    async def run(self, is_running: Callable[[], bool]) -> None:
+        """ Ticks on the running event loop until is_running() returns False """
+        while is_running():
+            await asyncio.sleep(self.step())
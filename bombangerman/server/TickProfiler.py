@@ -0,0 +1,111 @@
+from time import perf_counter_ns
+from typing import Iterable, List
+
+# Phases of a match tick, in the order they run: the player actions, the phases of Game.update(),
+# then packing the tick's output in Match.tick(). "tick" is the whole tick
+PHASES = ("actions", "anger", "crushing_boxes", "falling_boxes", "spawns", "bombs", "traps", "explosions", "players",
+          "output", "tick")
+(ACTIONS_PHASE, ANGER_PHASE, CRUSHING_BOXES_PHASE, FALLING_BOXES_PHASE, SPAWNS_PHASE, BOMBS_PHASE, TRAPS_PHASE,
+ EXPLOSIONS_PHASE, PLAYERS_PHASE, OUTPUT_PHASE, TICK_PHASE) = range(len(PHASES))
+
+# Histogram buckets are exact below 2 ** (SUB_BITS + 1) ns, above that each power of 2 is split into
+# 2 ** SUB_BITS buckets, so a bucket is at most 12.5 % wide. The last bucket holds everything from about 8 minutes
+SUB_BITS = 3
+SUB_BUCKETS = 1 << SUB_BITS
+NUM_BUCKETS = 37 * SUB_BUCKETS
+PERCENTILES = (50, 95, 99)
+
+
+def bucket_of(ns: int) -> int:
+    """ :returns: the histogram bucket of a duration """
+    length = ns.bit_length()
+    if length <= SUB_BITS + 1:
+        return ns
+    return min((length - SUB_BITS - 1) * SUB_BUCKETS + (ns >> (length - SUB_BITS - 1)), NUM_BUCKETS - 1)
+
+
+def bucket_end(bucket: int) -> int:
+    """ :returns: the smallest duration in ns above the bucket """
+    if bucket < 2 * SUB_BUCKETS:
+        return bucket + 1
+    shift = bucket // SUB_BUCKETS - 1
+    return (bucket % SUB_BUCKETS + SUB_BUCKETS + 1) << shift
+
+
+class TickProfiler:
+    """ Time spent per phase of each tick, as fixed-bucket histograms of perf_counter_ns() durations.
+        The tick code calls start() when a tick begins, mark() at the end of each phase and end_tick() when the
+        tick is done. A mark costs one clock read and one bucket increment, so profiling can stay on in a running
+        server. Histograms of several profilers, e.g. of all match workers, add up with merge().
+    """
+    def __init__(self):
+        self.histograms: List[List[int]] = [[0] * NUM_BUCKETS for _ in PHASES]
+        self.totals_ns = [0] * len(PHASES)
+        self.tick_start = 0
+        self.last = 0  # time of the last start() or mark()
+
+    def start(self) -> None:
+        """ A tick begins, before its player actions """
+        self.tick_start = self.last = perf_counter_ns()
+
+    def mark(self, phase: int) -> None:
+        """ The phase ended, it started at the previous mark() or start() """
+        now = perf_counter_ns()
+        ns = now - self.last
+        self.last = now
+        self.histograms[phase][bucket_of(ns)] += 1
+        self.totals_ns[phase] += ns
+
+    def end_tick(self) -> None:
+        ns = perf_counter_ns() - self.tick_start
+        self.histograms[TICK_PHASE][bucket_of(ns)] += 1
+        self.totals_ns[TICK_PHASE] += ns
+
+    @property
+    def ticks(self) -> int:
+        return sum(self.histograms[TICK_PHASE])
+
+    def merge(self, other: "TickProfiler") -> None:
+        """ Adds the durations profiled by the other profiler """
+        for histogram, other_histogram in zip(self.histograms, other.histograms):
+            for bucket, count in enumerate(other_histogram):
+                histogram[bucket] += count
+        self.totals_ns = [total + other_total for total, other_total in zip(self.totals_ns, other.totals_ns)]
+
+    def percentile(self, phase: int, percent: float) -> int:
+        """ :returns: the duration in ns that percent of the phase's samples take at most, rounded up to the end
+                      of its bucket. 0 without samples
+        """
+        histogram = self.histograms[phase]
+        rank = sum(histogram) * percent / 100
+        seen = 0
+        for bucket, count in enumerate(histogram):
+            seen += count
+            if count and seen >= rank:
+                return bucket_end(bucket)
+        return 0
+
+    def summary(self) -> dict:
+        """ :returns: phase name -> "p50", "p95", "p99", "mean" and "max" in µs, and the number of samples "n" """
+        summary = {}
+        for phase, name in enumerate(PHASES):
+            samples = sum(self.histograms[phase])
+            summary[name] = {"p%d" % percent: self.percentile(phase, percent) / 1000 for percent in PERCENTILES}
+            summary[name]["mean"] = self.totals_ns[phase] / samples / 1000 if samples else 0.
+            summary[name]["max"] = self.percentile(phase, 100) / 1000
+            summary[name]["n"] = samples
+        return summary
+
+    def report(self) -> List[str]:
+        """ :returns: a table of the summary() """
+        lines = ["{:<16}{:>10}{:>10}{:>10}{:>10}{:>10}".format("phase [µs]", "p50", "p95", "p99", "mean", "max")]
+        for name, stats in self.summary().items():
+            lines.append("{:<16}{p50:>10.2f}{p95:>10.2f}{p99:>10.2f}{mean:>10.2f}{max:>10.2f}".format(name, **stats))
+        return lines
+
+    @staticmethod
+    def merged(profilers: Iterable["TickProfiler"]) -> "TickProfiler":
+        total = TickProfiler()
+        for profiler in profilers:
+            total.merge(profiler)
+        return total
@@ -1,6 +1,15 @@
+from collections import deque
 from enum import Enum
-from typing import Tuple, Union
-from Entities import Entity
+from typing import Tuple, Optional, List
+
+import numpy as np
+
+from Entities import EntityStore, EntityType, BLOCKING_KINDS, NO_ENTITY
+from Events import EventType
+
+FIELD_HISTORY_LEN = 64  # tile changes remembered for patching clients. Clients further behind get the full field
+NO_CONTENT = -1  # content kind of tiles without content
+BLAST_DIRECTIONS = ((1, 0), (-1, 0), (0, -1), (0, 1))  # right, left, up, down, the order of Game.DIR
 
 
 class TileType(Enum):
@@ -8,22 +17,205 @@ class TileType(Enum):
     WALL = 1
 
 
+# TileType values as plain ints for the TileGrid arrays. Enum.value is too slow for hot paths
+EMPTY_TILE = TileType.EMPTY.value
+WALL_TILE = TileType.WALL.value
+
+
+class TileGrid:
+    """ The tiles of a field, stored as numpy arrays indexed [x, y]: tile type, sprite id, the kind of the
+        content (EntityType value or NO_CONTENT) and the content itself, as ID into the game's EntityStore or
+        NO_ENTITY. grid[x, y] returns a Tile view for code that prefers objects.
+        Passability is a bitmap updated whenever a tile's type or content changes. It is a flat bytearray
+        indexed x * height + y, because indexing it is much faster than indexing a numpy array.
+        passable_map() views the same memory as a numpy array.
+        The number of explosions on each tile is counted the same way, so finding out whether a
+        bomb or player is caught in an explosion does not depend on the size of the blast.
+        The rays a blast walks along are computed once per tile and kept until the field changes.
+    """
+    def __init__(self, width: int, height: int, entities: EntityStore):
+        """ :param entities: the store of the entities the tiles refer to """
+        self.width = width
+        self.height = height
+        self.entities = entities
+        self.types = np.full((width, height), TileType.EMPTY.value, dtype=np.uint8)
+        self.sprite_ids = np.zeros((width, height), dtype=np.uint16)
+        self.content_kinds = np.full((width, height), NO_CONTENT, dtype=np.int8)
+        self.contents = np.full((width, height), NO_ENTITY, dtype=np.int32)
+        self.passable = bytearray(b"\x01") * (width * height)
+        self.explosion_counts = [0] * (width * height)  # indexed x * height + y
+        self.blast_ray_cache = {}  # (x, y) -> blast_rays(x, y)
+
+    def __getitem__(self, position: Tuple[int, int]) -> "Tile":
+        x, y = position
+        return Tile(self, x % self.width, y % self.height)
+
+    def set_tile(self, x: int, y: int, type: TileType, sprite_id: int) -> None:
+        x, y = x % self.width, y % self.height  # the field is built with negative coordinates for the far walls
+        self.types[x, y] = type.value
+        self.sprite_ids[x, y] = sprite_id
+        self.update_passable(x, y)
+        if self.blast_ray_cache:
+            self.blast_ray_cache = {}
+
+    def get_type(self, x: int, y: int) -> TileType:
+        return TileType(self.types[x, y])
+
+    def has_content(self, x: int, y: int) -> bool:
+        return self.content_kinds[x, y] != NO_CONTENT
+
+    def get_content(self, x: int, y: int) -> int:
+        """ :returns: the entity ID of the tile's content, NO_ENTITY if it has none """
+        return self.contents.item(x, y)
+
+    def type_is(self, x: int, y: int, type_value: int) -> bool:
+        """ :param type_value: TileType value, e.g. EMPTY_TILE """
+        return self.types[x, y] == type_value
+
+    def content_is(self, x: int, y: int, kind: int) -> bool:
+        """ :param kind: EntityType value, e.g. BOX_KIND """
+        return self.content_kinds[x, y] == kind
+
+    def set_content(self, x: int, y: int, entity: int) -> None:
+        """ :param entity: entity ID of the new content, NO_ENTITY to clear the tile.
+                           A replaced entity stays in the EntityStore, remove it there
+        """
+        position = x, y
+        self.contents[position] = entity
+        kind = NO_CONTENT if entity == NO_ENTITY else self.entities.kinds[entity]
+        self.content_kinds[position] = kind
+        self.passable[x * self.height + y] = self.types.item(position) != WALL_TILE and kind not in BLOCKING_KINDS
+
+    def update_passable(self, x: int, y: int) -> None:
+        self.passable[x * self.height + y] = self.types.item(x, y) != WALL_TILE \
+            and self.content_kinds.item(x, y) not in BLOCKING_KINDS
+
+    def set_field(self, types: bytes, sprite_ids: bytes) -> None:
+        """ Sets the types and sprite ids of all tiles at once
+            :param types: as packed by self.types.tobytes()
+            :param sprite_ids: as packed by self.sprite_ids.tobytes()
+        """
+        if types != self.types.tobytes():
+            self.types[:] = np.frombuffer(types, dtype=np.uint8).reshape(self.width, self.height)
+            self.blast_ray_cache = {}
+        self.sprite_ids[:] = np.frombuffer(sprite_ids, dtype=np.uint16).reshape(self.width, self.height)
+        self.clear_contents()
+
+    def clear_contents(self) -> None:
+        """ Removes the content and the explosions of all tiles """
+        self.contents.fill(NO_ENTITY)
+        self.content_kinds.fill(NO_CONTENT)
+        self.passable[:] = (self.types != WALL_TILE).tobytes()
+        self.explosion_counts = [0] * (self.width * self.height)
+
+    def set_contents(self, contents: bytes) -> None:
+        """ Sets the content of all tiles at once, e.g. after the EntityStore was restored
+            :param contents: as packed by self.contents.tobytes()
+        """
+        self.contents[:] = np.frombuffer(contents, dtype=np.int32).reshape(self.width, self.height)
+        self.content_kinds[:] = self.kinds_of_contents()
+        self.passable[:] = self.traversable().tobytes()
+
+    def kinds_of_contents(self) -> np.ndarray:
+        """ :returns: per tile [x, y] the kind of its content, looked up in the EntityStore """
+        # the appended kind is the one of NO_ENTITY, which indexes the last item
+        kinds = np.array(self.entities.kinds.tolist() + [NO_CONTENT], dtype=np.int8)
+        return kinds[self.contents]
+
+    def traversable(self) -> np.ndarray:
+        """ :returns: per tile [x, y] whether players may traverse it, computed from the tile arrays """
+        return (self.types != WALL_TILE) & ~np.isin(self.content_kinds, list(BLOCKING_KINDS))
+
+    def is_passable(self, x: int, y: int) -> bool:
+        """ :returns: True if the player may traverse this tile """
+        return bool(self.passable[x * self.height + y])
+
+    def passable_map(self) -> np.ndarray:
+        """ :returns: the passability bitmap as a bool array indexed [x, y]. Shares memory with the bitmap """
+        return np.frombuffer(self.passable, dtype=bool).reshape(self.width, self.height)
+
+    def check_passable(self) -> None:
+        """ Debug check that the passability bitmap matches the tiles
+            :raises AssertionError: naming the tiles whose bit is wrong
+        """
+        wrong = np.argwhere(self.kinds_of_contents() != self.content_kinds).tolist()
+        assert not wrong, "content kinds do not match the entities at tiles " + str(wrong)
+        wrong = np.argwhere(self.traversable() != self.passable_map()).tolist()
+        assert not wrong, "passability bitmap is wrong at tiles " + str(wrong)
+
+    def add_explosion(self, x: int, y: int) -> None:
+        self.explosion_counts[x * self.height + y] += 1
+
+    def remove_explosion(self, x: int, y: int) -> None:
+        self.explosion_counts[x * self.height + y] -= 1
+
+    def has_explosion(self, x: int, y: int) -> bool:
+        return self.explosion_counts[x * self.height + y] > 0
+
+    def blast_rays(self, x: int, y: int) -> tuple:
+        """ :returns: one (tiles, ends_at_wall) ray per direction of BLAST_DIRECTIONS. The tiles are (x, y) itself,
+                      then the empty tiles up to the first wall, then that wall, in which case ends_at_wall is True
+        """
+        if not self.blast_ray_cache:
+            self.cache_blast_rays()
+        return self.blast_ray_cache[(x, y)]
+
+    def cache_blast_rays(self) -> None:
+        """ Computes the blast rays of all tiles at once, see blast_rays() """
+        types = self.types.tolist()
+        rays = {}
+        for dx, dy in BLAST_DIRECTIONS:
+            # walk against the direction, so each tile's ray extends the ray of the tile after it
+            xs = range(self.width - 1, -1, -1) if dx > 0 else range(self.width)
+            ys = range(self.height - 1, -1, -1) if dy > 0 else range(self.height)
+            following = {}
+            for x in xs:
+                for y in ys:
+                    if types[x][y] != EMPTY_TILE:
+                        ray = following[(x, y)] = (((x, y),), True)
+                    else:
+                        tiles, ends_at_wall = following.get((x + dx, y + dy), ((), False))
+                        ray = following[(x, y)] = (((x, y),) + tiles, ends_at_wall)
+                    rays.setdefault((x, y), []).append(ray)
+        self.blast_ray_cache = {position: tuple(position_rays) for position, position_rays in rays.items()}
+
+    def positions_of(self, kind: EntityType) -> List[Tuple[int, int]]:
+        """ :returns: the positions of all tiles holding content of this kind """
+        return [tuple(position) for position in np.argwhere(self.content_kinds == kind.value).tolist()]
+
+    def field_data(self) -> list:
+        """ :returns: [x][y] -> [tile type value, sprite id], as sent in MAP_DATA """
+        return np.stack((self.types, self.sprite_ids), axis=-1).tolist()
+
+
 class Tile:
-    def __init__(self, type: TileType, sprite_id, x, y):
-        self.type = type
-        self.sprite_id = sprite_id
+    """ View of one tile of a TileGrid """
+    __slots__ = ("grid", "x", "y")
+
+    def __init__(self, grid: TileGrid, x: int, y: int):
+        self.grid = grid
         self.x = x
         self.y = y
-        self.content: Union[Entity,None] = None
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, Tile) and self.grid is other.grid and (self.x, self.y) == (other.x, other.y)
+
+    @property
+    def type(self) -> TileType:
+        return self.grid.get_type(self.x, self.y)
+
+    @property
+    def sprite_id(self) -> int:
+        return int(self.grid.sprite_ids[self.x, self.y])
 
     def has_content(self):
-        return self.content != None
+        return self.grid.has_content(self.x, self.y)
 
     def get_content(self):
-        return self.content
+        return self.grid.get_content(self.x, self.y)
 
-    def set_content(self, content: Union[Entity,None]):
-        self.content = content
+    def set_content(self, entity: int):
+        self.grid.set_content(self.x, self.y, entity)
 
     def get_origin(self) -> Tuple[int, int]:
         return self.x, self.y
@@ -33,7 +225,42 @@ class Tile:
 
     def is_passable(self) -> bool:
         """ :returns: True if the player may traverse this tile """
-        if self.type in [TileType.WALL]: return False
-        if self.has_content():
-            return self.get_content().is_traversable()
-        return True
+        return self.grid.is_passable(self.x, self.y)
+
+
+class FieldHistory:
+    """ The last tile changes of a field. Every change creates a new field version,
+        so a client that knows some version can be patched to the current one.
+    """
+    def __init__(self, version: int = 0, max_len: int = FIELD_HISTORY_LEN):
+        self.version = version
+        self.changes = deque(maxlen=max_len)  # (version, x, y, tile type value, sprite_id)
+
+    def record(self, x: int, y: int, type: TileType, sprite_id) -> int:
+        """ :returns: the new field version """
+        self.add((self.version + 1, x, y, type.value, sprite_id))
+        return self.version
+
+    def add(self, change: tuple) -> None:
+        """ Adds a change recorded by another FieldHistory """
+        self.version = change[0]
+        self.changes.append(change)
+
+    def reset(self, version: int) -> None:
+        """ Forgets all changes, e.g. after receiving a full field of the given version """
+        self.version = version
+        self.changes.clear()
+
+    def changes_since(self, version: int) -> Optional[List[tuple]]:
+        """ :returns: the changes from version to the current version, or None if some of them are forgotten """
+        if version == self.version:
+            return []
+        if version > self.version or not self.changes or self.changes[0][0] > version + 1:
+            return None
+        return [change for change in self.changes if change[0] > version]
+
+    @staticmethod
+    def to_events(changes: List[tuple]) -> list:
+        """ :returns: the changes as encoded FIELD_CHANGED GameEvents """
+        return [(EventType.FIELD_CHANGED.value, {"x": x, "y": y, "t": type, "s": sprite_id})
+                for _, x, y, type, sprite_id in changes]
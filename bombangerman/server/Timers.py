@@ -0,0 +1,109 @@
+import heapq
+from typing import Iterable, List
+
+from Entities import NO_TIMER
+
+ENTITY_BITS = 24  # bit fields of an EntityTimerQueue heap entry: fire tick, sequence number, entity ID
+SEQ_BITS = 40
+ENTITY_MASK = (1 << ENTITY_BITS) - 1
+SEQ_MASK = (1 << SEQ_BITS) - 1
+FIRE_TICK_SHIFT = ENTITY_BITS + SEQ_BITS
+
+
+class TimerQueue:
+    """ Expiry heap of entities keyed on the absolute game tick they are due at.
+        Each tick only the entities due then are popped, so the cost of a tick grows with the
+        number of timers that fire, not with the number of live entities.
+        An entity is due at entity.fire_tick. Entities due at the same tick are popped in the
+        order they were first scheduled, which is the order the game spawned them in.
+        Schedules objects such as the spike traps, the entities of the EntityStore have an EntityTimerQueue.
+    """
+    def __init__(self):
+        self.heap = []  # (fire tick, sequence number, entity)
+        self.next_seq = 0
+
+    def __len__(self) -> int:
+        return len(self.heap)
+
+    def schedule(self, entity, fire_tick: int) -> None:
+        """ Schedules the entity, replacing its previous fire tick if it had one """
+        seq = getattr(entity, "timer_seq", None)
+        if seq is None:
+            seq = entity.timer_seq = self.next_seq
+            self.next_seq += 1
+        entity.fire_tick = fire_tick
+        heapq.heappush(self.heap, (fire_tick, seq, entity))
+
+    @staticmethod
+    def cancel(entity) -> None:
+        """ The entity's heap entry is dropped once it comes up """
+        entity.fire_tick = None
+
+    def pop_due(self, now: int) -> List:
+        """ :returns: the entities due at or before tick now, in the order they fire """
+        heap = self.heap
+        due = []
+        while heap and heap[0][0] <= now:
+            fire_tick, _, entity = heapq.heappop(heap)
+            if entity.fire_tick == fire_tick:  # not cancelled or rescheduled since
+                entity.fire_tick = None
+                due.append(entity)
+        return due
+
+    def restore(self, entities: Iterable, next_seq: int) -> None:
+        """ Replaces the schedule with the entities, due at their fire_tick in the order of their timer_seq.
+            Entities without a fire_tick are left out. For Game.restore(), which sets both on every entity
+        """
+        # a sorted list is a valid heap. Sequence numbers are unique, so entities are never compared
+        self.heap = sorted((entity.fire_tick, entity.timer_seq, entity) for entity in entities
+                           if entity.fire_tick is not None)
+        self.next_seq = next_seq
+
+
+class EntityTimerQueue:
+    """ TimerQueue of the entities of an Entities.EntityStore, by entity ID. An entity is due at its row of the
+        store's fire_ticks column and entities due at the same tick pop in the order of their timer_seqs.
+        A heap entry is one int with fire tick, sequence number and entity ID in its bit fields, which sorts the
+        same as a (fire tick, sequence number, entity ID) tuple in a fraction of the memory.
+    """
+    def __init__(self, entities):
+        """ :param entities: the EntityStore of the game """
+        self.entities = entities
+        self.heap = []  # fire tick << FIRE_TICK_SHIFT | sequence number << ENTITY_BITS | entity ID
+
+    def __len__(self) -> int:
+        return len(self.heap)
+
+    def schedule(self, entity: int, fire_tick: int) -> None:
+        """ Schedules the entity, replacing its previous fire tick if it had one """
+        entities = self.entities
+        entities.fire_ticks[entity] = fire_tick
+        heapq.heappush(self.heap, fire_tick << FIRE_TICK_SHIFT | entities.timer_seqs[entity] << ENTITY_BITS | entity)
+
+    def cancel(self, entity: int) -> None:
+        """ The entity's heap entry is dropped once it comes up """
+        self.entities.fire_ticks[entity] = NO_TIMER
+
+    def pop_due(self, now: int) -> List[int]:
+        """ :returns: the IDs of the entities due at or before tick now, in the order they fire """
+        heap = self.heap
+        fire_ticks = self.entities.fire_ticks
+        timer_seqs = self.entities.timer_seqs
+        end = (now + 1) << FIRE_TICK_SHIFT
+        due = []
+        while heap and heap[0] < end:
+            timer = heapq.heappop(heap)
+            entity = timer & ENTITY_MASK
+            # not cancelled or rescheduled since, and the row was not freed and reused by another entity
+            if fire_ticks[entity] == timer >> FIRE_TICK_SHIFT and timer_seqs[entity] == timer >> ENTITY_BITS & SEQ_MASK:
+                fire_ticks[entity] = NO_TIMER
+                due.append(entity)
+        return due
+
+    def restore(self, entities: Iterable[int]) -> None:
+        """ Replaces the schedule with the entities at the fire ticks of their rows. For Game.restore() """
+        fire_ticks = self.entities.fire_ticks
+        timer_seqs = self.entities.timer_seqs
+        # a sorted list is a valid heap
+        self.heap = sorted(fire_ticks[entity] << FIRE_TICK_SHIFT | timer_seqs[entity] << ENTITY_BITS | entity
+                           for entity in entities if fire_ticks[entity] != NO_TIMER)